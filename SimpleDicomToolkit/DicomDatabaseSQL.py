@@ -8,7 +8,9 @@ import os
 import json
 import warnings
 import logging
+import numbers
 import pydicom
+import numpy as np
 
 
 import SimpleITK as sitk
@@ -28,12 +30,19 @@ class Database(sdtk.Logger):
     _image          = None # cache single image
     _headers        = None # cache list of headers
     _tagnames       = None # cache for tagnames in current selection
+    _summary        = None # cache for counts and size of current selection
     _MAX_FILES       = 5000 # max number of files to be read by property images
+    _BATCH_SIZE      = 1000 # number of rows fetched at once by iter_ methods
     _sort_slices_by  = None # Dicom field name to sort slices by field value
+    watcher          = None # DatabaseWatcher started by watch()
+    _preview_cache   = None # PreviewCache created by preview_cache
+    _PREVIEW_FOLDER  = '.previews' # suffix of the preview cache folder
+    _shared          = None # SharedCache of a DatabaseRegistry
     #_LOG_LEVEL = logging.DEBUG
     
     def __init__(self, path, force_rebuild=False, scan=True, silent=False,
-                 SUV=True, in_memory=False, use_private_tags=False):
+                 SUV=True, in_memory=False, use_private_tags=False,
+                 builder=None, **kwargs):
         """ 
         Create a dicom database from path
 
@@ -45,8 +54,12 @@ class Database(sdtk.Logger):
                        database in memory.
         use_private_tags: Set to True to include private tags in the database.
                           [Experimental]
-            
+        builder:       use an existing DatabaseBuilder for path, the database
+                       is not opened or scanned again.
 
+        Additional keyword arguments are passed to DatabaseBuilder, e.g.
+        journal_mode='WAL' to read the database from other processes while
+        files are added.
         """
         if silent:
             self._LOG_LEVEL = logging.ERROR
@@ -56,15 +69,17 @@ class Database(sdtk.Logger):
         
         
 
-        self.builder = DatabaseBuilder(path=path, scan=scan,
-                                       force_rebuild=force_rebuild,
-                                       in_memory=in_memory,
-                                       use_private_tags=use_private_tags,
-                                       silent=silent)
-
-        self.logger.info('Database building completed')
+        if builder is None:
+            builder = DatabaseBuilder(path=path, scan=scan,
+                                      force_rebuild=force_rebuild,
+                                      in_memory=in_memory,
+                                      use_private_tags=use_private_tags,
+                                      silent=silent, **kwargs)
+            self.logger.info('Database building completed')
+        self.builder = builder
 
         self.database = self.builder.database
+        self.codec = self.builder.codec # value codec used by the database
 
         self.SUV = SUV
         self._selection = {}
@@ -81,7 +96,11 @@ class Database(sdtk.Logger):
 
     def __getattr__(self, attr):
         # enable dicom tags as attributes (default pydicom behaviour)
-        if attr in self.tag_names:
+        if attr.startswith('_') or 'builder' not in self.__dict__:
+            # private attributes and attributes accessed during init
+            raise AttributeError(attr)
+
+        if self.has_tag(attr):
             values = self.get_column(attr, parse=True)
 
             if len(values) == 1:
@@ -111,24 +130,27 @@ class Database(sdtk.Logger):
         else:
             header = 'Database contents:'
 
-        mbytes = self.database.sum_column(self.builder.MAIN_TABLE,
-                                          self.builder.FILE_SIZE_COL,
-                                          **self._selection)
-        mbytes = 0 if mbytes is None else mbytes/1e6
+        summary = self.summary
 
         msg = msg.format(header=header,
                          selection=selection,
-                         npatients=self.patient_count,
-                         nstudies=self.study_count,
-                         nseries=self.series_count,
-                         ninstances=self.instance_count,
-                         mbytes=round(mbytes))
+                         npatients=summary[DatabaseBuilder.PATIENTS],
+                         nstudies=summary[DatabaseBuilder.STUDIES],
+                         nseries=summary[DatabaseBuilder.SERIES],
+                         ninstances=summary[DatabaseBuilder.INSTANCES],
+                         mbytes=round(summary[DatabaseBuilder.BYTES]/1e6))
 
         return msg
 
     def __repr__(self):
         return self.__str__()
 
+    @property
+    def _query_selection(self):
+        # selection for queries, tags in the tag value table are selected
+        # with a subquery
+        return self.builder.query_selection(self._selection)
+
     @property
     def selection(self):
         # decode values for presentation
@@ -137,7 +159,8 @@ class Database(sdtk.Logger):
             if key in self.non_tag_columns:
                 selection[key] = value
             else:
-                selection[key] = sdtk.Decoder.decode_entry(key, value)[0]
+                selection[key] = sdtk.Decoder.decode_entry(
+                    key, value, codec=self.codec)[0]
         return selection
 
     @property
@@ -161,13 +184,15 @@ class Database(sdtk.Logger):
     @property
     def columns(self):
         """ Return all column names in database. """
-        return self.database.column_names(self.builder.MAIN_TABLE, close=True)
+        return self._cached('columns', lambda: self.database.column_names(
+            self.builder.MAIN_TABLE, close=True))
 
     @property
     def non_tag_columns(self):
         """ Return column names that are not dicom tagnames """
         return (self.builder.FILENAME_COL,
                 self.builder.FILE_SIZE_COL,
+                self.builder.ID_COL,
                 sdtk.SQLiteWrapper.ROWID,
                 self.builder.TAGNAMES_COL)
 
@@ -175,7 +200,8 @@ class Database(sdtk.Logger):
     def tag_names(self):
         """ Return the tag names that are in the database """
         if self._tagnames is None:
-            self._tagnames = self._get_tagnames() # use caching
+            # use caching
+            self._tagnames = self._cached('tag_names', self._get_tagnames)
         return self._tagnames
 
     @property
@@ -193,37 +219,45 @@ class Database(sdtk.Logger):
             self._headers = []
             return self.headers
 
-        headers = []
-        uids = self.SOPInstanceUID
-
-        if not isinstance(uids, list):
-            uids = [uids]
-
-        headers = [self.header_for_uid(uid) for uid in uids]
+        headers = list(self.iter_headers(sort_by=sdtk.SOPINSTANCEUID))
 
         self._headers = headers
 
         return self._headers
 
+    @property
+    def summary(self):
+        """ Return a dictionary with the number of patients, studies, series
+        and instances and the total file size in bytes of the current
+        selection. Without selection the summary stored in the database is
+        returned, otherwise it is computed in a single query. """
+        if self._summary is None:
+            if self._selection:
+                self._summary = self.builder.compute_summary(
+                    **self._query_selection)
+            else:
+                self._summary = self.builder.summary
+        return self._summary
+
     @property
     def series_count(self):
         """ Return number of series in database """
-        return self._count_tag('SeriesInstanceUID')
+        return self.summary[DatabaseBuilder.SERIES]
 
     @property
     def study_count(self):
         """ Return number of studies in database """
-        return self._count_tag('StudyInstanceUID')
+        return self.summary[DatabaseBuilder.STUDIES]
 
     @property
     def patient_count(self):
         """ Return number of patients in database """
-        return self._count_tag('PatientID')
+        return self.summary[DatabaseBuilder.PATIENTS]
 
     @property
     def instance_count(self):
         """ Return number of instances in database, equal to number of files"""
-        return self._count_tag('SOPInstanceUID')
+        return self.summary[DatabaseBuilder.INSTANCES]
 
     @property
     def image(self):
@@ -231,10 +265,31 @@ class Database(sdtk.Logger):
             All files must belong to the same dicom series
             (same SeriesInstanceUID). """
 
-        if self._image is not None:
-            return self._image
+        if self._image is None:
+            image = self._cached('image', self._read_image)
+            if self._shared is not None:
+                # cached images are shared with other databases, a copy
+                # (copy on write) protects them against changes by callers
+                image = self._copy_image(image)
+            self._image = image
+        return self._image
 
-        assert hasattr(self, 'SeriesInstanceUID')
+    @staticmethod
+    def _copy_image(image):
+        # copy of an image that shares the pixel buffer until one of the
+        # images is changed
+        copy = sitk.Image(image)
+        if hasattr(image, 'bqml_to_suv'):
+            copy.bqml_to_suv = image.bqml_to_suv
+        return copy
+
+    def _read_image(self):
+        # read the image of the selected series, without caching it
+        # read full headers of files that were indexed from a DICOMDIR
+        if self.builder.parse_pending(files=self.files):
+            self._reset_cache()
+
+        assert self.has_tag(sdtk.SERIESINSTANCEUID)
         assert isinstance(self.SeriesInstanceUID, str)
 
         image = sdtk.dicom_reader.read_serie(self.sorted_files, SUV=False,
@@ -260,8 +315,7 @@ class Database(sdtk.Logger):
         if self.SUV and bqml_to_suv != 1:
             image *= bqml_to_suv
             image.bqml_to_suv = bqml_to_suv
-        self._image = image
-        return self._image
+        return image
 
     @property
     def images(self):
@@ -277,7 +331,7 @@ class Database(sdtk.Logger):
         if self._images is not None:
             return self._images
 
-        assert hasattr(self, sdtk.SERIESINSTANCEUID)
+        assert self.has_tag(sdtk.SERIESINSTANCEUID)
 
         images = {}
         selection = self.selection.copy()
@@ -300,13 +354,309 @@ class Database(sdtk.Logger):
         return dict([(key, sitk.GetArrayFromImage(image)) \
                      for key, image in self.images.items()])
 
+    @property
+    def array_view(self):
+        """ Return a read-only numpy view on the pixel data of image, without
+        copying. See get_array. """
+        return self.get_array()
+
+    def get_array(self, view=True, keep_image=True):
+        """ Return a numpy array for the selected series.
+
+        view:       return a read-only view on the pixel buffer of the sitk
+                    image instead of a copy (array property). The view holds
+                    a reference to the image, the pixel data stays valid after
+                    the image cache is cleared (select, reset) and is freed
+                    when the cache and all views are gone.
+        keep_image: store the image in the cache of the image property. Use
+                    False to read large series once: with view the returned
+                    array is the only owner of the pixel data, without view
+                    the image is released after copying.
+
+        Memory used: array property and view=False, keep_image=True keep two
+        copies (image and array), all other combinations keep one copy.
+        """
+        if keep_image or self._image is not None:
+            image = self.image
+        else:
+            image = self._read_image()
+
+        if view:
+            return sdtk.dicom_reader.array_view(image)
+        return sitk.GetArrayFromImage(image)
+
+    def get_arrays(self, view=True, keep_images=True):
+        """ Return a dictionary with key the SeriesInstanceUID and value the
+        numpy array of the series, see get_array for view and keep_images """
+        if keep_images or self._images is not None:
+            return {uid: sdtk.dicom_reader.array_view(image) if view \
+                    else sitk.GetArrayFromImage(image) \
+                    for uid, image in self.images.items()}
+
+        if len(self.files) > self._MAX_FILES:
+            raise IOError('Number of files exceeds MAX_FILES property')
+        assert self.has_tag(sdtk.SERIESINSTANCEUID)
+
+        arrays = {}
+        selection = self.selection.copy()
+        for uid in self.get_column(sdtk.SERIESINSTANCEUID):
+            self.select(SeriesInstanceUID=uid)
+            arrays[uid] = self.get_array(view=view, keep_image=False)
+            self.reset().select(**selection)
+        return arrays
+
+    def read_region(self, z_range=None, roi=None):
+        """ Return an sitk image with a region of the selected series.
+        z_range (start, stop) selects slices in the order of sorted_files
+        (frames for a single multi frame file) like a python slice and roi
+        (x0, y0, x1, y1) selects the in-plane window in pixels. Only the files
+        of the selected slices are read, origin and spacing are set for the
+        region. Values are rescaled (and converted to SUV) as for image. """
+        # read full headers of files that were indexed from a DICOMDIR
+        if self.builder.parse_pending(files=self.files):
+            self._reset_cache()
+
+        assert self.has_tag(sdtk.SERIESINSTANCEUID)
+        uid = self.SeriesInstanceUID
+        assert isinstance(uid, str)
+
+        columns = [self.builder.FILENAME_COL, sdtk.SOPINSTANCEUID,
+                   sdtk.IMAGEPOSITIONPATIENT]
+        table = self.to_table(columns=columns, sort_by=self.sort_slices_by,
+                              sort_decimal=True, pandas=False)
+
+        files = [os.path.join(self.builder.path, file.replace('\\', '/')) \
+                 for file in table[self.builder.FILENAME_COL]]
+        z_start, z_stop, _ = slice(*(z_range or (None,))).indices(len(files))
+        slice_spacing = self._slice_spacing(
+            table[sdtk.IMAGEPOSITIONPATIENT], z_start, z_stop)
+
+        image = sdtk.dicom_reader.read_region(files, z_range=z_range, roi=roi,
+                                              slice_spacing=slice_spacing)
+
+        first = z_start if len(files) > 1 else 0
+        header = self.header_for_uid(table[sdtk.SOPINSTANCEUID][first])
+        slope, intercept = sdtk.dicom_reader.rescale_values(header)
+        image *= slope
+        image += intercept
+
+        if self.SUV:
+            bqml_to_suv = self.suv_scale_factors().get(uid, 1)
+            if np.isfinite(bqml_to_suv) and bqml_to_suv != 1:
+                image *= bqml_to_suv
+                image.bqml_to_suv = bqml_to_suv
+        return image
+
+    def mapped_array(self, rescale=True):
+        """ Return a numpy array for the selected series, read from memory
+        mapped files at the pixel data offsets stored in the database.
+        Headers are not parsed. Only works for files with uncompressed pixel
+        data that were indexed by this version, raises a ValueError otherwise.
+        With rescale values are rescaled with the rescale slope and intercept
+        of each file (and converted to SUV) as for array, otherwise the stored
+        pixel values are returned. MONOCHROME1 images are not inverted and
+        rescale values in functional groups are not used. """
+        rows, records = self._pixel_records()
+        array = sdtk.dicom_reader.read_mapped(records)
+        if not rescale:
+            return array
+        array = self._rescale_files(array, rows, records)
+        return self._scale_series(array, rows[0][sdtk.SOPINSTANCEUID])
+
+    def decoded_array(self, workers=None):
+        """ Return a numpy array for the selected series. Compressed pixel
+        data (JPEG, JPEG 2000, RLE, detected from the transfer syntax stored
+        in the database) is decoded by a pool of workers processes, slices or
+        the frames of a single multi frame file are decoded in parallel.
+        Uncompressed pixel data is read as by mapped_array. Values are
+        rescaled (and converted to SUV) as for array. """
+        rows, records = self._pixel_records()
+        uncompressed = sdtk.dicom_reader.UNCOMPRESSED_TRANSFER_SYNTAXES
+        if all(record.transfer_syntax in uncompressed for record in records):
+            array = sdtk.dicom_reader.read_mapped(records)
+            array = self._rescale_files(array, rows, records)
+        else:
+            array = sdtk.dicom_reader.read_decoded(records, workers=workers)
+        return self._scale_series(array, rows[0][sdtk.SOPINSTANCEUID])
+
+    def _pixel_records(self):
+        # rows with file id, SOPInstanceUID and rescale values and the pixel
+        # data record of each file of the selected series, sorted
+        assert self.has_tag(sdtk.SERIESINSTANCEUID)
+        assert isinstance(self.SeriesInstanceUID, str)
+
+        file_id = self.builder.ID_COL
+        rescale_tags = [tag for tag in (sdtk.RESCALESLOPE,
+                                        sdtk.RESCALEINTERCEPT) \
+                        if tag in self.columns]
+        rows = list(self.iter_rows(columns=[file_id, sdtk.SOPINSTANCEUID] + \
+                                   rescale_tags,
+                                   sort_by=self.sort_slices_by,
+                                   sort_decimal=True))
+
+        selection = self.database._select_statement(self.builder.MAIN_TABLE,
+                                                    column_names=[file_id],
+                                                    **self._query_selection)
+        pixel_data = self.builder.get_pixel_data(
+            sdtk.SQLiteWrapper.Subquery(*selection))
+
+        records = []
+        for row in rows:
+            if row[file_id] not in pixel_data:
+                msg = 'No pixel data index for {0}, rebuild the database'
+                raise ValueError(msg.format(row[sdtk.SOPINSTANCEUID]))
+            record = pixel_data[row[file_id]]
+            file = os.path.join(self.builder.path,
+                                record.file.replace('\\', '/'))
+            records.append(record._replace(file=file))
+        return rows, records
+
+    @staticmethod
+    def _rescale_files(array, rows, records):
+        # rescale each file with its own slope and intercept
+        slopes, intercepts = [], []
+        for row, record in zip(rows, records):
+            frames = record.frames or 1
+            slope = row.get(sdtk.RESCALESLOPE)
+            intercept = row.get(sdtk.RESCALEINTERCEPT)
+            slopes += [1 if slope is None else slope] * frames
+            intercepts += [0 if intercept is None else intercept] * frames
+        array = array * np.array(slopes, dtype=np.float64)[:, None, None]
+        array += np.array(intercepts, dtype=np.float64)[:, None, None]
+        return array
+
+    def _scale_series(self, array, sopinstanceuid):
+        # apply real world value mapping and SUV of the series as read_serie
+        # and image do
+        header = self.header_for_uid(sopinstanceuid)
+        slope, intercept = sdtk.dicom_reader.rescale_values(header)
+        if (slope, intercept) != (1, 0):
+            array *= slope
+            array += intercept
+
+        if self.SUV:
+            uid = header.SeriesInstanceUID
+            bqml_to_suv = self.suv_scale_factors().get(uid, 1)
+            if np.isfinite(bqml_to_suv) and bqml_to_suv != 1:
+                array *= bqml_to_suv
+        return array
+
+    @staticmethod
+    def _slice_spacing(positions, z_start, z_stop):
+        # distance between the slices in z_range from the positions of the
+        # sorted slices, None if positions are missing
+        if len(positions) < 2 or any(position is None \
+                                     for position in positions):
+            return None
+        if z_stop - z_start < 2:
+            # single slice, use the distance to a neighbour
+            z_start = min(z_start, len(positions) - 2)
+            z_stop = z_start + 2
+        first = np.asarray(positions[z_start], dtype=np.float64)
+        last = np.asarray(positions[z_stop - 1], dtype=np.float64)
+        spacing = np.linalg.norm(last - first) / (z_stop - z_start - 1)
+        return float(spacing) if spacing > 0 else None
+
+    @property
+    def preview_cache(self):
+        """ PreviewCache with the previews of series, stored in a folder next
+        to the database file (in memory for in memory databases) """
+        if self._preview_cache is None:
+            folder = None
+            if self.builder.database_file != sdtk.SQLiteWrapper.IN_MEMORY:
+                folder = self.builder.database_file + self._PREVIEW_FOLDER
+            self._preview_cache = sdtk.PreviewCache(folder)
+        return self._preview_cache
+
+    def preview(self, level=1):
+        """ Return a downsampled numpy array of the selected series. Levels
+        1, 2 and 3 are downsampled 2, 4 and 8 times, level 'mip' returns a
+        maximum intensity projection thumbnail. Previews are built once and
+        rebuilt only when the files of the series change. """
+        assert self.has_tag(sdtk.SERIESINSTANCEUID)
+        uid = self.SeriesInstanceUID
+        assert isinstance(uid, str)
+
+        job = self._preview_jobs()[uid]
+        if not self.preview_cache.has(uid, job[-1]):
+            self.preview_cache.build({uid: job}, workers=1)
+
+        preview = self.preview_cache.get(uid, job[-1], level=level)
+        if preview is None:
+            raise IOError('Cannot read series {0}'.format(uid))
+        return preview
+
+    def build_previews(self, workers=None, rebuild=False):
+        """ Build the previews of all series in the current selection that
+        are not in the preview cache or are outdated. Series are read by a
+        pool of worker processes. Returns the number of series built. """
+        jobs = self._preview_jobs()
+        if not rebuild:
+            jobs = {uid: job for uid, job in jobs.items() \
+                    if not self.preview_cache.has(uid, job[-1])}
+
+        self.logger.info('Building previews for %s series', len(jobs))
+        self.preview_cache.build(jobs, workers=workers)
+        return len(jobs)
+
+    def _preview_jobs(self):
+        # sorted files, SUV scale and signature for each selected series
+        if self.builder.parse_pending(files=self.files):
+            self._reset_cache()
+
+        factors = self.suv_scale_factors() if self.SUV else {}
+
+        jobs = {}
+        for uid, files in self._series_files().items():
+            files = [os.path.join(self.builder.path, file) for file in files]
+            scale = factors.get(uid, 1)
+            if not np.isfinite(scale):
+                scale = 1 # no SUV information
+            signature = sdtk.PreviewCache.signature(files, scale=scale)
+            jobs[uid] = (files, scale, signature)
+        return jobs
+
+    def _series_files(self):
+        # sorted files of each selected series from a single query, the
+        # selection and sort_slices_by are not changed. Slices are sorted as
+        # by sorted_files, the sort tag is chosen for each series.
+        columns = self.columns
+        if sdtk.SERIESINSTANCEUID not in columns:
+            return {}
+        sort_tags = [tag for tag in (sdtk.SLICELOCATION, sdtk.INSTANCENUMBER) \
+                     if tag in columns]
+        column_names = [sdtk.SERIESINSTANCEUID, self.builder.FILENAME_COL]
+        column_names += ['CAST({0} AS DECIMAL)'.format(tag) \
+                         for tag in sort_tags]
+
+        series = {}
+        for row in self.database.iter_query(self.builder.MAIN_TABLE,
+                                            column_names=column_names,
+                                            **self._query_selection):
+            if row[0] is not None: # files without series are skipped
+                series.setdefault(row[0], []).append(row[1:])
+
+        result = {}
+        for uid, rows in series.items():
+            # first sort tag with values in the series, None sorts first
+            index = next((index for index in range(1, len(sort_tags) + 1) \
+                          if any(row[index] is not None for row in rows)),
+                         None)
+            if index is not None:
+                rows = sorted(rows, key=lambda row: (row[index] is not None,
+                                                     row[index] or 0))
+            uid = sdtk.Decoder.decode_entry(sdtk.SERIESINSTANCEUID, uid,
+                                            codec=self.codec)[0]
+            result[uid] = [row[0].replace('\\', '/') for row in rows]
+        return result
+
     @property
     def sort_slices_by(self):
         if self._sort_slices_by is None:
-            if hasattr(self, 'SliceLocation'):
-                self._sort_slices_by = 'SliceLocation'
-            elif hasattr(self, 'InstanceNumber'):
-                self._sort_slices_by = 'InstanceNumber'
+            if self.has_tag(sdtk.SLICELOCATION):
+                self._sort_slices_by = sdtk.SLICELOCATION
+            elif self.has_tag(sdtk.INSTANCENUMBER):
+                self._sort_slices_by = sdtk.INSTANCENUMBER
         return self._sort_slices_by
 
     @sort_slices_by.setter
@@ -332,7 +682,7 @@ class Database(sdtk.Logger):
                                                self.builder.FILENAME_COL,
                                                sort_by=sort_by,
                                                sort_decimal=True,
-                                               **self._selection)
+                                               **self._query_selection)
 
         files = [file.replace('\\', '/') for file in files]
 
@@ -364,7 +714,7 @@ class Database(sdtk.Logger):
             if tag in self.non_tag_columns:
                 continue
 
-            value = self._encode_value(tag, value)
+            value = self._encode_value(tag, value, codec=self.codec)
             kwargs[tag] = value
 
         self._selection.update(kwargs)
@@ -372,12 +722,44 @@ class Database(sdtk.Logger):
 
         return self
 
+    def watch(self, interval=2, batch_size=100):
+        """ Start a DatabaseWatcher that adds new files and removes deleted
+        files in a background thread. Cached values of this database are
+        cleared after every change. Returns the watcher, use watcher.stop()
+        to stop watching. """
+        if self.builder.memory == self.builder.MEMORY_LOAD:
+            raise ValueError('Databases loaded in memory cannot be watched')
+        if self.watcher is None:
+            builder = self.builder
+            self.watcher = sdtk.DatabaseWatcher(
+                builder.path, database_file=builder.database_file,
+                interval=interval, batch_size=batch_size, **builder.options)
+            self.watcher.subscribe(self._on_database_changed)
+        self.watcher.start()
+        return self.watcher
+
+    def has_tag(self, tag_name):
+        """ Return True if the tag is present in the header of at least one
+        file in the current selection. Use has_tag instead of hasattr, hasattr
+        reads all values of the tag from the database. """
+        if self._tagnames is not None:
+            return tag_name in self._tagnames
+        return self.builder.has_tag(tag_name, **self._query_selection)
+
+    def has_values(self, tag_name):
+        """ Return True if the tag has a value for at least one file in the
+        current selection. """
+        return self.builder.has_values(tag_name, **self._query_selection)
+
     def header_for_uid(self, sopinstanceuid):
         """ Return a pydicom header for the requested sopinstanceuid """
         uid = sdtk.Encoder.encode_value_with_tagname('SOPInstanceUID',
-                                                     sopinstanceuid)
+                                                     sopinstanceuid,
+                                                     codec=self.codec)
 
+        file_id = self.builder.ID_COL
         h_dicts = self.database.get_row_dict(self.builder.MAIN_TABLE,
+                                             column_names=[file_id, '*'],
                                              SOPInstanceUID=uid)
         if not h_dicts:
             msg = 'SOPInstanceUID %s not in database'
@@ -386,9 +768,35 @@ class Database(sdtk.Logger):
             msg = 'SOPInstanceUID {0} not unique'
             raise ValueError(msg.format(uid))
         h_dict = h_dicts[0]
-        h_dict = {tag: h_dict[tag] for tag in self.tag_names}
-
-        return self._decode(h_dict)
+        h_dict.update(self.builder.get_side_row(h_dict[file_id]))
+        # tags that are not in the header of this file are NULL
+        h_dict = {tag: h_dict[tag] for tag in self.tag_names \
+                  if h_dict.get(tag) is not None}
+
+        return self._decode(h_dict, codec=self.codec)
+
+    def duplicate_files(self, with_path=False):
+        """ Return a dictionary with the SOPInstanceUID as key and the other
+        files of the instance as value, for instances in the selection that
+        were found more than once (see the duplicates option). """
+        if self.builder.duplicates is None:
+            return {}
+        selection = self.database._select_statement(
+            self.builder.MAIN_TABLE, column_names=[sdtk.SOPINSTANCEUID],
+            **self._query_selection)
+        duplicates = self.builder.get_duplicates(
+            sdtk.SQLiteWrapper.Subquery(*selection))
+
+        result = {}
+        for uid, files in duplicates.items():
+            uid = sdtk.Decoder.decode_entry(sdtk.SOPINSTANCEUID, uid,
+                                            codec=self.codec)[0]
+            files = [file.replace('\\', '/') for file in files]
+            if with_path:
+                files = [os.path.join(self.builder.path, file) \
+                         for file in files]
+            result[uid] = files
+        return result
 
     def reset(self, tags=None):
         """ After a query a subset of the database is visible, use reset
@@ -413,36 +821,308 @@ class Database(sdtk.Logger):
         else:
             sort_by = None
 
-        values = self.database.get_column(self.builder.MAIN_TABLE,
-                                          column_name, sort_by=sort_by,
-                                          distinct=distinct,
-                                          close=False, **self._selection)
+        if column_name in self.columns or \
+            column_name in self.non_tag_columns:
+            values = self.database.get_column(self.builder.MAIN_TABLE,
+                                              column_name, sort_by=sort_by,
+                                              distinct=distinct, close=False,
+                                              **self._query_selection)
+        else:
+            # tag stored in the tag value table
+            values = self.builder.get_side_values(column_name,
+                                                  distinct=distinct,
+                                                  sort=sort, close=False,
+                                                  **self._query_selection)
 
         self.logger.debug('parising column....')
 
         if parse and column_name not in self.non_tag_columns:
-            values = [sdtk.Decoder.decode_entry(column_name, vi)[0] \
+            values = [sdtk.Decoder.decode_entry(column_name, vi,
+                                                codec=self.codec)[0] \
                       for vi in values]
 
         if close:
             self.database.close()
         return values
 
+    def iter_rows(self, columns=None, parse=True, sort_by=None,
+                  sort_decimal=False, batch_size=None):
+        """ Yield a dictionary with the values of the given columns for each
+        file in the current selection. By default all tag columns are
+        returned. Rows are streamed from the database in batches of batch_size
+        rows, selections of any size can be processed in constant memory. """
+        if columns is None:
+            main_columns = self.columns
+            columns = [tag for tag in self.tag_names if tag in main_columns]
+
+        if batch_size is None:
+            batch_size = self._BATCH_SIZE
+
+        rows = self.database.iter_query(self.builder.MAIN_TABLE,
+                                        column_names=columns, sort_by=sort_by,
+                                        sort_decimal=sort_decimal,
+                                        batch_size=batch_size,
+                                        **self._query_selection)
+
+        for row in rows:
+            row = dict(zip(columns, row))
+            if parse:
+                for column, value in row.items():
+                    if value is None or column in self.non_tag_columns:
+                        continue
+                    row[column] = sdtk.Decoder.decode_entry(
+                        column, value, codec=self.codec)[0]
+            yield row
+
+    def to_table(self, columns=None, sort_by=None, sort_decimal=False,
+                 chunk_size=None, pandas=True, distinct=False):
+        """ Return the values of columns for all files in the current
+        selection in a single query. Returns a pandas DataFrame with one row
+        per file or a numpy structured array if pandas is not installed (or
+        pandas is False). Numeric columns get an integer or float dtype, NULL
+        values in float columns are NaN.
+
+        With chunk_size a generator is returned that yields tables of at most
+        chunk_size rows, for selections that do not fit in memory. Use
+        distinct to return each combination of values only once. """
+        if columns is None:
+            columns = list(self.tag_names)
+
+        # tags in the tag value table are read with a subquery
+        main_columns = self.columns
+        select = [column if column in main_columns \
+                  or column in self.non_tag_columns \
+                  else self.builder.side_column(column) for column in columns]
+
+        rows = self.database.iter_query(self.builder.MAIN_TABLE,
+                                        column_names=select, sort_by=sort_by,
+                                        sort_decimal=sort_decimal,
+                                        distinct=distinct,
+                                        batch_size=chunk_size or \
+                                            self._BATCH_SIZE,
+                                        **self._query_selection)
+
+        if chunk_size is None:
+            return self._make_table(columns, list(rows), pandas=pandas)
+        return self._iter_tables(columns, rows, chunk_size, pandas=pandas)
+
+    def _iter_tables(self, columns, rows, chunk_size, pandas=True):
+        # yield tables with chunk_size rows
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield self._make_table(columns, chunk, pandas=pandas)
+                chunk = []
+        if chunk:
+            yield self._make_table(columns, chunk, pandas=pandas)
+
+    def _make_table(self, columns, rows, pandas=True):
+        # decode rows column wise and convert to a DataFrame or numpy array
+        data = {}
+        for index, column in enumerate(columns):
+            values = [row[index] for row in rows]
+            data[column] = self._column_array(self._decode_column(column,
+                                                                  values))
+        return self._table_from_arrays(columns, data, pandas=pandas)
+
+    @staticmethod
+    def _table_from_arrays(columns, data, pandas=True):
+        # DataFrame or numpy structured array from a dictionary with arrays
+        if pandas:
+            try:
+                import pandas as pd
+            except ImportError:
+                pass
+            else:
+                return pd.DataFrame(data, columns=columns)
+
+        dtype = [(column, data[column].dtype) for column in columns]
+        length = len(data[columns[0]]) if columns else 0
+        table = np.empty(length, dtype=dtype)
+        for column in columns:
+            table[column] = data[column]
+        return table
+
+    def _decode_column(self, column, values):
+        # decode the values of a column, each distinct value is decoded once
+        if column in self.non_tag_columns:
+            return values
+        decoded = {}
+        result = []
+        for value in values:
+            if value is None:
+                result.append(None)
+                continue
+            key = value if not isinstance(value, list) else str(value)
+            if key not in decoded:
+                decoded[key] = sdtk.Decoder.decode_entry(
+                    column, value, codec=self.codec)[0]
+            result.append(decoded[key])
+        return result
+
+    @staticmethod
+    def _column_array(values):
+        # numpy array with an int or float dtype for numeric columns
+        not_null = [value for value in values if value is not None]
+        is_number = lambda value: isinstance(value, numbers.Number) \
+            and not isinstance(value, bool)
+
+        if not_null and all(is_number(value) for value in not_null):
+            if len(not_null) == len(values) and \
+                all(isinstance(value, numbers.Integral) for value in values):
+                return np.array(values, dtype=np.int64)
+            return np.array([np.nan if value is None else value \
+                             for value in values], dtype=np.float64)
+
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+
+    def suv_scale_factors(self):
+        """ Return a dictionary with the SeriesInstanceUID as keys and the SUV
+        scale factor (Bq/cc --> SUV) as values for all series in the current
+        selection. Factors are computed from database values in a single
+        query without reading headers or pixel data. Series without SUV
+        information get NaN. """
+        series = self._suv_series_parameters()
+        factors = sdtk.dicom_reader.suv_scale_factors(
+            series['weight'], series['dose'], series['halflife'],
+            series['delta_time'])
+        return dict(zip(series[sdtk.SERIESINSTANCEUID], factors.tolist()))
+
+    def frame_decay_factors(self, pandas=True):
+        """ Return a table with a row for each file (frame) in the current
+        selection with the SOPInstanceUID, SeriesInstanceUID, the stored
+        FrameReferenceTime (ms), DecayFactor and DecayCorrection and:
+
+        decay:      fraction of the injected activity left at the frame
+                    reference time (series start if FrameReferenceTime is
+                    missing)
+        suv_factor: SUV scale factor for the pixel values of the frame,
+                    following DecayCorrection (START: decay at series start,
+                    ADMIN: no decay, NONE: decay at the frame reference time)
+
+        Computed for all frames at once from database values, without reading
+        headers or pixel data. Returns a pandas DataFrame or a numpy
+        structured array, see to_table. """
+        columns = [sdtk.SOPINSTANCEUID, sdtk.SERIESINSTANCEUID,
+                   sdtk.FRAMEREFERENCETIME, sdtk.DECAYFACTOR,
+                   sdtk.DECAYCORRECTION]
+        frames = self.to_table(columns=columns, pandas=False)
+        series = self._suv_series_parameters()
+
+        # series parameters for each frame
+        index = {uid: i for i, uid in \
+                 enumerate(series[sdtk.SERIESINSTANCEUID])}
+        frame_series = np.array([index[uid] for uid in \
+                                 frames[sdtk.SERIESINSTANCEUID]], dtype=int)
+        parameters = {key: series[key][frame_series] for key in \
+                      ('weight', 'dose', 'halflife', 'delta_time')}
+
+        reference_time = frames[sdtk.FRAMEREFERENCETIME].astype(object)
+        reference_time = np.array([0 if value is None else value for value \
+                                   in reference_time], dtype=np.float64)
+        frame_time = parameters['delta_time'] + reference_time / 1000
+
+        decay = sdtk.dicom_reader.decay_factors(parameters['halflife'],
+                                                frame_time)
+        # suv factor at the time the pixel values are decay corrected to
+        correction = frames[sdtk.DECAYCORRECTION].astype(object)
+        delta_time = np.where(correction == 'NONE', frame_time,
+                              np.where(correction == 'ADMIN', 0,
+                                       parameters['delta_time']))
+        suv_factor = sdtk.dicom_reader.suv_scale_factors(
+            parameters['weight'], parameters['dose'], parameters['halflife'],
+            delta_time)
+
+        data = {column: frames[column] for column in columns}
+        data['decay'] = decay
+        data['suv_factor'] = suv_factor
+        return self._table_from_arrays(columns + ['decay', 'suv_factor'],
+                                       data, pandas=pandas)
+
+    def _suv_series_parameters(self):
+        # SUV parameters as arrays with one element per series, the
+        # radiopharmaceutical sequence is decoded once per distinct value
+        columns = [sdtk.SERIESINSTANCEUID, sdtk.SERIESDATE, sdtk.SERIESTIME,
+                   sdtk.PATIENTWEIGHT,
+                   sdtk.RADIOPHARMACEUTICALINFORMATIONSEQUENCE]
+        table = self.to_table(columns=columns, distinct=True, pandas=False)
+
+        uids_seen = set()
+        uids, parameters = [], []
+        for row in table.tolist():
+            if row[0] in uids_seen:
+                continue # series with varying values, use the first
+            uids_seen.add(row[0])
+            uids.append(row[0])
+            parameters.append(sdtk.dicom_reader.suv_parameters(*row[1:]))
+
+        parameters = np.array(parameters, dtype=np.float64).reshape(-1, 4)
+        series = {sdtk.SERIESINSTANCEUID: np.array(uids, dtype=object)}
+        for index, key in enumerate(('weight', 'dose', 'halflife',
+                                     'delta_time')):
+            series[key] = parameters[:, index]
+        return series
+
+    def iter_files(self, with_path=False, sort=False, batch_size=None):
+        """ Yield the files in the current selection. Files are sorted by the
+        tag in sort_slices_by if sort is True. """
+        sort_by = self.sort_slices_by if sort else None
+
+        rows = self.iter_rows(columns=[self.builder.FILENAME_COL],
+                              sort_by=sort_by, sort_decimal=True,
+                              batch_size=batch_size)
+
+        for row in rows:
+            file = row[self.builder.FILENAME_COL].replace('\\', '/')
+            if with_path:
+                file = os.path.join(self.builder.path, file)
+            yield file
+
+    def iter_headers(self, sort_by=None, batch_size=None):
+        """ Yield a pydicom header for each file in the current selection.
+        Headers are generated from database content. Unlike the headers
+        property, the number of files is not limited by MAX_FILES. """
+        file_id = self.builder.ID_COL
+        main_columns = self.columns
+        columns = [tag for tag in self.tag_names if tag in main_columns]
+        # tags that are stored in the tag value table
+        side_tags = len(columns) < len(self.tag_names)
+
+        for row in self.iter_rows(columns=columns + [file_id], parse=False,
+                                  sort_by=sort_by, batch_size=batch_size):
+            row_id = row.pop(file_id)
+            if side_tags:
+                row.update(self.builder.get_side_row(row_id))
+            # tags that are not in the header of this file are NULL
+            hdict = {tag: value for tag, value in row.items() \
+                     if value is not None}
+            yield self._decode(hdict, codec=self.codec)
+
     def query(self, *args, **kwargs):
         warnings.warn('\nUse select instead of query\n', DeprecationWarning)
         return self.select(*args, **kwargs)
 
     def _get_tagnames(self):
         """ Return the tag names that are in the database """
-        
-        tagname_rows = self.get_column(self.builder.TAGNAMES_COL,
-                                       distinct=True, parse=False)
-        tagnames = set()
-        for row in tagname_rows:
-            for tagname in json.loads(row):
-                tagnames.add(tagname)
+        return self.builder.get_tag_names(**self._query_selection)
 
-        return tuple(tagnames)
+    def _on_database_changed(self, event):
+        # called by the watcher thread after files were added or removed
+        self.logger.info('Database changed: %i files added, %i removed',
+                         len(event.added), len(event.removed))
+        self._reset_cache()
+
+    def _cached(self, name, compute):
+        # return a value that depends on the selection, values are shared
+        # with the other databases of a DatabaseRegistry entry
+        if self._shared is None:
+            return compute()
+        key = (name, repr(sorted(self._selection.items())), self.SUV,
+               self._sort_slices_by)
+        return self._shared.get(key, compute)
 
     def _reset_cache(self):
         # Clear stored values of this object
@@ -450,50 +1130,199 @@ class Database(sdtk.Logger):
         self._images = None
         self._image = None
         self._tagnames = None
+        self._summary = None
 
 
     @staticmethod
-    def _encode_value(tagname, value):
+    def _encode_value(tagname, value, codec=None):
         _, VR, VM = sdtk.Decoder.decode_tagname(tagname)
         if sdtk.SQLiteWrapper.is_between_dict(value):
             for key, v in value.items():
-                value[key] = sdtk.Encoder.convert_value(v, VR=VR, VM=VM)
+                value[key] = sdtk.Encoder.convert_value(v, VR=VR, VM=VM,
+                                                        codec=codec)
         else:
-            value = sdtk.Encoder.convert_value(value, VR=VR, VM=VM)
+            value = sdtk.Encoder.convert_value(value, VR=VR, VM=VM,
+                                               codec=codec)
         return value
 
     @staticmethod
-    def _decode(hdict):
-        return sdtk.Decoder.decode(hdict)
-
-    def _count_tag(self, tagname):
-        if tagname not in self.tag_names:
-            count = 0
-        else:
-            count = self.database.count_column(self.builder.MAIN_TABLE,
-                                               tagname, distinct=True,
-                                               **self._selection)
-        return count
+    def _decode(hdict, codec=None):
+        return sdtk.Decoder.decode(hdict, codec=codec)
 
 
 class DatabaseBuilder(sdtk.Logger):
     """ Build a dicom database from a folder or set of files """
+    ID_COL          = 'id' # rowid alias in the main table, stable file id
     FILENAME_COL    = 'dicom_file_name' # colum in table that stores filenames
     FILE_SIZE_COL   = 'file_size_bytes' # store size of files
     TAGNAMES_COL    = 'dicom_tag_names' # column that stores tag names for file
+    REASON_COL      = 'rejection_reason' # why a file was not added
 
     MAIN_TABLE      = 'DicomMetaDataTable'   # stores values for each tag
     _INFO_TABLE      = 'Info'                 # store database version
     _INFO_DESCRIPTION_COL = 'Description'
     _INFO_PATH_COL = 'path'
     _INFO_VALUE_COL = 'Value'
+    _INFO_VERSION   = 'Version' # descriptions of rows in the info table
+    _INFO_TAGS      = 'Tags'
+    _INFO_CODEC     = 'Codec'
+    _INFO_SIDE_TAGS = 'SideTags'
+    _INFO_DUPLICATES = 'Duplicates'
     _FILENAME_TABLE  = 'FileNameTable' # stores non dicom files
+    _SUMMARY_TABLE   = 'SummaryTable'  # stores counts for entire database
+    _TAG_TABLE       = 'TagNameTable'  # stores an id for each tag name
+    _TAG_PRESENCE_TABLE = 'TagPresenceTable' # stores tag ids for each file
+    _TAG_ID_COL      = 'tag_id'
+    _TAG_NAME_COL    = 'tag_name'
+    _FILE_ID_COL     = 'file_id' # id of file in main table
+    _VALUE_TABLE     = 'TagValueTable' # values of tags without a column
+    _PENDING_TABLE   = 'PendingTable' # files indexed from a DICOMDIR
+    _PIXEL_TABLE     = 'PixelDataTable' # location of the pixel data of files
+    _DUPLICATE_TABLE = 'DuplicateTable' # other files of stored instances
+    _UNIQUE_INDEX    = 'unique_sop_instance_uid'
+    _DICOMDIR        = 'DICOMDIR'
+    _VALUE_COL       = 'value'
+    _REMOVE_TABLE    = 'temp.RemovedFiles' # files to remove in bulk
+    _REMOVED_VALUES  = 'temp.RemovedValues' # counted values of removed files
+    _MIGRATE_TABLE   = 'DicomMetaDataTableNew' # main table during migration
+
+    # columns of the pixel data table and the tags stored in them
+    _PIXEL_COLUMNS   = ('offset', 'length', 'transfer_syntax', 'rows',
+                        'columns', 'frames', 'samples_per_pixel',
+                        'bits_allocated', 'bits_stored',
+                        'pixel_representation')
+    _PIXEL_TAGS      = (sdtk.ROWS, sdtk.COLUMNS, 'NumberOfFrames',
+                        'SamplesPerPixel', 'BitsAllocated', 'BitsStored',
+                        'PixelRepresentation')
+
+    # summary fields, each summary field is a column in the summary table
+    PATIENTS        = 'patients'
+    STUDIES         = 'studies'
+    SERIES          = 'series'
+    INSTANCES       = 'instances'
+    BYTES           = 'bytes'
+
+    # summary fields that count the distinct values of a tag
+    _SUMMARY_COUNTS = ((PATIENTS, sdtk.PATIENTID),
+                       (STUDIES, sdtk.STUDYINSTANCEUID),
+                       (SERIES, sdtk.SERIESINSTANCEUID),
+                       (INSTANCES, sdtk.SOPINSTANCEUID))
+
+    # tags that are always stored when only a selection of tags is stored,
+    # used for counting, sorting, SUV and reading images
+    REQUIRED_TAGS   = (sdtk.PATIENTID, sdtk.STUDYINSTANCEUID,
+                       sdtk.SERIESINSTANCEUID, sdtk.SOPINSTANCEUID,
+                       sdtk.SOPCLASSUID, sdtk.MODALITY,
+                       'SpecificCharacterSet',
+                       sdtk.INSTANCENUMBER, sdtk.SLICELOCATION,
+                       sdtk.IMAGEPOSITIONPATIENT, sdtk.IMAGEORIENTATIONPATIENT,
+                       sdtk.PIXELSPACING, sdtk.SLICETHICKNESS,
+                       sdtk.ROWS, sdtk.COLUMNS, 'NumberOfFrames',
+                       sdtk.RESCALESLOPE, sdtk.RESCALEINTERCEPT,
+                       sdtk.REALWORLDVALUEMAPPINGSEQUENCE,
+                       sdtk.SERIESDATE, sdtk.SERIESTIME,
+                       sdtk.ACQUISITIONDATE, sdtk.ACQUISITIONTIME,
+                       sdtk.PATIENTWEIGHT,
+                       sdtk.RADIOPHARMACEUTICALINFORMATIONSEQUENCE,
+                       sdtk.UNITS, sdtk.DECAYCORRECTION, sdtk.DECAYFACTOR,
+                       sdtk.FRAMEREFERENCETIME, sdtk.ACTUALFRAMEDURATION,
+                       'SamplesPerPixel', 'BitsAllocated', 'BitsStored',
+                       'PixelRepresentation')
+
     #_LOG_LEVEL = logging.DEBUG
 
     _chunk_size     = 1000  # number of files to read before committing
 
+    # reasons for not adding a file, in addition to the FileScanner reasons
+    REJECT_NOT_DICOM     = 'not dicom'
+    REJECT_NOT_FOUND     = 'not found'
+    REJECT_UNREADABLE    = 'unreadable'
+    REJECT_NOT_ENCODABLE = 'not encodable'
+    REJECT_DICOMDIR      = 'dicomdir' # DICOMDIR read by the dicomdir option
+    REJECT_DUPLICATE     = 'duplicate' # SOPInstanceUID already in database
+
+    # modes for databases that are built or queried in memory
+    MEMORY_BUILD         = 'build' # build in memory, then write to disk
+    MEMORY_LOAD          = 'load'  # copy the database file to memory
+
+    # policies for files of an instance that is already in the database
+    DUPLICATES_FIRST     = 'first'  # keep the file that was added first
+    DUPLICATES_NEWEST    = 'newest' # keep the most recently modified file
+
     def __init__(self, path=None, scan=True, silent=False, database_file=None,
-                 force_rebuild=False, in_memory=False, use_private_tags=False):
+                 force_rebuild=False, in_memory=False, use_private_tags=False,
+                 journal_mode=None, busy_timeout=None, synchronous=None,
+                 scan_workers=None, max_depth=None, follow_symlinks=False,
+                 file_rules=None, tags=None, codec=None, side_tags=None,
+                 dicomdir=False, duplicates=None, memory=None,
+                 thread_local=False):
+        """
+        Build or update the database for the dicom files in path
+
+        thread_local:  open a separate sqlite connection in each thread. The
+                       builder (and databases using it) can then be shared
+                       between threads, see DatabaseRegistry.
+
+        memory:        'build' builds (or updates) the database in memory and
+                       writes a single snapshot to the database file when
+                       the build is finished. 'load' copies the database
+                       file to memory at open, queries do not touch the disk
+                       anymore. The database file is only written after a
+                       scan that changed the database or by save().
+
+        duplicates:    policy for files with a SOPInstanceUID that is already
+                       in the database, 'first' keeps the file that was added
+                       first and 'newest' the most recently modified file.
+                       The other files are recorded as duplicate locations
+                       and each instance is stored once, enforced by a
+                       unique index. Stored in the database and used for
+                       subsequent scans.
+
+        dicomdir:      index files referenced by a DICOMDIR from the DICOMDIR
+                       records (patient, study, series and image) without
+                       opening the files. The full headers of these files are
+                       read later by parse_pending, when an image is read or
+                       in the background by a DatabaseWatcher.
+
+        side_tags:     public tags (e.g. rarely used tags) that are stored in
+                       the tag value table instead of a column of the main
+                       table. Private tags are always stored in the tag value
+                       table, this keeps the main table narrow. Stored in the
+                       database and used for subsequent scans.
+
+        codec:         name of the value codec for a new database, 'json'
+                       (default) or 'binary'. The binary codec stores numbers
+                       as sqlite numbers and multiple values and sequences as
+                       compact blobs. The codec of an existing database is
+                       read from the database.
+
+        tags:          store only these tags (dicom keywords) and the
+                       REQUIRED_TAGS. Only these tags are parsed from the
+                       files, which makes building faster and the database
+                       smaller. The selection is stored in the database and
+                       used for new files in subsequent scans. Pass an empty
+                       list to store only the REQUIRED_TAGS.
+
+        scan_workers:  number of threads that scan folders concurrently for
+                       new files. Speeds up scanning of network shares.
+        max_depth:     number of sub folder levels to scan for new files,
+                       None scans all sub folders.
+        follow_symlinks: scan folders that are symbolic links, each folder
+                       is scanned once. Links to folders are skipped
+                       otherwise.
+        file_rules:    dictionary with include/exclude glob patterns,
+                       extensions and size limits for new files, see
+                       FileScanner.filter_files. Rejected files are recorded
+                       and not considered again.
+        journal_mode:  sqlite journal mode of the database file. Use 'WAL' to
+                       allow other processes to query the database while
+                       files are added. The database is checkpointed after
+                       each build.
+        busy_timeout:  time in milliseconds a connection waits for a lock
+                       held by another process.
+        synchronous:   sqlite synchronous setting, 'NORMAL' is recommended
+                       in combination with WAL.
+        """
         if silent:
             self._LOG_LEVEL = logging.ERROR
             
@@ -503,24 +1332,58 @@ class DatabaseBuilder(sdtk.Logger):
         
         
         self.use_private_tags = use_private_tags
+        self.journal_mode = journal_mode
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.scan_workers = scan_workers
+        self.max_depth = max_depth
+        self.follow_symlinks = follow_symlinks
+        self.file_rules = {} if file_rules is None else file_rules
+        self.dicomdir = dicomdir
+        self.memory = memory
+        self.thread_local = thread_local
         
+        self._tag_ids = None # cache for tag name --> tag id
+
         path, file = self._parse_path(path)
 
-        if file is None:
+        if database_file is not None:
+            file = database_file
+        elif file is None:
             file = self._get_database_file(path, in_memory=in_memory)
 
 
         self.database_file = file
 
+        if memory not in (None, self.MEMORY_BUILD, self.MEMORY_LOAD):
+            msg = 'memory must be None, {0} or {1}'
+            raise ValueError(msg.format(self.MEMORY_BUILD, self.MEMORY_LOAD))
+        if memory is not None and file == sdtk.SQLiteWrapper.IN_MEMORY:
+            raise ValueError('memory needs a database file')
+
         self.database = self.open_database(database_file=file,
                                            force_rebuild=force_rebuild,
                                            path=path)
 
+        self.codec = self._init_codec(codec)
+        self.tags = self._init_tags(tags)
+        self.side_tags = self._init_side_tags(side_tags)
+        self.duplicates = self._init_duplicates(duplicates)
+
         files = self.file_list(self.path, index=scan)
 
         self._update_db(files=files, silent=silent)
-        
-        self.path = path
+
+        # a single bulk copy of a database that was built in memory
+        if self.memory == self.MEMORY_BUILD:
+            self.save()
+            self.database = self._open_wrapper(file)
+        elif self.memory == self.MEMORY_LOAD and self.database.total_changes:
+            self.save()
+
+        if path is not None:
+            # path is None when a database file was passed
+            self.path = path
         
         self.database.close()
 
@@ -531,16 +1394,42 @@ class DatabaseBuilder(sdtk.Logger):
         return self.database.get_column(self._FILENAME_TABLE,
                                         self.FILENAME_COL)
     @property
+    def options(self):
+        """ Return the keyword arguments to open the database with another
+        builder (e.g. of a DatabaseWatcher) that scans and connects like this
+        builder. Tags, side tags, the codec and the duplicate policy are
+        stored in the database. """
+        return {'use_private_tags': self.use_private_tags,
+                'journal_mode': self.journal_mode,
+                'busy_timeout': self.busy_timeout,
+                'synchronous': self.synchronous,
+                'scan_workers': self.scan_workers,
+                'max_depth': self.max_depth,
+                'follow_symlinks': self.follow_symlinks,
+                'file_rules': self.file_rules,
+                'dicomdir': self.dicomdir}
+
+    @property
+    def summary(self):
+        """ Return the summary of the entire database that is stored in the
+        database and updated for each added and removed file. """
+        names = [name for name, _ in self._SUMMARY_COUNTS] + [self.BYTES]
+        rows = self.database.query(self._SUMMARY_TABLE, column_names=names)
+        if not rows:
+            # summary table did not get populated yet
+            return self.update_summary()
+        return dict(zip(names, rows[0]))
+
+    @property
     def path(self):
-        p = self.database.get_column(self._INFO_TABLE, self._INFO_PATH_COL)[0]
-        return p
+        return self._get_info(self.database, self._INFO_VERSION,
+                              column=self._INFO_PATH_COL)
 
     @path.setter
     def path(self, path):
         if path != self.path:
-            self.database.delete_table(self._INFO_TABLE)
-            self._create_info_table(self.database, version=self.version,
-                                    path=path)
+            self._set_info(self._INFO_VERSION, path,
+                           column=self._INFO_PATH_COL)
     @property
     def version(self):
         return DatabaseBuilder.get_version(self.database)
@@ -549,15 +1438,27 @@ class DatabaseBuilder(sdtk.Logger):
     @version.setter
     def version(self, version):
         if version != self.version:
-            self.database.delete_table(self._INFO_TABLE)
-            self._create_info_table(self.database, version=version,
-                                    path=self.path)
+            self._set_info(self._INFO_VERSION, version)
+
+    @property
+    def specific_tags(self):
+        """ Return the tags that are read from each file, None if all tags
+        are read """
+        if self.tags is None:
+            return None
+        return sorted(set(self.tags).union(self.REQUIRED_TAGS))
 
     def open_database(self, database_file, path, force_rebuild=False):
-        """ Open the sqlite database in the file, rebuild if asked """
+        """ Open the sqlite database in the file, rebuild if asked. The
+        database file is copied to memory when memory is set. """
         
-        database = sdtk.SQLiteWrapper(database_file)
-        database._LOG_LEVEL = self._LOG_LEVEL
+        if self.memory is None:
+            database = self._open_wrapper(database_file)
+        else:
+            database = self._open_wrapper(sdtk.SQLiteWrapper.IN_MEMORY)
+            if os.path.isfile(database_file) and not force_rebuild:
+                self.logger.info('Loading %s in memory', database_file)
+                database.restore(database_file, close=False)
         
         
 
@@ -577,23 +1478,516 @@ class DatabaseBuilder(sdtk.Logger):
 
         if not self.MAIN_TABLE in database.table_names:
             self._create_main_table(database)
+        else:
+            self._migrate_main_table(database)
         if not self._INFO_TABLE in database.table_names:
             self._create_info_table(database, path=path)
         if not self._FILENAME_TABLE in database.table_names:
             self._create_filename_table(database)
+        elif not self.REASON_COL in database.column_names(self._FILENAME_TABLE):
+            database.add_column(self._FILENAME_TABLE, self.REASON_COL)
+        if not self._SUMMARY_TABLE in database.table_names:
+            self._create_summary_table(database)
+        self.database = database
+
+        if not self._TAG_PRESENCE_TABLE in database.table_names:
+            self._create_tag_tables(database)
+            self._index_tag_names()
+        if not self._VALUE_TABLE in database.table_names:
+            self._create_value_table(database)
+        if not self._PENDING_TABLE in database.table_names:
+            self._create_pending_table(database)
+        if not self._PIXEL_TABLE in database.table_names:
+            self._create_pixel_table(database)
+        if not self._DUPLICATE_TABLE in database.table_names:
+            self._create_duplicate_table(database)
+        self._create_summary_indexes()
+        if not database.query(self._SUMMARY_TABLE):
+            # stored summary is changed incrementally from here on
+            self.update_summary()
+        return database
+
+    def _open_wrapper(self, database_file):
+        thread_local = self.thread_local and \
+            database_file != sdtk.SQLiteWrapper.IN_MEMORY
+        database = sdtk.SQLiteWrapper(database_file,
+                                      journal_mode=self.journal_mode,
+                                      busy_timeout=self.busy_timeout,
+                                      synchronous=self.synchronous,
+                                      thread_local=thread_local)
+        database._LOG_LEVEL = self._LOG_LEVEL
         return database
 
+    def save(self, database_file=None):
+        """ Write a snapshot of a database in memory to database_file, by
+        default the database file of the builder. """
+        if database_file is None:
+            database_file = self.database_file
+        if database_file == self.database.database_file:
+            return # changes are already in the file
+        self.logger.info('Writing database to %s', database_file)
+        self.database.backup(database_file)
+
+    def get_tag_names(self, close=True, **kwargs):
+        """ Return the tag names that are present in the rows that match the
+        selection (kwargs). Tag names are read from the tag presence table """
+        cmd = ('SELECT {tag_name} FROM {tag_table} AS t WHERE EXISTS '
+               '(SELECT 1 FROM {presence_table} AS p '
+               'WHERE p.{tag_id} = t.{tag_id} {file_filter})')
+
+        where, values = sdtk.SQLiteWrapper._where_clause(**kwargs)
+        cmd = cmd.format(tag_name=self._TAG_NAME_COL,
+                         tag_table=self._TAG_TABLE,
+                         presence_table=self._TAG_PRESENCE_TABLE,
+                         tag_id=self._TAG_ID_COL,
+                         file_filter=self._file_filter(where))
+
+        result = self.database.execute(cmd, values=values, fetch_all=True,
+                                       close=close)
+        return tuple(ri[0] for ri in result)
+
+    def has_tag(self, tag_name, close=True, **kwargs):
+        """ Return True if tag is present in at least one of the rows that
+        match the selection (kwargs) """
+        cmd = ('SELECT EXISTS(SELECT 1 FROM {presence_table} AS p '
+               'JOIN {tag_table} AS t ON p.{tag_id} = t.{tag_id} '
+               'WHERE t.{tag_name} = ? {file_filter} LIMIT 1)')
+
+        where, values = sdtk.SQLiteWrapper._where_clause(**kwargs)
+        cmd = cmd.format(presence_table=self._TAG_PRESENCE_TABLE,
+                         tag_table=self._TAG_TABLE,
+                         tag_id=self._TAG_ID_COL,
+                         tag_name=self._TAG_NAME_COL,
+                         file_filter=self._file_filter(where))
+
+        result = self.database.execute(cmd, values=[tag_name, *values],
+                                       fetch_all=True, close=close)
+        return bool(result[0][0])
+
+    def has_values(self, tag_name, close=True, **kwargs):
+        """ Return True if tag has a value in at least one of the rows that
+        match the selection (kwargs) """
+        if tag_name not in self.database.column_names(self.MAIN_TABLE,
+                                                      close=False):
+            # tag in tag value table, values are never NULL
+            return self.has_tag(tag_name, close=close, **kwargs)
+        return self.database.column_has_values(self.MAIN_TABLE, tag_name,
+                                               close=close, **kwargs)
+
+    def compute_summary(self, close=True, **kwargs):
+        """ Count patients, studies, series and instances and sum the file
+        sizes for the rows that match the selection (kwargs) in one
+        aggregate query. """
+        columns = self.database.column_names(self.MAIN_TABLE, close=False)
+
+        expressions = []
+        for name, tagname in self._SUMMARY_COUNTS:
+            if tagname in columns:
+                expressions += ['COUNT(DISTINCT {0})'.format(tagname)]
+            else:
+                expressions += ['0'] # tag not (yet) in database
+        expressions += ['SUM({0})'.format(self.FILE_SIZE_COL)]
+
+        values = self.database.aggregate(self.MAIN_TABLE, expressions,
+                                         close=close, **kwargs)
+
+        summary = dict(zip([name for name, _ in self._SUMMARY_COUNTS],
+                           values[:-1]))
+        summary[self.BYTES] = 0 if values[-1] is None else values[-1]
+        return summary
+
+    def update_summary(self, close=True):
+        """ Recompute the summary of the entire database and store it in the
+        summary table. The stored summary is changed for each added and
+        removed file, a full recompute is only needed for databases without
+        a stored summary. """
+        summary = self.compute_summary(close=False)
+        self.database.execute('DELETE FROM {0}'.format(self._SUMMARY_TABLE),
+                              close=False)
+        self.database.insert_row_dict(self._SUMMARY_TABLE, summary,
+                                      close=close)
+        return summary
+
+    def _create_summary_indexes(self, columns=None):
+        # indexes on the counted tags, the stored summary is updated with
+        # a lookup of the values of added and removed files
+        if columns is None:
+            columns = self.database.column_names(self.MAIN_TABLE, close=False)
+        cmd = 'CREATE INDEX IF NOT EXISTS {table}_{tag} ON {table} ({tag})'
+        for _, tagname in self._SUMMARY_COUNTS:
+            if tagname in columns:
+                self.database.execute(cmd.format(table=self.MAIN_TABLE,
+                                                 tag=tagname), close=False)
+        self.database.close()
+
+    def _has_value(self, tagname, value):
+        # True if a file in the database has the (encoded) value for tagname
+        cmd = 'SELECT 1 FROM {table} WHERE {tag}=? LIMIT 1'
+        cmd = cmd.format(table=self.MAIN_TABLE, tag=tagname)
+        return bool(self.database.execute(cmd, values=[value], fetch_all=True,
+                                          close=False))
+
+    def _summary_delta(self, hdict, columns):
+        # change of the summary when the (encoded) header dictionary of a
+        # file is inserted, columns are the existing columns
+        delta = {self.BYTES: hdict.get(self.FILE_SIZE_COL) or 0}
+        for name, tagname in self._SUMMARY_COUNTS:
+            value = hdict.get(tagname)
+            if value is None:
+                delta[name] = 0
+            elif tagname not in columns:
+                delta[name] = 1
+            else:
+                delta[name] = 0 if self._has_value(tagname, value) else 1
+        return delta
+
+    def _change_summary(self, delta, close=True):
+        # add the changes in delta to the stored summary
+        names = list(delta.keys())
+        cmd = 'UPDATE {table} SET {changes}'
+        changes = ', '.join('{0} = {0} + ?'.format(name) for name in names)
+        cmd = cmd.format(table=self._SUMMARY_TABLE, changes=changes)
+        self.database.execute(cmd, values=[delta[name] for name in names],
+                              close=close)
+
     @staticmethod
     def get_version(database):
         """ Return the version of the database """
-        if DatabaseBuilder._INFO_TABLE not in database.table_names:
+        v = DatabaseBuilder._get_info(database, DatabaseBuilder._INFO_VERSION)
+        if v is None:
             v = 0
-        else:
-            v = database.get_column(DatabaseBuilder._INFO_TABLE,
-                                    DatabaseBuilder._INFO_VALUE_COL)[0]
 
         return float(v)
 
+    @staticmethod
+    def _get_info(database, description, column=None, close=True):
+        # value in the info table for the row with description, None if the
+        # row does not exist
+        if DatabaseBuilder._INFO_TABLE not in database.table_names:
+            return None
+        if column is None:
+            column = DatabaseBuilder._INFO_VALUE_COL
+        where = {DatabaseBuilder._INFO_DESCRIPTION_COL: description}
+        values = database.get_column(DatabaseBuilder._INFO_TABLE, column,
+                                     close=close, **where)
+        return values[0] if values else None
+
+    def _set_info(self, description, value, column=None, close=True):
+        # store value in the info table in the row with description
+        if column is None:
+            column = self._INFO_VALUE_COL
+        where = {self._INFO_DESCRIPTION_COL: description}
+        exists = self.database.get_column(self._INFO_TABLE,
+                                          self._INFO_DESCRIPTION_COL,
+                                          close=False, **where)
+        if exists:
+            self.database.set_column_where(self._INFO_TABLE, column, value,
+                                           close=close, **where)
+        else:
+            self.database.insert_row_dict(self._INFO_TABLE,
+                                          {**where, column: value},
+                                          close=close)
+
+    def _init_codec(self, codec):
+        # the codec of a database cannot change once files were added
+        stored = self._get_info(self.database, self._INFO_CODEC)
+        if stored is None:
+            has_files = self.database.column_has_values(self.MAIN_TABLE,
+                                                        self.FILENAME_COL)
+            if has_files or codec is None:
+                # database created by an older version
+                stored = sdtk.JSONCodec.NAME
+            else:
+                stored = codec
+            self._set_info(self._INFO_CODEC, stored)
+
+        if codec is not None and codec != stored:
+            msg = ('Database uses codec {0}, rebuild the database with '
+                   'force_rebuild=True to use codec {1}')
+            raise ValueError(msg.format(stored, codec))
+        return sdtk.get_codec(stored)
+
+    def _init_side_tags(self, side_tags):
+        # side tags passed to the builder replace the stored side tags
+        if side_tags is None:
+            stored = self._get_info(self.database, self._INFO_SIDE_TAGS)
+            return [] if stored is None else json.loads(stored)
+
+        side_tags = list(side_tags)
+        required = set(side_tags).intersection(self.REQUIRED_TAGS)
+        if required:
+            msg = 'Required tags cannot be stored as side tags: {0}'
+            raise ValueError(msg.format(sorted(required)))
+
+        self._set_info(self._INFO_SIDE_TAGS, json.dumps(side_tags))
+        return side_tags
+
+    def _init_duplicates(self, duplicates):
+        # a policy passed to the builder replaces the stored policy, the
+        # unique index is created when a policy is set for the first time
+        if duplicates is None:
+            return self._get_info(self.database, self._INFO_DUPLICATES)
+
+        policies = (self.DUPLICATES_FIRST, self.DUPLICATES_NEWEST)
+        if duplicates not in policies:
+            msg = 'Duplicate policy must be one of {0}'
+            raise ValueError(msg.format(policies))
+
+        self._set_info(self._INFO_DUPLICATES, duplicates, close=False)
+        self.duplicates = duplicates
+        self._add_column_for_tags([sdtk.SOPINSTANCEUID])
+
+        cmd = "SELECT name FROM sqlite_master WHERE type='index' AND name=?"
+        exists = self.database.execute(cmd, values=[self._UNIQUE_INDEX],
+                                       fetch_all=True, close=False)
+        if not exists:
+            self._resolve_duplicates()
+            cmd = 'CREATE UNIQUE INDEX {index} ON {table} ({uid})'
+            cmd = cmd.format(index=self._UNIQUE_INDEX, table=self.MAIN_TABLE,
+                             uid=sdtk.SOPINSTANCEUID)
+            self.database.execute(cmd, close=False)
+        self.database.close()
+        return duplicates
+
+    def _resolve_duplicates(self):
+        # keep one file of each instance that is in the database more than
+        # once, the other files are moved to the duplicate table
+        cmd = ('SELECT {uid}, {file_name} FROM {table} WHERE {uid} IN '
+               '(SELECT {uid} FROM {table} WHERE {uid} IS NOT NULL '
+               'GROUP BY {uid} HAVING COUNT(*) > 1) ORDER BY {id}')
+        cmd = cmd.format(uid=sdtk.SOPINSTANCEUID, table=self.MAIN_TABLE,
+                         file_name=self.FILENAME_COL, id=self.ID_COL)
+
+        instances = {}
+        for uid, file in self.database.execute(cmd, fetch_all=True,
+                                               close=False):
+            instances.setdefault(uid, []).append(file)
+
+        duplicates = {}
+        for uid, files in instances.items():
+            keep = self._canonical_file(files)
+            duplicates.update({file: uid for file in files if file != keep})
+
+        if duplicates:
+            self.logger.info('Moving %i duplicate files', len(duplicates))
+            self.remove_files(list(duplicates), close=False, promote=False)
+            self._record_duplicates(duplicates, close=False)
+
+    def _canonical_file(self, files):
+        # file that is kept for an instance, files are in the order in which
+        # they were added
+        if self.duplicates == self.DUPLICATES_NEWEST:
+            return max(files, key=self._modification_time)
+        return files[0]
+
+    def _modification_time(self, file):
+        try:
+            return os.path.getmtime(os.path.join(self.path, file))
+        except OSError:
+            return float('-inf')
+
+    def _keep_duplicate(self, file, uid):
+        # file has the (encoded) SOPInstanceUID uid, returns True if file
+        # has to be inserted. The file that is not kept is recorded as a
+        # duplicate.
+        cmd = 'SELECT {file_name} FROM {table} WHERE {uid}=?'
+        cmd = cmd.format(file_name=self.FILENAME_COL, table=self.MAIN_TABLE,
+                         uid=sdtk.SOPINSTANCEUID)
+        existing = self.database.execute(cmd, values=[uid], fetch_all=True,
+                                         close=False)
+        if not existing:
+            return True
+
+        existing = existing[0][0]
+        if self._canonical_file([existing, file]) == existing:
+            self.logger.info('%s is a duplicate of %s', file, existing)
+            self._record_duplicates({file: uid}, close=False)
+            return False
+
+        self.logger.info('%s replaces duplicate %s', file, existing)
+        self.remove_files([existing], close=False, promote=False)
+        self._record_duplicates({existing: uid}, close=False)
+        return True
+
+    def _record_duplicates(self, duplicates, close=True):
+        # store the files and (encoded) SOPInstanceUID of duplicates, the
+        # files are rejected and will not be read again
+        cmd = 'INSERT OR REPLACE INTO {table} ({file_name}, {uid}) VALUES (?, ?)'
+        cmd = cmd.format(table=self._DUPLICATE_TABLE,
+                         file_name=self.FILENAME_COL, uid=sdtk.SOPINSTANCEUID)
+        self.database.executemany(cmd, list(duplicates.items()), close=False)
+
+        cmd = ('INSERT OR REPLACE INTO {table} ({file_name}, {reason}) '
+               'VALUES (?, ?)')
+        cmd = cmd.format(table=self._FILENAME_TABLE,
+                         file_name=self.FILENAME_COL, reason=self.REASON_COL)
+        self.database.executemany(cmd, [(file, self.REJECT_DUPLICATE) \
+                                        for file in duplicates], close=close)
+
+    def _promote_duplicates(self, close=True):
+        # duplicates of instances that are no longer in the database are
+        # removed from the duplicate table and returned, they have to be
+        # inserted again
+        cmd = ('SELECT {file_name} FROM {duplicate_table} WHERE {uid} NOT IN '
+               '(SELECT {uid} FROM {table} WHERE {uid} IS NOT NULL)')
+        cmd = cmd.format(file_name=self.FILENAME_COL,
+                         duplicate_table=self._DUPLICATE_TABLE,
+                         uid=sdtk.SOPINSTANCEUID, table=self.MAIN_TABLE)
+        promoted = [row[0] for row in self.database.execute(
+            cmd, fetch_all=True, close=False)]
+
+        for table in (self._DUPLICATE_TABLE, self._FILENAME_TABLE):
+            cmd = 'DELETE FROM {table} WHERE {file_name}=?'
+            cmd = cmd.format(table=table, file_name=self.FILENAME_COL)
+            self.database.executemany(cmd, [[file] for file in promoted],
+                                      close=False)
+        self.database.close(close)
+        return promoted
+
+    def get_duplicates(self, uids=None, close=True):
+        """ Return a dictionary with the (encoded) SOPInstanceUID as key and
+        a list with the duplicate files of the instance as value. Only
+        instances in uids (list or Subquery) are returned if uids is given.
+        """
+        cmd = ('SELECT {uid}, {file_name} FROM {table} {where} '
+               'ORDER BY {uid}, {file_name}')
+        if uids is None:
+            where, values = '', []
+        else:
+            where, values = self.database._where_clause(
+                **{sdtk.SOPINSTANCEUID: uids})
+        cmd = cmd.format(uid=sdtk.SOPINSTANCEUID, file_name=self.FILENAME_COL,
+                         table=self._DUPLICATE_TABLE, where=where)
+
+        duplicates = {}
+        for uid, file in self.database.execute(cmd, values=values,
+                                               fetch_all=True, close=close):
+            duplicates.setdefault(uid, []).append(file)
+        return duplicates
+
+    def is_side_tag(self, tag_name, columns=None):
+        """ Return True if values of new files for tag_name are stored in the
+        tag value table. Tags that have a column in the main table (created
+        by older versions) keep using the column. """
+        if columns is None:
+            columns = self.database.column_names(self.MAIN_TABLE)
+        if tag_name in columns:
+            return False
+        return tag_name.startswith(sdtk.Encoder._PRIVATE_TAG_PREFIX) \
+            or tag_name in self.side_tags
+
+    def query_selection(self, selection, close=True, schema=None):
+        """ Return the selection for queries on the main table. Tags in the
+        selection that are stored in the tag value table are replaced by a
+        subquery on the file id. Use schema for a database that is attached
+        to another connection. """
+        columns = self.database.column_names(self.MAIN_TABLE, close=close)
+
+        query_selection = {}
+        subqueries = []
+        values = []
+        for tag_name, value in selection.items():
+            if tag_name in columns or tag_name == sdtk.SQLiteWrapper.ROWID:
+                query_selection[tag_name] = value
+                continue
+
+            cmd = ('SELECT {file_id} FROM {value_table} {where} '
+                   'AND {tag_id} = (SELECT {tag_id} FROM {tag_table} '
+                   'WHERE {tag_name} = ?)')
+            where, vals = sdtk.SQLiteWrapper._where_clause(
+                **{self._VALUE_COL: value})
+            subqueries += [cmd.format(
+                file_id=self._FILE_ID_COL,
+                value_table=self._schema_table(self._VALUE_TABLE, schema),
+                where=where, tag_id=self._TAG_ID_COL,
+                tag_table=self._schema_table(self._TAG_TABLE, schema),
+                tag_name=self._TAG_NAME_COL)]
+            values += vals + [tag_name]
+
+        if subqueries:
+            if self.ID_COL in query_selection:
+                msg = 'Cannot combine an id selection with side tags'
+                raise ValueError(msg)
+            sql = ' INTERSECT '.join(subqueries)
+            query_selection[self.ID_COL] = \
+                sdtk.SQLiteWrapper.Subquery(sql, values)
+        return query_selection
+
+    def get_side_values(self, tag_name, distinct=True, sort=True,
+                        close=True, **kwargs):
+        """ Return the values of a tag in the tag value table for the rows
+        that match the selection (kwargs) """
+        cmd = ('SELECT {distinct} v.{value} FROM {value_table} AS v '
+               'JOIN {tag_table} AS t ON v.{tag_id} = t.{tag_id} '
+               'WHERE t.{tag_name} = ? {file_filter} {order}')
+
+        where, values = sdtk.SQLiteWrapper._where_clause(**kwargs)
+        file_filter = self._file_filter(where, alias='v')
+        cmd = cmd.format(distinct='DISTINCT' if distinct else '',
+                         value=self._VALUE_COL,
+                         value_table=self._VALUE_TABLE,
+                         tag_table=self._TAG_TABLE, tag_id=self._TAG_ID_COL,
+                         tag_name=self._TAG_NAME_COL, file_filter=file_filter,
+                         order='ORDER BY v.{0}'.format(self._VALUE_COL) \
+                             if sort else '')
+
+        result = self.database.execute(cmd, values=[tag_name, *values],
+                                       fetch_all=True, close=close)
+        return [row[0] for row in result]
+
+    def side_column(self, tag_name, schema=None):
+        """ Return a SQL expression for a query on the main table that selects
+        the value of tag_name from the tag value table. Use schema for a
+        database that is attached to another connection. """
+        cmd = ('(SELECT v.{value} FROM {value_table} AS v '
+               'JOIN {tag_table} AS t ON v.{tag_id} = t.{tag_id} '
+               'WHERE v.{file_id} = {table}.{id} AND t.{tag_name} = \'{tag}\') '
+               'AS {tag}')
+        table = lambda name: self._schema_table(name, schema)
+        return cmd.format(value=self._VALUE_COL,
+                          value_table=table(self._VALUE_TABLE),
+                          tag_table=table(self._TAG_TABLE),
+                          tag_id=self._TAG_ID_COL, file_id=self._FILE_ID_COL,
+                          table=table(self.MAIN_TABLE), id=self.ID_COL,
+                          tag_name=self._TAG_NAME_COL, tag=tag_name)
+
+    @staticmethod
+    def _schema_table(table, schema=None):
+        # name of a table in an attached database
+        return table if schema is None else schema + '.' + table
+
+    def get_side_row(self, file_id, close=True):
+        """ Return a dictionary with the tags and values in the tag value
+        table for a file (id in the main table) """
+        cmd = ('SELECT t.{tag_name}, v.{value} FROM {value_table} AS v '
+               'JOIN {tag_table} AS t ON v.{tag_id} = t.{tag_id} '
+               'WHERE v.{file_id} = ?')
+        cmd = cmd.format(tag_name=self._TAG_NAME_COL, value=self._VALUE_COL,
+                         value_table=self._VALUE_TABLE,
+                         tag_table=self._TAG_TABLE, tag_id=self._TAG_ID_COL,
+                         file_id=self._FILE_ID_COL)
+        return dict(self.database.execute(cmd, values=[file_id],
+                                          fetch_all=True, close=close))
+
+    def _init_tags(self, tags):
+        # tags passed to the builder replace the tags stored in the database
+        if tags is None:
+            stored = self._get_info(self.database, self._INFO_TAGS)
+            return None if stored is None else json.loads(stored)
+
+        tags = list(tags)
+        for tag in tags:
+            if pydicom.datadict.tag_for_keyword(tag) is None:
+                raise ValueError('{0} is not a dicom keyword'.format(tag))
+
+        self._set_info(self._INFO_TAGS, json.dumps(tags), close=False)
+        self.tags = tags
+
+        # create columns up front, files do not add columns
+        self._add_column_for_tags(self.specific_tags)
+        self.database.close()
+        return tags
+
     def _get_database_file(self, path, in_memory=False):
         # database file name
         if in_memory:
@@ -624,7 +2018,15 @@ class DatabaseBuilder(sdtk.Logger):
         # gather file list
         if index:
             self.logger.info('Scanning for new files')
-            files = sdtk.FileScanner.files_in_folder(path, recursive=True)
+            files = sdtk.FileScanner.files_in_folder(
+                path, recursive=True, workers=self.scan_workers,
+                max_depth=self.max_depth,
+                follow_symlinks=self.follow_symlinks)
+
+            # skip the database file and its journal files
+            database_name = os.path.basename(self.database_file)
+            files = [file for file in files \
+                     if not file.startswith(database_name)]
         else:
             files = []
         return files
@@ -633,60 +2035,119 @@ class DatabaseBuilder(sdtk.Logger):
         """ Insert a dicom file to the database """
         self.logger.debug('Inserting: %s', file)
         self.database.insert_row_dict(self._FILENAME_TABLE,
-                                      {self.FILENAME_COL: file})
+                                      {self.FILENAME_COL: file}, close=False)
 
         if _existing_column_names is None:
             table = DatabaseBuilder.MAIN_TABLE
-            _existing_column_names = self.database.column_names(table)
+            _existing_column_names = self.database.column_names(table,
+                                                                close=False)
 
         # read file from disk
         fullfile = os.path.join(self.path, file)
 
         try:
-            header = pydicom.read_file(fullfile, stop_before_pixels=True)
+            # check the first bytes before parsing the file with pydicom
+            file_type = sdtk.FileScanner.sniff(fullfile)
+            if file_type is None:
+                self.logger.info('{0} not dicom.'.format(fullfile))
+                self._reject(file, self.REJECT_NOT_DICOM, close=close)
+                return _existing_column_names
+
+            # files without preamble can only be read with force
+            force = file_type == sdtk.FileScanner.RAW_DICOM
+            with open(fullfile, 'rb') as fp:
+                header = pydicom.read_file(fp, stop_before_pixels=True,
+                                           force=force,
+                                           specific_tags=self.specific_tags)
+                pixel_data = self._locate_pixel_data(fp, header, fullfile)
         except FileNotFoundError:
             # skip file when file had been removed between scanning and
             # the time point the file is opened.
             
             self.logger.info('{0} not found.'.format(fullfile))
+            self._reject(file, self.REJECT_NOT_FOUND, close=close)
             return _existing_column_names
         except AttributeError:
             # Attribute error is thrown when reading a dicom dirfile by pydiom
             self.logger.info('{0} not proper dicom.'.format(fullfile))
+            self._reject(file, self.REJECT_NOT_DICOM, close=close)
             return _existing_column_names
         except:
             msg = ('WARNING: Unhandled exception while reading {0}. '
                    'File is skipped')
             print(msg.format(fullfile))
+            self._reject(file, self.REJECT_UNREADABLE, close=close)
             return _existing_column_names
-            
+
+        return self._insert_header(file, header, _existing_column_names,
+                                   pixel_data=pixel_data, close=close)
+
+    def _locate_pixel_data(self, fp, header, fullfile):
+        # pydicom stops at the pixel data element. Files of which the pixel
+        # data cannot be located are stored without a location and are read
+        # by pydicom or SimpleITK.
+        try:
+            return sdtk.dicom_reader.pixel_data_location(fp, header)
+        except Exception:
+            self.logger.info('Cannot locate pixel data in %s', fullfile)
+            return None
+
+    def _insert_header(self, file, header, _existing_column_names,
+                       pixel_data=None, close=True):
+        # insert the values of a pydicom header in the database for file,
+        # pixel_data is the offset and length of the pixel data in the file
+        fullfile = os.path.join(self.path, file)
+
         # convert header to dictionary
         try:
             hdict = DatabaseBuilder._encode(
-                    header, use_private_tags=self.use_private_tags)
+                    header, use_private_tags=self.use_private_tags,
+                    codec=self.codec)
         except:
             self.logger.info('Cannot add: %s', file)
+            self._reject(file, self.REJECT_NOT_ENCODABLE, close=close)
             return _existing_column_names
 
         # store tag names
-        hdict[self.TAGNAMES_COL] = json.dumps(list(hdict.keys()))
+        tag_names = list(hdict.keys())
+        hdict[self.TAGNAMES_COL] = json.dumps(tag_names)
         hdict[self.FILENAME_COL] = file # add filenmae to dictionary
         hdict[self.FILE_SIZE_COL] = os.path.getsize(fullfile)
 
+        # only one file of each instance is stored when a duplicate policy
+        # is set
+        uid = hdict.get(sdtk.SOPINSTANCEUID)
+        if self.duplicates is not None and uid is not None \
+            and not self._keep_duplicate(file, uid):
+            return _existing_column_names
+
+        # values of side tags are stored in the tag value table
+        side_values = {tag: hdict.pop(tag) for tag in tag_names \
+                       if self.is_side_tag(tag, _existing_column_names)}
+
         # determine which columns need to be added to the database
         newcols = [c for c in hdict.keys() if c not in _existing_column_names]
 
+        summary_delta = self._summary_delta(hdict, _existing_column_names)
+
         # add columns
         self._add_column_for_tags(newcols, skip_check=True)
 
         # encode dictionary values to json and stor in database
         try:
-            self.database.insert_row_dict(self.MAIN_TABLE, hdict, close=close)
+            file_id = self.database.insert_row_dict(self.MAIN_TABLE, hdict,
+                                                    close=False)
         except:
             msg = ('Could not insert file: {0}'.format(file))
             self.database.close()
             raise IOError(msg)
 
+        self._change_summary(summary_delta, close=False)
+        self._insert_side_values(file_id, side_values)
+        if pixel_data is not None:
+            self._insert_pixel_data(file_id, header, *pixel_data)
+        self._index_tags(file_id, tag_names, close=close)
+
         if close:
             self.database.close()
 
@@ -694,27 +2155,321 @@ class DatabaseBuilder(sdtk.Logger):
         self.logger.debug('Inserted: %s', file)
         return newcols
 
-    def remove_files(self, file_names):
-        """ Remove file list from the database """
-        for file_name in file_names:
-            self.remove_file(file_name, close=False)
+    @property
+    def rejections(self):
+        """ Return a dictionary with the number of files that were not added
+        to the database for each reason """
+        cmd = ('SELECT {reason}, COUNT(*) FROM {table} '
+               'WHERE {reason} IS NOT NULL GROUP BY {reason}')
+        cmd = cmd.format(reason=self.REASON_COL, table=self._FILENAME_TABLE)
+        return dict(self.database.execute(cmd, fetch_all=True))
+
+    def _reject(self, file, reason, close=True):
+        # record why a file was not added, the file will not be read again
+        self.database.set_column_where(self._FILENAME_TABLE, self.REASON_COL,
+                                       reason, close=close,
+                                       **{self.FILENAME_COL: file})
+
+    def _record_rejected(self, rejected):
+        # record files that were rejected by the file rules
+        cmd = 'INSERT OR IGNORE INTO {table} ({file_name}, {reason}) VALUES (?, ?)'
+        cmd = cmd.format(table=self._FILENAME_TABLE,
+                         file_name=self.FILENAME_COL, reason=self.REASON_COL)
+        self.database.executemany(cmd, list(rejected.items()))
+
+    def remove_files(self, file_names, close=True, promote=True):
+        """ Remove file list from the database. The file names are loaded
+        in a temporary table and removed with a single DELETE per table in
+        one transaction. Returns the duplicates of removed instances, these
+        files have to be inserted again (see the duplicates option). """
+        if not file_names:
+            return []
+
+        cmd = 'CREATE TEMP TABLE IF NOT EXISTS {table} ({file_name} TEXT UNIQUE)'
+        self.database.execute(cmd.format(table=self._REMOVE_TABLE,
+                                         file_name=self.FILENAME_COL),
+                              close=False)
+        self.database.execute('DELETE FROM {0}'.format(self._REMOVE_TABLE),
+                              close=False)
+
+        cmd = 'INSERT OR IGNORE INTO {table} ({file_name}) VALUES (?)'
+        cmd = cmd.format(table=self._REMOVE_TABLE, file_name=self.FILENAME_COL)
+        self.database.executemany(cmd, [[file] for file in file_names],
+                                  close=False)
+
+        removed = 'SELECT {file_name} FROM {remove_table}'
+        removed = removed.format(file_name=self.FILENAME_COL,
+                                 remove_table=self._REMOVE_TABLE)
+
+        counted = self._collect_removed_values(removed)
+
+        for file_table in (self._TAG_PRESENCE_TABLE, self._VALUE_TABLE,
+                           self._PIXEL_TABLE):
+            cmd = ('DELETE FROM {file_table} WHERE {file_id} IN '
+                   '(SELECT {id} FROM {table} '
+                   'WHERE {file_name} IN ({removed}))')
+            cmd = cmd.format(file_table=file_table, id=self.ID_COL,
+                             file_id=self._FILE_ID_COL, table=self.MAIN_TABLE,
+                             file_name=self.FILENAME_COL, removed=removed)
+            self.database.execute(cmd, close=False)
+
+        for table in (self.MAIN_TABLE, self._FILENAME_TABLE,
+                      self._PENDING_TABLE, self._DUPLICATE_TABLE):
+            cmd = 'DELETE FROM {table} WHERE {file_name} IN ({removed})'
+            cmd = cmd.format(table=table, file_name=self.FILENAME_COL,
+                             removed=removed)
+            self.database.execute(cmd, close=False)
+
+        self._remove_from_summary(counted)
+        self.database.execute('DROP TABLE {0}'.format(self._REMOVE_TABLE),
+                              close=False)
+
+        promoted = []
+        if promote and self.duplicates is not None:
+            promoted = self._promote_duplicates(close=False)
+        self.database.close(close)
+        return promoted
+
+    def _collect_removed_values(self, removed):
+        # store the counted values of the files that will be removed
+        # (select statement removed) and return the change of the number of
+        # instances and bytes
+        columns = self.database.column_names(self.MAIN_TABLE, close=False)
+        counted = [(name, tagname) for name, tagname in self._SUMMARY_COUNTS \
+                   if tagname in columns]
+
+        cmd = 'CREATE TEMP TABLE IF NOT EXISTS {table} (name TEXT, value)'
+        self.database.execute(cmd.format(table=self._REMOVED_VALUES),
+                              close=False)
+        self.database.execute('DELETE FROM {0}'.format(self._REMOVED_VALUES),
+                              close=False)
+
+        for name, tagname in counted:
+            cmd = ('INSERT INTO {values} (name, value) '
+                   'SELECT DISTINCT ?, {tag} FROM {table} '
+                   'WHERE {tag} IS NOT NULL AND {file_name} IN ({removed})')
+            cmd = cmd.format(values=self._REMOVED_VALUES, tag=tagname,
+                             table=self.MAIN_TABLE,
+                             file_name=self.FILENAME_COL, removed=removed)
+            self.database.execute(cmd, values=[name], close=False)
+
+        cmd = 'SELECT SUM({size}) FROM {table} WHERE {file_name} IN ({removed})'
+        cmd = cmd.format(size=self.FILE_SIZE_COL, table=self.MAIN_TABLE,
+                         file_name=self.FILENAME_COL, removed=removed)
+        size = self.database.execute(cmd, fetch_all=True, close=False)[0][0]
+        return counted, size or 0
+
+    def _remove_from_summary(self, counted):
+        # after the rows were deleted, values collected by
+        # _collect_removed_values that are no longer in the database are
+        # subtracted from the stored summary
+        counted, size = counted
+        delta = {self.BYTES: -size}
+        for name, tagname in counted:
+            cmd = ('SELECT COUNT(*) FROM {values} AS v WHERE v.name=? AND '
+                   'NOT EXISTS (SELECT 1 FROM {table} WHERE {tag}=v.value)')
+            cmd = cmd.format(values=self._REMOVED_VALUES,
+                             table=self.MAIN_TABLE, tag=tagname)
+            delta[name] = -self.database.execute(cmd, values=[name],
+                                                 fetch_all=True,
+                                                 close=False)[0][0]
+        self._change_summary(delta, close=False)
+        self.database.execute('DROP TABLE {0}'.format(self._REMOVED_VALUES),
+                              close=False)
 
-        self.database.close()
+    @property
+    def pending_files(self):
+        """ Return the files that were indexed from a DICOMDIR and of which
+        the full header was not read yet """
+        return self.database.get_column(self._PENDING_TABLE,
+                                        self.FILENAME_COL)
 
-    def remove_file(self, file_name, close=True):
-        """ Remove file from database """
+    def parse_pending(self, files=None, limit=None):
+        """ Read the full header of files that were indexed from a DICOMDIR.
+        Only pending files in files are read if files is given and at most
+        limit files are read. Returns the files that were read. """
+        pending = self.pending_files
+        if files is not None:
+            files = set(files)
+            pending = [file for file in pending if file in files]
+        if limit is not None:
+            pending = pending[:limit]
+
+        self.update_files(pending)
+        return pending
+
+    def _index_dicomdirs(self, new_files):
+        # insert the files referenced by the new DICOMDIR files from the
+        # directory records, returns the new files that still have to be read
+        dicomdirs = [file for file in new_files \
+                     if os.path.basename(file) == self._DICOMDIR]
+        if not dicomdirs:
+            return new_files
+
+        remaining = set(new_files)
+        columns = self.database.column_names(self.MAIN_TABLE, close=False)
+        cmd = 'INSERT OR IGNORE INTO {table} ({file_name}) VALUES (?)'
+        cmd = cmd.format(table=self._PENDING_TABLE,
+                         file_name=self.FILENAME_COL)
+
+        for dicomdir in dicomdirs:
+            folder = os.path.dirname(dicomdir)
+            try:
+                records = list(sdtk.dicom_reader.read_dicomdir(
+                    os.path.join(self.path, dicomdir)))
+            except Exception:
+                self.logger.info('Cannot read %s', dicomdir)
+                continue # read as a normal file
+
+            self.logger.info('Indexing %i files from %s', len(records),
+                             dicomdir)
+            self._record_rejected({dicomdir: self.REJECT_DICOMDIR})
+            remaining.discard(dicomdir)
+
+            for file, header in records:
+                file = os.path.normpath(os.path.join(folder, file))
+                if file not in remaining:
+                    continue # not found or already in database
+                remaining.discard(file)
+
+                self.database.insert_row_dict(self._FILENAME_TABLE,
+                                              {self.FILENAME_COL: file},
+                                              close=False)
+                new_columns = self._insert_header(file, header, columns,
+                                                  close=False)
+                columns = list(set(columns + new_columns))
+                self.database.execute(cmd, values=[file], close=False)
 
-        self.database.delete_rows(DatabaseBuilder.MAIN_TABLE,
-                                  column=DatabaseBuilder.FILENAME_COL,
-                                  value=file_name, close=False)
+            self.database.close()
 
-        self.database.delete_rows(DatabaseBuilder._FILENAME_TABLE,
-                                  column=DatabaseBuilder.FILENAME_COL,
-                                  value=file_name, close=False)
+        return [file for file in new_files if file in remaining]
 
-        if close:
-            self.database.close()
+    def update_files(self, file_names, silent=True):
+        """ Read modified files again. The old rows are removed in bulk (see
+        remove_files) before the files are inserted. """
+        if not file_names:
+            return
+
+        self.logger.info('Updating %i files', len(file_names))
+        promoted = self.remove_files(file_names)
+        self.insert_files(file_names + promoted, silent=silent)
+        self.checkpoint()
 
+    def remove_file(self, file_name, close=True):
+        """ Remove file from database, see remove_files """
+        return self.remove_files([file_name], close=close)
+
+    def _file_filter(self, where, alias='p'):
+        # restrict rows of the tag presence table (alias p) or the tag value
+        # table to the files in the main table that match the where clause
+        if not where:
+            return ''
+        file_filter = ('AND {alias}.{file_id} IN '
+                       '(SELECT {id} FROM {table} {where})')
+        return file_filter.format(alias=alias, file_id=self._FILE_ID_COL,
+                                  id=self.ID_COL,
+                                  table=self.MAIN_TABLE, where=where)
+
+    def _get_tag_ids(self, tag_names):
+        # return the tag ids for the tag names, tag names that are not yet
+        # in the tag table are added
+        if self._tag_ids is None:
+            rows = self.database.query(self._TAG_TABLE, close=False,
+                                       column_names=[self._TAG_NAME_COL,
+                                                     self._TAG_ID_COL])
+            self._tag_ids = dict(rows)
+
+        for tag_name in tag_names:
+            if tag_name in self._tag_ids:
+                continue
+            # tag may have been added by another builder on the same file
+            cmd = 'INSERT OR IGNORE INTO {table} ({tag_name}) VALUES (?)'
+            cmd = cmd.format(table=self._TAG_TABLE,
+                             tag_name=self._TAG_NAME_COL)
+            self.database.execute(cmd, values=[tag_name], close=False)
+            tag_id = self.database.get_column(self._TAG_TABLE,
+                                              self._TAG_ID_COL, close=False,
+                                              **{self._TAG_NAME_COL: tag_name})
+            self._tag_ids[tag_name] = tag_id[0]
+
+        return [self._tag_ids[tag_name] for tag_name in tag_names]
+
+    def _insert_side_values(self, file_id, side_values):
+        # store values of side tags for the file with file_id
+        if not side_values:
+            return
+        cmd = ('INSERT OR REPLACE INTO {table} ({file_id}, {tag_id}, {value}) '
+               'VALUES (?, ?, ?)')
+        cmd = cmd.format(table=self._VALUE_TABLE, file_id=self._FILE_ID_COL,
+                         tag_id=self._TAG_ID_COL, value=self._VALUE_COL)
+        tag_ids = self._get_tag_ids(list(side_values.keys()))
+        values = [(file_id, tag_id, value) for tag_id, value \
+                  in zip(tag_ids, side_values.values())]
+        self.database.executemany(cmd, values, close=False)
+
+    def _insert_pixel_data(self, file_id, header, offset, length):
+        # store location and format of the pixel data of the file with file_id
+        values = [getattr(header, tag, None) for tag in self._PIXEL_TAGS]
+        if None in values[:2]:
+            return # no image (rows and columns)
+        try:
+            values = [None if value is None else int(value) \
+                      for value in values]
+        except (TypeError, ValueError):
+            self.logger.info('Invalid pixel data tags in file %s', file_id)
+            return
+
+        cmd = ('INSERT OR REPLACE INTO {table} ({columns}) '
+               'VALUES ({bindings})')
+        columns = [self._FILE_ID_COL] + list(self._PIXEL_COLUMNS)
+        cmd = cmd.format(table=self._PIXEL_TABLE, columns=', '.join(columns),
+                         bindings=', '.join(['?'] * len(columns)))
+        values = [file_id, offset, length,
+                  sdtk.dicom_reader.transfer_syntax(header)] + values
+        self.database.execute(cmd, values=values, close=False)
+
+    def get_pixel_data(self, file_ids, close=True):
+        """ Return a dictionary with a PixelDataRecord for each file id (id
+        in the main table) that has pixel data. file_ids may be a list or a
+        Subquery. File names are relative to path. """
+        cmd = ('SELECT p.{file_id}, m.{file_name}, {columns} '
+               'FROM {table} AS p JOIN {main_table} AS m '
+               'ON m.{id} = p.{file_id} {where}')
+        where, values = self.database._where_clause(
+            **{'p.' + self._FILE_ID_COL: file_ids})
+        columns = ', '.join('p.' + column for column in self._PIXEL_COLUMNS)
+        cmd = cmd.format(file_id=self._FILE_ID_COL, id=self.ID_COL,
+                         file_name=self.FILENAME_COL, columns=columns,
+                         table=self._PIXEL_TABLE, main_table=self.MAIN_TABLE,
+                         where=where)
+        result = self.database.execute(cmd, values=values, fetch_all=True,
+                                       close=close)
+        return {row[0]: sdtk.dicom_reader.PixelDataRecord(*row[1:]) \
+                for row in result}
+
+    def _index_tags(self, file_id, tag_names, close=True):
+        # store which tags are present in the file with file_id
+        cmd = ('INSERT OR IGNORE INTO {table} ({file_id}, {tag_id}) '
+               'VALUES (?, ?)')
+        cmd = cmd.format(table=self._TAG_PRESENCE_TABLE,
+                         file_id=self._FILE_ID_COL,
+                         tag_id=self._TAG_ID_COL)
+        values = [(file_id, tag_id) for tag_id in self._get_tag_ids(tag_names)]
+        self.database.executemany(cmd, values, close=close)
+
+    def _index_tag_names(self):
+        # populate the tag presence table from the tag names stored with
+        # each file. Needed once for databases created by older versions.
+        rows = self.database.query(self.MAIN_TABLE, close=False,
+                                   column_names=[self.ID_COL,
+                                                 self.TAGNAMES_COL])
+        if not rows:
+            return
+
+        self.logger.info('Indexing tag names for %i files', len(rows))
+        for file_id, tag_names in rows:
+            self._index_tags(file_id, json.loads(tag_names), close=False)
+        self.database.close()
 
     def _add_column_for_tags(self, tag_names, skip_check=False):
         # add columns to the databse for the given tag_names
@@ -726,32 +2481,71 @@ class DatabaseBuilder(sdtk.Logger):
         else:
             existing_columns = []
 
-        var_type = sdtk.SQLiteWrapper.TEXT # everything is stored as text
+        var_type = self.codec.COLUMN_TYPE # type of all tag columns
 
         for tag_name in tag_names:
             if tag_name not in existing_columns:
                 self.database.add_column(self.MAIN_TABLE, tag_name,
                                          close=False, var_type=var_type)
 
+        counted = [tag for _, tag in self._SUMMARY_COUNTS if tag in tag_names]
+        if counted:
+            self._create_summary_indexes(columns=counted)
+
+    def rescan(self, silent=True):
+        """ Scan path again, add new files and remove files that no longer
+        exist. Returns True if the database changed. """
+        return self._update_db(files=self.file_list(self.path), silent=silent)
+
     def _update_db(self, files=None, existing_files=None, silent=False):
         # scan for file new and removed files in the path. Update the
-        # database with new files, remove files that are no longer in path
+        # database with new files, remove files that are no longer in path.
+        # Returns True if files were added or removed.
 
         if not files:
-            return
+            return False
 
         if existing_files is None:
             existing_files = self.files
 
         new_files, not_found = sdtk.FileScanner.compare(files, existing_files)
+
+        new_files, rejected = sdtk.FileScanner.filter_files(
+            new_files, folder=self.path, **self.file_rules)
+        if rejected:
+            self.logger.info('Skipping %i files by file rules', len(rejected))
+            self._record_rejected(rejected)
+
+        if self.dicomdir:
+            indexed = len(new_files)
+            new_files = self._index_dicomdirs(new_files)
+            indexed -= len(new_files)
+        else:
+            indexed = 0
+
         self.logger.info('Adding %i files and removing %i files',
                          len(new_files), len(not_found))
 
         # handle files that were not found
 
-        self.remove_files(not_found)
+        # commits removed files, duplicates of removed instances are added
+        # again
+        new_files += self.remove_files(not_found)
+
+        self.insert_files(new_files, silent=silent)
 
-        self.database.close() # commit removed files
+        changed = bool(new_files or not_found or indexed)
+        if changed:
+            self.checkpoint()
+
+        if new_files or rejected:
+            self.logger.info('Files not added to database: %s',
+                             self.rejections)
+        return changed
+
+    def insert_files(self, new_files, silent=True):
+        """ Insert a list of files in the database. Changes are committed
+        after every chunk of files. """
 
         if not new_files:
             return # nothing to add
@@ -798,33 +2592,215 @@ class DatabaseBuilder(sdtk.Logger):
             self.logger.debug('Committing changes to db')
             self.database.close() # commit changes
 
+    def checkpoint(self):
+        """ Move changes from the write-ahead log to the database file when
+        the database is in WAL mode. """
+        if str(self.journal_mode).upper() == sdtk.SQLiteWrapper.WAL:
+            self.database.checkpoint()
+
     @staticmethod
     def _create_filename_table(database):
         # create the main table with dicom tags as columns
         cmd = """CREATE TABLE  IF NOT EXISTS {table}
                  (id INTEGER AUTO_INCREMENT PRIMARY KEY ,
-                  {file_name} TEXT UNIQUE) """
+                  {file_name} TEXT UNIQUE,
+                  {reason} TEXT) """
 
 
         cmd = cmd.format(table=DatabaseBuilder._FILENAME_TABLE,
-                         file_name=DatabaseBuilder.FILENAME_COL)
+                         file_name=DatabaseBuilder.FILENAME_COL,
+                         reason=DatabaseBuilder.REASON_COL)
 
         database.execute(cmd)
 
     @staticmethod
-    def _create_main_table(database):
-        # create the main table with dicom tags as columns
+    def _create_main_table(database, table=None, columns=()):
+        # create the main table with dicom tags as columns. id is an alias
+        # of the rowid so file ids in the side tables survive a VACUUM.
+        # columns are (name, type) of additional columns
         cmd = """CREATE TABLE  IF NOT EXISTS {table}
-                 (id INTEGER AUTO_INCREMENT PRIMARY KEY ,
+                 ({id} INTEGER PRIMARY KEY,
                   {file_name} TEXT UNIQUE,
                   {file_size} INTEGER,
-                  {tag_names} TEXT)"""
+                  {tag_names} TEXT{columns})"""
 
-
-        cmd = cmd.format(table=DatabaseBuilder.MAIN_TABLE,
+        columns = ''.join(', {0} {1}'.format(*column) for column in columns)
+        cmd = cmd.format(table=table or DatabaseBuilder.MAIN_TABLE,
+                         id=DatabaseBuilder.ID_COL,
                          file_name=DatabaseBuilder.FILENAME_COL,
                          file_size=DatabaseBuilder.FILE_SIZE_COL,
-                         tag_names=DatabaseBuilder.TAGNAMES_COL)
+                         tag_names=DatabaseBuilder.TAGNAMES_COL,
+                         columns=columns)
+
+        database.execute(cmd)
+
+    def _migrate_main_table(self, database):
+        # older versions declared id as INTEGER AUTO_INCREMENT which is not
+        # an alias of the rowid, a VACUUM could renumber the rows. The rows
+        # are copied to a table with an id alias, keeping the rowid as id.
+        pragma = database.pragma(self.MAIN_TABLE, close=False)
+        types = {row[1]: row[2] for row in pragma}
+        if types.get(self.ID_COL, '').upper() == 'INTEGER':
+            database.close()
+            return
+
+        self.logger.info('Migrating %s to a stable file id', self.MAIN_TABLE)
+
+        fixed = (self.ID_COL, self.FILENAME_COL, self.FILE_SIZE_COL,
+                 self.TAGNAMES_COL)
+        columns = [(name, vtype) for name, vtype in types.items() \
+                   if name not in fixed]
+
+        cmd = ("SELECT sql FROM sqlite_master WHERE type='index' "
+               "AND tbl_name=? AND sql IS NOT NULL")
+        indexes = database.execute(cmd, values=[self.MAIN_TABLE],
+                                   fetch_all=True, close=False)
+
+        database.execute('DROP TABLE IF EXISTS {0}'.format(
+            self._MIGRATE_TABLE), close=False)
+        self._create_main_table(database, table=self._MIGRATE_TABLE,
+                                columns=columns)
+        names = ', '.join(list(fixed[1:]) + [name for name, _ in columns])
+        cmd = ('INSERT INTO {new} ({id}, {names}) '
+               'SELECT rowid, {names} FROM {table}')
+        cmd = cmd.format(new=self._MIGRATE_TABLE, id=self.ID_COL,
+                         names=names, table=self.MAIN_TABLE)
+        database.execute(cmd, close=False)
+        database.execute('DROP TABLE {0}'.format(self.MAIN_TABLE),
+                         close=False)
+        database.execute('ALTER TABLE {0} RENAME TO {1}'.format(
+            self._MIGRATE_TABLE, self.MAIN_TABLE), close=False)
+        for (index, ) in indexes:
+            database.execute(index, close=False)
+        database.close()
+
+    @staticmethod
+    def _create_pending_table(database):
+        # files indexed from a DICOMDIR of which the header was not read
+        cmd = """CREATE TABLE IF NOT EXISTS {table}
+                 ({file_name} TEXT PRIMARY KEY)"""
+
+        cmd = cmd.format(table=DatabaseBuilder._PENDING_TABLE,
+                         file_name=DatabaseBuilder.FILENAME_COL)
+
+        database.execute(cmd)
+
+    @staticmethod
+    def _create_pixel_table(database):
+        # offset and length of the pixel data in the file and the tags
+        # needed to interpret it, one row for each file with pixel data
+        cmd = """CREATE TABLE IF NOT EXISTS {table}
+                 ({file_id} INTEGER PRIMARY KEY,
+                  offset INTEGER,
+                  length INTEGER,
+                  transfer_syntax TEXT,
+                  rows INTEGER,
+                  columns INTEGER,
+                  frames INTEGER,
+                  samples_per_pixel INTEGER,
+                  bits_allocated INTEGER,
+                  bits_stored INTEGER,
+                  pixel_representation INTEGER)"""
+
+        cmd = cmd.format(table=DatabaseBuilder._PIXEL_TABLE,
+                         file_id=DatabaseBuilder._FILE_ID_COL)
+
+        database.execute(cmd)
+
+    @staticmethod
+    def _create_duplicate_table(database):
+        # files of instances that are stored with another file, with the
+        # encoded SOPInstanceUID of the instance
+        cmd = """CREATE TABLE IF NOT EXISTS {table}
+                 ({file_name} TEXT PRIMARY KEY,
+                  {uid})"""
+
+        cmd = cmd.format(table=DatabaseBuilder._DUPLICATE_TABLE,
+                         file_name=DatabaseBuilder.FILENAME_COL,
+                         uid=sdtk.SOPINSTANCEUID)
+        database.execute(cmd, close=False)
+
+        cmd = """CREATE INDEX IF NOT EXISTS {table}_{uid}
+                 ON {table} ({uid})"""
+        cmd = cmd.format(table=DatabaseBuilder._DUPLICATE_TABLE,
+                         uid=sdtk.SOPINSTANCEUID)
+        database.execute(cmd)
+
+    @staticmethod
+    def _create_value_table(database):
+        # values of side tags, one row for each file and tag. Values have no
+        # type affinity and are stored as encoded by the codec.
+        cmd = """CREATE TABLE IF NOT EXISTS {value_table}
+                 ({file_id} INTEGER,
+                  {tag_id} INTEGER,
+                  {value},
+                  PRIMARY KEY ({file_id}, {tag_id})) WITHOUT ROWID"""
+
+        cmd = cmd.format(value_table=DatabaseBuilder._VALUE_TABLE,
+                         file_id=DatabaseBuilder._FILE_ID_COL,
+                         tag_id=DatabaseBuilder._TAG_ID_COL,
+                         value=DatabaseBuilder._VALUE_COL)
+
+        database.execute(cmd, close=False)
+
+        cmd = """CREATE INDEX IF NOT EXISTS {value_table}_{tag_id}_{value}
+                 ON {value_table} ({tag_id}, {value})"""
+
+        cmd = cmd.format(value_table=DatabaseBuilder._VALUE_TABLE,
+                         tag_id=DatabaseBuilder._TAG_ID_COL,
+                         value=DatabaseBuilder._VALUE_COL)
+
+        database.execute(cmd)
+
+    @staticmethod
+    def _create_tag_tables(database):
+        # tag names are stored once in the tag table. The presence table
+        # links each file (id in main table) to the tags in its header.
+        cmd = """CREATE TABLE IF NOT EXISTS {tag_table}
+                 ({tag_id} INTEGER PRIMARY KEY,
+                  {tag_name} TEXT UNIQUE)"""
+
+        cmd = cmd.format(tag_table=DatabaseBuilder._TAG_TABLE,
+                         tag_id=DatabaseBuilder._TAG_ID_COL,
+                         tag_name=DatabaseBuilder._TAG_NAME_COL)
+
+        database.execute(cmd, close=False)
+
+        cmd = """CREATE TABLE IF NOT EXISTS {presence_table}
+                 ({file_id} INTEGER,
+                  {tag_id} INTEGER,
+                  PRIMARY KEY ({tag_id}, {file_id})) WITHOUT ROWID"""
+
+        cmd = cmd.format(presence_table=DatabaseBuilder._TAG_PRESENCE_TABLE,
+                         tag_id=DatabaseBuilder._TAG_ID_COL,
+                         file_id=DatabaseBuilder._FILE_ID_COL)
+
+        database.execute(cmd, close=False)
+
+        cmd = """CREATE INDEX IF NOT EXISTS {presence_table}_{file_id}
+                 ON {presence_table} ({file_id})"""
+
+        cmd = cmd.format(presence_table=DatabaseBuilder._TAG_PRESENCE_TABLE,
+                         file_id=DatabaseBuilder._FILE_ID_COL)
+
+        database.execute(cmd)
+
+    @staticmethod
+    def _create_summary_table(database):
+        # single row table with the counts for the entire database
+        cmd = """CREATE TABLE  IF NOT EXISTS {table}
+                 ({patients} INTEGER,
+                  {studies} INTEGER,
+                  {series} INTEGER,
+                  {instances} INTEGER,
+                  {bytes} INTEGER)"""
+
+        cmd = cmd.format(table=DatabaseBuilder._SUMMARY_TABLE,
+                         patients=DatabaseBuilder.PATIENTS,
+                         studies=DatabaseBuilder.STUDIES,
+                         series=DatabaseBuilder.SERIES,
+                         instances=DatabaseBuilder.INSTANCES,
+                         bytes=DatabaseBuilder.BYTES)
 
         database.execute(cmd)
 
@@ -844,7 +2820,7 @@ class DatabaseBuilder(sdtk.Logger):
                          path_col=DatabaseBuilder._INFO_PATH_COL)
 
         database.execute(cmd)
-        values = [None, 'Version', version, path]
+        values = [None, DatabaseBuilder._INFO_VERSION, version, path]
         database.insert_list(DatabaseBuilder._INFO_TABLE, values)
 
     @staticmethod
@@ -854,9 +2830,9 @@ class DatabaseBuilder(sdtk.Logger):
             yield iterable[i:i + chunksize]
 
     @staticmethod
-    def _encode(header, use_private_tags=False):
+    def _encode(header, use_private_tags=False, codec=None):
         # pydicom header to dictionary with (json) encoded values
         return sdtk.Header.from_pydicom_header(
-                header, use_private_tags=use_private_tags)
+                header, use_private_tags=use_private_tags, codec=codec)
 
 
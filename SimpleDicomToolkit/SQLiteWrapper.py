@@ -4,10 +4,29 @@ Created on Tue Sep  5 16:54:20 2017
 @author: HeyDude
 """
 import logging
+import threading
 import sqlite3 as lite
+from collections import namedtuple
 from SimpleDicomToolkit import Logger
 
 
+# value for a where clause, selects rows for which the column is IN the result
+# of the select statement sql with the (bound) values
+Subquery = namedtuple('Subquery', ['sql', 'values'])
+
+
+class _ConnectionState:
+    # open connection of a SQLiteWrapper
+    connected = False
+    connection = None
+    cursor = None
+    row_factory = None
+
+class _ThreadConnectionState(_ConnectionState, threading.local):
+    # each thread opens its own connection
+    pass
+
+
 class SQLiteWrapper(Logger):
     """ Pythonic interface for a sqlite3 database """
 
@@ -21,23 +40,46 @@ class SQLiteWrapper(Logger):
     INTEGER     = 'INTEGER'
     BLOB        = 'BLOB'
     ROWID       = 'rowid'
+    FETCH_SIZE  = 1000 # number of rows fetched at once by iter_query
     _LOG_LEVEL  = logging.ERROR
 
     START       = 'start'
     END         = 'end'
-    __row_factory = None
 
-    def __init__(self, database_file=None):
+    # journal modes, WAL allows readers while a single writer is active
+    WAL         = 'WAL'
+    DELETE      = 'DELETE'
+
+    Subquery    = Subquery
+
+    def __init__(self, database_file=None, journal_mode=None,
+                 busy_timeout=None, synchronous=None, thread_local=False):
         """ Connect to database and create tables
         database:   new or existing database file
-        table_name:     names for table(s) that will be used. If they don't
-                        exist they will be created."""
+        journal_mode:   sqlite journal mode, e.g. WAL to allow concurrent
+                        readers while writing. None keeps the current mode.
+        busy_timeout:   time in milliseconds to wait for a lock held by
+                        another connection before raising an error.
+        synchronous:    sqlite synchronous setting (OFF, NORMAL, FULL).
+                        NORMAL is safe in WAL mode and faster than FULL.
+        thread_local:   use a separate connection in each thread, the
+                        wrapper can be shared between threads. Not
+                        possible for in memory databases."""
         super().__init__()
 
+        if thread_local and database_file == self.IN_MEMORY:
+            raise ValueError('In memory databases cannot be thread local')
+        self.thread_local = thread_local
+        self._state = _ThreadConnectionState() if thread_local \
+            else _ConnectionState()
+
         if database_file is None:
             database_file = self.DATABASE_FILE
 
         self.database_file = database_file
+        self.journal_mode = journal_mode
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
         self.connected = False # self.connect() needs this attribute
         self.connection = None # Databse connection
         self.cursor = None # Database cursor
@@ -71,6 +113,22 @@ class SQLiteWrapper(Logger):
 
         return result
 
+    def executemany(self, sql_query, values, close=True):
+        """ Execute a sql query for each set of values in a single call """
+        self.connect()
+
+        self.logger.debug(sql_query)
+        try:
+            result = self.cursor.executemany(sql_query, values)
+        except:
+            self.logger.error('Could not excute query: \n %s', sql_query)
+            raise
+
+        if close:
+            self.close()
+
+        return result
+
     def add_columns(self, table_name, column_names, var_type=None,
                     close=True):
         """ Add columns to a table """
@@ -203,6 +261,62 @@ class SQLiteWrapper(Logger):
 
             columns specifies which columns will be returned.
         """
+        query, values = self._select_statement(source_table,
+                                               column_names=column_names,
+                                               sort_by=sort_by,
+                                               distinct=distinct,
+                                               sort_decimal=sort_decimal,
+                                               **kwargs)
+
+        self.logger.debug('Executing query')
+        self.logger.debug(query)
+        self.logger.debug(values)
+
+        result = self.execute(query, values=values, fetch_all=True,
+                              close=close)
+
+        return result
+
+    def iter_query(self, source_table, column_names=None, sort_by=None,
+                   distinct=False, sort_decimal=False, batch_size=None,
+                   **kwargs):
+        """ Generator version of query. Rows are fetched in batches of
+        batch_size rows, only a single batch is kept in memory. The query
+        runs on its own connection, other queries can be executed while
+        iterating. """
+        query, values = self._select_statement(source_table,
+                                               column_names=column_names,
+                                               sort_by=sort_by,
+                                               distinct=distinct,
+                                               sort_decimal=sort_decimal,
+                                               **kwargs)
+        if batch_size is None:
+            batch_size = self.FETCH_SIZE
+
+        if self.in_memory:
+            # an in memory database only exists for the open connection
+            self.connect()
+            connection = self.connection
+        else:
+            connection = self._open_connection()
+
+        self.logger.debug(query)
+        cursor = connection.cursor()
+        try:
+            cursor.execute(query, values)
+            rows = cursor.fetchmany(batch_size)
+            while rows:
+                yield from rows
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            cursor.close()
+            if connection is not self.connection:
+                connection.close()
+
+    def _select_statement(self, source_table, column_names=None,
+                          sort_by=None, distinct=False, sort_decimal=False,
+                          **kwargs):
+        # construct a select statement and the values for the where clause
         query = ('SELECT {distinct} {column_names} '
                  'FROM {source_table} {where_clause} {order_q}')
 
@@ -228,14 +342,7 @@ class SQLiteWrapper(Logger):
                              order_q=order_q,
                              distinct=distinct)
 
-        self.logger.debug('Executing query')
-        self.logger.debug(query)
-        self.logger.debug(values)
-
-        result = self.execute(query, values=values, fetch_all=True,
-                              close=close)
-
-        return result
+        return query, values
 
 
     def insert_list(self, table_name, values, column_names=None, close=True):
@@ -270,7 +377,8 @@ class SQLiteWrapper(Logger):
         else:
             cmd += SQLiteWrapper.binding_str(1)
 
-        self.execute(cmd, values=values, close=close)
+        result = self.execute(cmd, values=values, close=close)
+        return result.lastrowid
 
     def insert_lists(self, table_name, values, column_names=None, close=True):
         """ Insert a  list with values as multiple rows. Each value in a row
@@ -311,7 +419,8 @@ class SQLiteWrapper(Logger):
         columns = list(data_dict.keys())
         values = list(data_dict.values())
 
-        self.insert_list(table_name, values, column_names=columns, close=close)
+        return self.insert_list(table_name, values, column_names=columns,
+                                close=close)
 
     def delete_rows(self, table_name, column=None, value=None, close=True):
         """
@@ -327,19 +436,74 @@ class SQLiteWrapper(Logger):
         """Connect to the SQLite3 database."""
 
         if not self.connected:
-            try:
-                self.connection = lite.connect(self.database_file)
-
-            except lite.OperationalError:
-                msg = 'Could not connect to %s'
-                self.logger.error(msg, self.database_file)
-                raise
+            self.connection = self._open_connection()
             self.connection.row_factory = self._row_factory
             self.cursor = self.connection.cursor()
             self.connected = True
             if self._LOG_LEVEL == logging.DEBUG:
                 self.connection.set_trace_callback(print)
 
+    def _open_connection(self):
+        # open a new connection and apply the pragmas of this database
+        try:
+            connection = lite.connect(self.database_file)
+        except lite.OperationalError:
+            msg = 'Could not connect to %s'
+            self.logger.error(msg, self.database_file)
+            raise
+
+        if self.busy_timeout is not None:
+            connection.execute('PRAGMA busy_timeout = {0}'.format(
+                int(self.busy_timeout)))
+        if self.journal_mode is not None and not self.in_memory:
+            connection.execute('PRAGMA journal_mode = {0}'.format(
+                self.journal_mode))
+        if self.synchronous is not None:
+            connection.execute('PRAGMA synchronous = {0}'.format(
+                self.synchronous))
+        return connection
+
+    def checkpoint(self, mode='TRUNCATE', close=True):
+        """ Copy the contents of the write ahead log to the database file.
+        Only has effect in WAL mode. TRUNCATE also empties the log file. """
+        cmd = 'PRAGMA wal_checkpoint({mode})'.format(mode=mode)
+        result = self.execute(cmd, fetch_all=True, close=close)
+        return result[0] if result else None
+
+    def backup(self, database_file, close=True):
+        """ Write a consistent snapshot of this database to database_file
+        with the sqlite online backup API. The content of database_file is
+        replaced. """
+        self.connect()
+        self.connection.commit()
+        target = SQLiteWrapper(database_file, journal_mode=self.journal_mode,
+                               busy_timeout=self.busy_timeout,
+                               synchronous=self.synchronous)
+        connection = target._open_connection()
+        try:
+            self.connection.backup(connection)
+        finally:
+            connection.close()
+        self.close(close)
+
+    def restore(self, database_file, close=True):
+        """ Replace the content of this database with a copy of
+        database_file with the sqlite online backup API, e.g. to load a
+        database file in memory. """
+        self.connect()
+        source = lite.connect(database_file)
+        try:
+            source.backup(self.connection)
+        finally:
+            source.close()
+        self.close(close)
+
+    @property
+    def total_changes(self):
+        """ Number of rows changed since the connection was opened """
+        self.connect()
+        return self.connection.total_changes
+
     def close(self, close=True):
         """Dicconnect form the SQLite3 database and commit changes."""
 
@@ -381,19 +545,42 @@ class SQLiteWrapper(Logger):
                          where = where)
         return self.execute(cmd, values=values, fetch_all=True)[0][0]
 
+    def aggregate(self, table, expressions, close=True, **kwargs):
+        """
+        Evaluate multiple aggregate expressions, e.g. COUNT(DISTINCT col),
+        in a single query. Returns a tuple with a result for each expression
+        """
+        where, values = self._where_clause(**kwargs)
+        cmd = 'SELECT {expressions} FROM {table} {where}'
+        cmd = cmd.format(table=table, where=where,
+                         expressions=self._list_to_string(expressions))
+        return tuple(self.execute(cmd, values=values, fetch_all=True,
+                                  close=close)[0])
+
     def column_has_value(self, table, column, value):
         """ True if column contains the value """
         cmd = 'SELECT EXISTS(SELECT 1 FROM {table} WHERE {column}=? LIMIT 1)'
         cmd = cmd.format(table=table, column=column)
         return bool(self.execute(cmd, values=[value], fetch_all=True)[0][0])
 
-    def set_column_where(self, table, column, value, **kwargs):
+    def column_has_values(self, table, column, close=True, **kwargs):
+        """ True if column contains a value that is not NULL in the rows where
+        criterium is met """
+        where, values = self._where_clause(**kwargs)
+        not_null = '{column} IS NOT NULL'.format(column=column)
+        where = where + ' AND ' + not_null if where else 'WHERE ' + not_null
+        cmd = 'SELECT EXISTS(SELECT 1 FROM {table} {where} LIMIT 1)'
+        cmd = cmd.format(table=table, where=where)
+        return bool(self.execute(cmd, values=values, fetch_all=True,
+                                 close=close)[0][0])
+
+    def set_column_where(self, table, column, value, close=True, **kwargs):
         """ Set values in a column where criterium is met """
         cmd = "UPDATE {table} SET {column} = ? {where_clause}"
         where_clause, values = self._where_clause(**kwargs)
         cmd = cmd.format(table=table, column=column, where_clause=where_clause)
         values = [value, *values]
-        self.execute(cmd, values=values)
+        self.execute(cmd, values=values, close=close)
 
     def get_column_where(self, table, column, sort_by=None, sort_decimal=False,
                          **kwargs):
@@ -411,34 +598,54 @@ class SQLiteWrapper(Logger):
     def pragma(self, table_name, close=True):
         """ Return information about the table """
         cmd = 'PRAGMA TABLE_INFO({table_name})'.format(table_name=table_name)
-        result = self.execute(cmd, fetch_all=True)
-        self.close(close)
-        return result
+        return self.execute(cmd, fetch_all=True, close=close)
 
     def column_names(self, table_name, close=True):
         """ Return all column names in the table """
-        pragma = self.pragma(table_name)
-        column_names = [pi[1] for pi in pragma]
-        self.close(close)
-        return column_names
+        pragma = self.pragma(table_name, close=close)
+        return [pi[1] for pi in pragma]
 
     @property
     def in_memory(self):
         """ Return True if database soly exists in memory """
         return self.database_file == SQLiteWrapper.IN_MEMORY
 
+    @property
+    def connected(self):
+        return self._state.connected
+
+    @connected.setter
+    def connected(self, connected):
+        self._state.connected = connected
+
+    @property
+    def connection(self):
+        return self._state.connection
+
+    @connection.setter
+    def connection(self, connection):
+        self._state.connection = connection
+
+    @property
+    def cursor(self):
+        return self._state.cursor
+
+    @cursor.setter
+    def cursor(self, cursor):
+        self._state.cursor = cursor
+
     @property
     def _row_factory(self):
         """
         Set the row factory to format sql responses
         """
-        return self.__row_factory
+        return self._state.row_factory
 
     @_row_factory.setter
     def _row_factory(self, factory):
-        self.__row_factory = factory
+        self._state.row_factory = factory
         if self.connected:
-            self.connection.row_factory = self.__row_factory
+            self.connection.row_factory = factory
             self.cursor = self.connection.cursor()
 
     @property
@@ -527,7 +734,10 @@ class SQLiteWrapper(Logger):
         def _single_clause(column, val):
             # construct a part of the where clause statement for single
             # column and value
-            if isinstance(val, (list, tuple)):
+            if isinstance(val, Subquery):
+                expr = column + ' IN (' + val.sql + ')'
+                val = list(val.values)
+            elif isinstance(val, (list, tuple)):
                 expr = column + ' IN '+ SQLiteWrapper.binding_str(len(val))
             elif SQLiteWrapper.is_between_dict(val):
                 expr, val = _between(val)
@@ -2,10 +2,15 @@ from SimpleDicomToolkit.logger import Logger, applogger
 from SimpleDicomToolkit.progress_bar import progress_bar
 from SimpleDicomToolkit.dicom_tags import *
 from SimpleDicomToolkit import dicom_reader
+from SimpleDicomToolkit.value_codec import JSONCodec, BinaryCodec, get_codec
 from SimpleDicomToolkit.dicom_parser import Encoder, Decoder, Header
 from SimpleDicomToolkit.SQLiteWrapper import SQLiteWrapper
 from SimpleDicomToolkit.file_scanner import FileScanner
 from SimpleDicomToolkit.DicomDatabaseSQL import Database
+from SimpleDicomToolkit.federated_database import FederatedDatabase
+from SimpleDicomToolkit.preview_cache import PreviewCache
+from SimpleDicomToolkit.watcher import DatabaseWatcher, WatchEvent
 
 
 
+from SimpleDicomToolkit.registry import DatabaseRegistry, SharedCache, get_database
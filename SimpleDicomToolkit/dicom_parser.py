@@ -6,12 +6,12 @@ Created on Tue Sep  5 16:54:20 2017
 
 import warnings
 import logging
-import json
 from datetime import datetime
 
 import dateutil
 import pydicom
 from SimpleDicomToolkit.logger import Logger
+from SimpleDicomToolkit.value_codec import JSONCodec
 
 
 ISO_DATE = '%Y-%m-%d'
@@ -58,9 +58,10 @@ class Header(dict):
         return Header.from_pydicom_header(header)
 
     @staticmethod
-    def from_pydicom_header(header, use_private_tags=False):
+    def from_pydicom_header(header, use_private_tags=False, codec=None):
         """ Return Header from pydicom dataset """
-        hdict = Encoder.encode(header, use_private_tags=use_private_tags)
+        hdict = Encoder.encode(header, use_private_tags=use_private_tags,
+                               codec=codec)
         return Header.from_dict(hdict)
 
 
@@ -78,9 +79,10 @@ class Encoder():
     TM_NULL = '-1'
 
     @staticmethod
-    def encode(dicom_header, use_private_tags=False):
+    def encode(dicom_header, use_private_tags=False, codec=None):
         """ Convert a pydicom header to a dictionary with encoded names
-        as keys and (json) encoded values as values. """
+        as keys and (json) encoded values as values. Values are encoded by
+        codec, JSONCodec by default. """
 
         dicom_dict = {}
 
@@ -101,7 +103,7 @@ class Encoder():
                 # discard pixel data
                 continue
         
-            encoded = Encoder.encocode_element(element)
+            encoded = Encoder.encocode_element(element, codec=codec)
 
             if encoded is None:
                 continue # skip element that failed encoding
@@ -116,14 +118,14 @@ class Encoder():
         return dicom_dict
 
     @staticmethod
-    def encocode_element(element):
+    def encocode_element(element, codec=None):
         """ Return encoded name and encoded value for a pydicom element """
         name = Encoder._encode_tagname(element)
         if isinstance(element.value, pydicom.sequence.Sequence):
-            value = Encoder._encode_sequence(element)
+            value = Encoder._encode_sequence(element, codec=codec)
         else:
             try:
-                value = Encoder._encode_value(element)
+                value = Encoder._encode_value(element, codec=codec)
             except (TypeError, ValueError):
                 msg = '\nCannot encode {0}, ommitting tag\n'
                 warnings.warn(msg.format(element), RuntimeWarning)
@@ -133,11 +135,11 @@ class Encoder():
         return name, value
 
     @staticmethod
-    def encode_value_with_tagname(tagname, value):
+    def encode_value_with_tagname(tagname, value, codec=None):
         """ Convert a value corresponding with tagname """
         _, VR, VM = Decoder.decode_tagname(tagname)
 
-        return Encoder.convert_value(value, VR)
+        return Encoder.convert_value(value, VR, codec=codec)
 
     @staticmethod
     def _encode_tagname(element):
@@ -158,42 +160,51 @@ class Encoder():
         return name
 
     @staticmethod
-    def _encode_sequence(seqs):
+    def _encode_sequence(seqs, codec=None):
+        if codec is None:
+            codec = JSONCodec
 
         # iterate over sequences each element of a sequence is a dataset
         values = []
         for seq in seqs:
-            values += [Encoder.encode(seq)]
-        value = json.dumps(values)
+            values += [Encoder.encode(seq, codec=codec)]
+        value = codec.pack(values)
         return value
 
     @staticmethod
-    def _encode_value(element):
+    def _encode_value(element, codec=None):
         # encode the value of a pydicom element to a json string
+        if codec is None:
+            codec = JSONCodec
 
         vr = element.VR
         vm = element.VM
         if Encoder.is_multiple(element.VM):
             # convert to list before converting elements in list
 
-            value = json.dumps([Encoder.convert_value(vi, VR=vr, VM=vm)\
+            value = codec.pack([Encoder.convert_value(vi, VR=vr, VM=vm,
+                                                      codec=codec)\
                                 for vi in element.value])
 
         else:
-            value = Encoder.convert_value(element.value, VR=vr, VM=vm)
+            value = Encoder.convert_value(element.value, VR=vr, VM=vm,
+                                          codec=codec)
         return value
 
     @staticmethod
-    def convert_value(value, VR='', VM='1'):
+    def convert_value(value, VR='', VM='1', codec=None):
         """ Convert a value to a sqlite3 compatible value. Most values will
-        be converted to json strings. """
+        be converted to json strings by the default JSONCodec. """
+        if codec is None:
+            codec = JSONCodec
+
         if isinstance(value, pydicom.valuerep.PersonName3):
             # special treatment of person names
             
             if isinstance(value.original_string, bytes):
-                value = json.dumps(value.original_string.decode())
+                value = codec.dumps(value.original_string.decode())
             else:
-                value = json.dumps(value.original_string)
+                value = codec.dumps(value.original_string)
         elif VR == 'DA': # DATE
             if value == '':
                 value = Encoder.DA_NULL
@@ -221,14 +232,14 @@ class Encoder():
 
         elif VR == 'AT':
             # dicom tag reference
-            value = json.dumps(value.real)
+            value = codec.dumps(value.real)
         elif isinstance(value, bytes):
             # bytes are converted to hex string
-            value = json.dumps(value.hex())
+            value = codec.dumps(value.hex())
         else:
             # Convert also ints and floats to string, stored as text in
             # database for simplicity. All columns are text.
-            value = json.dumps(value)
+            value = codec.dumps(value)
 
         return value
 
@@ -251,21 +262,22 @@ class Decoder():
         """ Complementary to the pydicom.datadict functions. Dictionary
         returns tag for keyword. """
 
-        # lazy instanciation
-        if not self._tag_dict:
+        # lazy instanciation, shared by all instances
+        if not Decoder._tag_dict:
             tag_dict = {}
             for tag, item in pydicom.datadict.DicomDictionary.items():
                 tag_dict[item[-1]] = tag
-                self._tag_dict = tag_dict
-        return tag_dict
+            Decoder._tag_dict = tag_dict
+        return Decoder._tag_dict
 
     @staticmethod
-    def decode(header_dict):
+    def decode(header_dict, codec=None):
         """ Convert dictionary to pydicom dataset. """
         ds = pydicom.Dataset()
         for tagname, repval in header_dict.items():
             try:
-                value, tag, vr, vm = Decoder.decode_entry(tagname, repval)
+                value, tag, vr, vm = Decoder.decode_entry(tagname, repval,
+                                                          codec=codec)
             except:
                 raise ValueError('Cannot decode tag: {0} with value {1}'.format(tagname, repval))
             try:
@@ -285,21 +297,26 @@ class Decoder():
 
 
     @staticmethod
-    def decode_entry(tagname, value):
+    def decode_entry(tagname, value, codec=None):
         """ Decode a value with a given (encoded) tagname """
+        if codec is None:
+            codec = JSONCodec
+
         tag, vr, vm = Decoder.decode_tagname(tagname)
 
         if Decoder.is_sequence(tagname):
             # encoded sequence, recursive call
-            value = [Decoder.decode(vi) for vi in json.loads(value)]
+            value = [Decoder.decode(vi, codec=codec) \
+                     for vi in codec.unpack(value)]
             return value, tag, vr, vm
 
 
-        if Decoder.is_multiple(value):
-            value = json.loads(value)
-            value = [Decoder._decode_value(vi, VR=vr, VM=vm) for vi in value]
+        if Decoder.is_multiple(value, codec=codec):
+            value = codec.unpack(value)
+            value = [Decoder._decode_value(vi, VR=vr, VM=vm, codec=codec) \
+                     for vi in value]
         else:
-            value = Decoder._decode_value(value, VR=vr, VM=vm)
+            value = Decoder._decode_value(value, VR=vr, VM=vm, codec=codec)
 
         # HACK, Hermes stores sometimes these weird values
         if isinstance(value, str) and value == '-1.$':
@@ -322,14 +339,17 @@ class Decoder():
         return tag, vr, vm
 
     @staticmethod
-    def _decode_value(value, VR=None, VM='1'):
+    def _decode_value(value, VR=None, VM='1', codec=None):
+        if codec is None:
+            codec = JSONCodec
+
         if isinstance(value, str) and VR not in ('DA', 'DT', 'TM'):
-            value = json.loads(value)
+            value = codec.loads(value)
 
         if value is None:
             pass
         elif isinstance(value, list) and VR == 'SQ':
-            return [Decoder.decode(vi) for vi in value]
+            return [Decoder.decode(vi, codec=codec) for vi in value]
         elif VR == 'OB':
             # bytes are stored as hex string, this should retrun bytes
             value = bytearray.fromhex(value)
@@ -365,16 +385,11 @@ class Decoder():
         return VR == 'SQ'
 
     @staticmethod
-    def is_multiple(converted_value):
+    def is_multiple(converted_value, codec=None):
         """ Return True if value contains multiple values """
-        try:
-            value = json.loads(converted_value)
-            if isinstance(value, list):
-                return True
-            else:
-                return False
-        except:
-            return False
+        if codec is None:
+            codec = JSONCodec
+        return codec.is_packed(converted_value)
 
 def test_encode(file):
     try:
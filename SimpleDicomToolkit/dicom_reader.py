@@ -4,36 +4,450 @@ Created on Tue Sep  5 16:54:20 2017
 @author: HeyDude
 """
 import os
+import mmap
+import struct
+import itertools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import SimpleDicomToolkit
 import SimpleITK as sitk
 import dateutil
+import numpy as np
 import pydicom
 import warnings
 
-def sitk_image(path):
+def sitk_image(path, workers=None):
     """ Get SITK image from dicom file(s) containing a single dicom series.
-    Path may be a folder, file or list of files """
-    return SimpleDicomToolkit.Database(path, in_memory=True).image
-
-def sitk_images(path):
+    Path may be a folder, file or list of files. Files are read in parallel
+    by workers threads, see index_series. """
+    series = index_series(path, workers=workers)
+    if len(series) != 1:
+        msg = '{0} contains {1} series, use sitk_images'
+        raise ValueError(msg.format(path, len(series)))
+    return _read_indexed(*series.values())
+
+def sitk_images(path, workers=None):
     """ Get SITK images from dicom file(s) containing one or more dicom series.
     Path may be a folder, file or list of files. A dictionary is returned with
     keys the SeriesInstanceUID and has sitk images as values. """
-    return SimpleDicomToolkit.Database(path, in_memory=True).images
+    series = index_series(path, workers=workers)
+    max_files = SimpleDicomToolkit.Database._MAX_FILES
+    if sum(len(rows) for rows in series.values()) > max_files:
+        raise IOError('Number of files exceeds MAX_FILES property')
+    return {uid: _read_indexed(rows) for uid, rows in series.items()}
 
-def numpy_array(path):
+def numpy_array(path, workers=None):
     """ Get numpy array from dicom file(s) containing a single dicom series.
     Path may be a folder, file or list of files """
-    return SimpleDicomToolkit.Database(path, in_memory=True).array
+    return sitk.GetArrayFromImage(sitk_image(path, workers=workers))
 
-def numpy_arrays(path):
+def numpy_arrays(path, workers=None):
     """ Get numpy arrays from dicom file(s) containing one or more dicom series.
     Path may be a folder, file or list of files. A dictionary is returned with
     keys the SeriesInstanceUID and has numpy arrays as values. """
-    return SimpleDicomToolkit.Database(path, in_memory=True).arrays
+    return {uid: sitk.GetArrayFromImage(image) \
+            for uid, image in sitk_images(path, workers=workers).items()}
+
+# tags read by index_series to group and sort the files of a series
+_INDEX_TAGS = ('SeriesInstanceUID', 'SOPInstanceUID', 'SliceLocation',
+               'InstanceNumber')
+
+def _index_file(file):
+    # return the file and the values of the index tags present in the file,
+    # None if file is not a dicom file
+    scanner = SimpleDicomToolkit.FileScanner
+    file_type = scanner.sniff(file)
+    if file_type is None:
+        return None
+    try:
+        header = pydicom.read_file(file, stop_before_pixels=True,
+                                   force=file_type == scanner.RAW_DICOM,
+                                   specific_tags=list(_INDEX_TAGS))
+    except Exception:
+        return None
+    return file, {tag: header.get(tag) for tag in _INDEX_TAGS if tag in header}
+
+def _decimal(value):
+    # sort key of a value as sqlite's CAST(value AS DECIMAL), empty values
+    # first
+    if value is None or value == '':
+        return (0, 0)
+    try:
+        return (1, float(value))
+    except (TypeError, ValueError):
+        return (1, 0)
+
+def _sort_slices(rows):
+    # sort the files of a series by SliceLocation, or InstanceNumber if no
+    # file has a SliceLocation (see Database.sort_slices_by). Files with
+    # equal values are sorted by name.
+    for tag in (SimpleDicomToolkit.SLICELOCATION,
+                SimpleDicomToolkit.INSTANCENUMBER):
+        if any(tag in values for _, values in rows):
+            return sorted(rows, key=lambda row: (_decimal(row[1].get(tag)),
+                                                 row[0]))
+    if len(rows) > 1:
+        warnings.warn('\nSlice Sorting Failed Before Reading!\n',
+                      RuntimeWarning)
+    return sorted(rows)
+
+def index_series(path, workers=None):
+    """ Return a dictionary with the SeriesInstanceUID as key and a sorted
+    list of (file, values) tuples as value. Path may be a folder (searched
+    recursively), file or list of files. Only the tags in _INDEX_TAGS are
+    read, by a pool of workers threads. Slices are sorted as by
+    Database.sorted_files. Used by sitk_image(s) and numpy_array(s) instead
+    of building a Database. """
+    if isinstance(path, str) and os.path.isdir(path):
+        files = SimpleDicomToolkit.FileScanner.files_in_folder(
+            path, recursive=True, absolute_path=True)
+    elif isinstance(path, str):
+        files = [path]
+    else:
+        files = list(path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        rows = [row for row in executor.map(_index_file, files) \
+                if row is not None]
+
+    series = {}
+    for row in rows:
+        uid = row[1].get(SimpleDicomToolkit.SERIESINSTANCEUID)
+        if uid is not None:
+            series.setdefault(str(uid), []).append(row)
+    return {uid: _sort_slices(series[uid]) for uid in sorted(series)}
+
+def _read_indexed(rows):
+    # read a series from the rows of index_series, pixel values are scaled
+    # to SUV as by Database.image
+    image = read_serie([file for file, _ in rows], SUV=False)
+
+    # SUV information of the file with the first SOPInstanceUID
+    uid = lambda row: str(row[1].get(SimpleDicomToolkit.SOPINSTANCEUID, ''))
+    header = pydicom.read_file(min(rows, key=uid)[0], stop_before_pixels=True)
+    try:
+        bqml_to_suv = suv_scale_factor(header)
+    except:
+        warnings.warn('\nNo SUV information found, disabling SUV\n',
+                      RuntimeWarning)
+        bqml_to_suv = 1
+
+    if bqml_to_suv != 1:
+        image *= bqml_to_suv
+        image.bqml_to_suv = bqml_to_suv
+    return image
 
 
+# elements of directory records that are not part of the headers of files
+_DIRECTORY_RECORD_TAGS = ('OffsetOfTheNextDirectoryRecord',
+                          'RecordInUseFlag',
+                          'OffsetOfReferencedLowerLevelDirectoryEntity',
+                          'DirectoryRecordType',
+                          'ReferencedFileID',
+                          'ReferencedSOPClassUIDInFile',
+                          'ReferencedSOPInstanceUIDInFile',
+                          'ReferencedTransferSyntaxUIDInFile',
+                          'ReferencedRelatedGeneralSOPClassUIDInFile')
+
+def read_dicomdir(file):
+    """ Yield the file name and a pydicom header for each file referenced by
+    a DICOMDIR. File names are relative to the folder of the DICOMDIR. Each
+    header combines the patient, study, series and image records of the file,
+    the referenced file files itself are not opened. """
+    dicomdir = pydicom.dcmread(file)
+
+    def walk(records, parent_header):
+        for record in records:
+            if getattr(record, 'RecordInUseFlag', None) == 0:
+                continue # inactive record
+
+            header = pydicom.Dataset()
+            header.update(parent_header)
+            for element in record:
+                if element.keyword not in _DIRECTORY_RECORD_TAGS:
+                    header.add(element)
+
+            if 'ReferencedFileID' in record:
+                file_id = record.ReferencedFileID
+                if isinstance(file_id, str):
+                    file_id = [file_id]
+                uid = getattr(record, 'ReferencedSOPInstanceUIDInFile', None)
+                if uid is not None:
+                    header.SOPInstanceUID = uid
+                    header.SOPClassUID = record.ReferencedSOPClassUIDInFile
+                yield os.path.join(*file_id), header
+
+            yield from walk(record.children, header)
+
+    yield from walk(dicomdir.patient_records, pydicom.Dataset())
+
+# transfer syntaxes with native (uncompressed) pixel data
+IMPLICIT_VR_LITTLE_ENDIAN = '1.2.840.10008.1.2'
+EXPLICIT_VR_LITTLE_ENDIAN = '1.2.840.10008.1.2.1'
+EXPLICIT_VR_BIG_ENDIAN    = '1.2.840.10008.1.2.2'
+DEFLATED_LITTLE_ENDIAN    = '1.2.840.10008.1.2.1.99'
+UNCOMPRESSED_TRANSFER_SYNTAXES = (IMPLICIT_VR_LITTLE_ENDIAN,
+                                  EXPLICIT_VR_LITTLE_ENDIAN,
+                                  EXPLICIT_VR_BIG_ENDIAN)
+
+_PIXEL_DATA_TAG = (0x7FE0, 0x0010)
+_UNDEFINED_LENGTH = 0xFFFFFFFF
+
+# location and format of the pixel data of a file, as stored by the
+# DatabaseBuilder. length is None for encapsulated (compressed) pixel data.
+PixelDataRecord = namedtuple('PixelDataRecord',
+                             ['file', 'offset', 'length', 'transfer_syntax',
+                              'rows', 'columns', 'frames',
+                              'samples_per_pixel', 'bits_allocated',
+                              'bits_stored', 'pixel_representation'])
+
+def transfer_syntax(header):
+    """ Return the transfer syntax uid of a pydicom header. Derived from the
+    encoding for files without file meta information. """
+    file_meta = getattr(header, 'file_meta', None)
+    uid = getattr(file_meta, 'TransferSyntaxUID', None)
+    if uid:
+        return str(uid)
+    if not header.is_little_endian:
+        return EXPLICIT_VR_BIG_ENDIAN
+    if header.is_implicit_VR:
+        return IMPLICIT_VR_LITTLE_ENDIAN
+    return EXPLICIT_VR_LITTLE_ENDIAN
+
+def pixel_data_location(fp, header):
+    """ Return the offset and length of the PixelData value in file object
+    fp. fp must be positioned at the PixelData element, as pydicom leaves it
+    after reading header with stop_before_pixels. Returns None if there is
+    no pixel data. Length is None for encapsulated (compressed) data. """
+    if transfer_syntax(header) == DEFLATED_LITTLE_ENDIAN:
+        return None # header was read from a decompressed stream
+    start = fp.tell()
+    data = fp.read(12)
+    if len(data) < 8:
+        return None
+
+    endian = '<' if header.is_little_endian else '>'
+    if struct.unpack(endian + 'HH', data[:4]) != _PIXEL_DATA_TAG:
+        return None
+
+    if header.is_implicit_VR:
+        offset, length = start + 8, struct.unpack(endian + 'I', data[4:8])[0]
+    else:
+        # OB, OW and UN have a 4 byte length after 2 reserved bytes
+        offset, length = start + 12, struct.unpack(endian + 'I', data[8:])[0]
+    if length == _UNDEFINED_LENGTH:
+        length = None
+    return offset, length
+
+def _pixel_dtype(record):
+    # numpy dtype of the stored pixel values
+    if record.transfer_syntax not in UNCOMPRESSED_TRANSFER_SYNTAXES:
+        msg = 'Transfer syntax {0} of {1} is not uncompressed'
+        raise ValueError(msg.format(record.transfer_syntax, record.file))
+    if record.bits_allocated not in (8, 16, 32) or \
+        record.samples_per_pixel not in (None, 1):
+        msg = '{0} has no single sample 8, 16 or 32 bit pixel data'
+        raise ValueError(msg.format(record.file))
+
+    endian = '>' if record.transfer_syntax == EXPLICIT_VR_BIG_ENDIAN else '<'
+    kind = 'i' if record.pixel_representation == 1 else 'u'
+    return np.dtype(endian + kind + str(record.bits_allocated // 8))
+
+def read_mapped(records):
+    """ Read the pixel data of uncompressed files into a numpy array with
+    shape (frames, rows, columns). Records are PixelDataRecords with the
+    location and format of the pixel data in each file. Files are memory
+    mapped and only the pixel data is copied, headers are not parsed. """
+    records = list(records)
+    first = records[0]
+    dtype = _pixel_dtype(first)
+    rows, columns = first.rows, first.columns
+    nframes = sum(record.frames or 1 for record in records)
+
+    array = np.empty((nframes, rows, columns), dtype=dtype.newbyteorder('='))
+    index = 0
+    for record in records:
+        if _pixel_dtype(record) != dtype or \
+            (record.rows, record.columns) != (rows, columns):
+            msg = 'Pixel data of {0} has a different format'
+            raise ValueError(msg.format(record.file))
+
+        frames = record.frames or 1
+        count = frames * rows * columns
+        if record.length is None or count * dtype.itemsize > record.length:
+            msg = 'Pixel data of {0} is incomplete'
+            raise ValueError(msg.format(record.file))
+
+        with open(record.file, 'rb') as fp:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            data = np.frombuffer(mapped, dtype=dtype, count=count,
+                                 offset=record.offset)
+            array[index:index + frames] = data.reshape(frames, rows, columns)
+            del data # release the buffer before closing the map
+            mapped.close()
+        index += frames
+
+    # sign extend values with less bits stored than allocated
+    bits_stored = first.bits_stored or first.bits_allocated
+    if first.pixel_representation == 1 and bits_stored < first.bits_allocated:
+        shift = first.bits_allocated - bits_stored
+        array <<= shift
+        array >>= shift
+    return array
+
+def can_decode(transfer_syntax):
+    """ Return True if an available pydicom pixel data handler can decode
+    pixel data with transfer_syntax """
+    return any(handler.is_available() and \
+               handler.supports_transfer_syntax(transfer_syntax) \
+               for handler in pydicom.config.pixel_data_handlers)
+
+def _single_frame(header, index):
+    # header with only frame index of encapsulated multi frame pixel data
+    frames = pydicom.encaps.generate_pixel_data_frame(
+        header.PixelData, int(header.NumberOfFrames))
+    header.PixelData = pydicom.encaps.encapsulate(
+        [next(itertools.islice(frames, index, None))])
+    header.NumberOfFrames = 1
+    return header
+
+def decode_pixels(file, frame=None, transfer_syntax=None):
+    """ Decode the pixel data of a file (or a single frame) to a float array
+    with shape (frames, rows, columns), rescaled with the rescale slope and
+    intercept of the file. pydicom is used if one of its pixel data handlers
+    supports the transfer syntax, SimpleITK (gdcm) otherwise. """
+    if transfer_syntax is None or can_decode(transfer_syntax):
+        header = pydicom.dcmread(file)
+        if frame is not None:
+            header = _single_frame(header, frame)
+        array = header.pixel_array.astype(np.float64)
+        array *= float(getattr(header, 'RescaleSlope', 1))
+        array += float(getattr(header, 'RescaleIntercept', 0))
+    else:
+        array = sitk.GetArrayFromImage(sitk.ReadImage(file, sitk.sitkFloat64))
+        if frame is not None:
+            array = array[frame]
+    return array.reshape((-1,) + array.shape[-2:])
+
+def _decode_job(job):
+    # worker function for read_decoded
+    return decode_pixels(*job)
+
+# elements needed by pydicom to decode pixel data
+_PIXEL_MODULE = ('SamplesPerPixel', 'PhotometricInterpretation',
+                 'PlanarConfiguration', 'Rows', 'Columns', 'BitsAllocated',
+                 'BitsStored', 'HighBit', 'PixelRepresentation')
+
+def _pixel_header(header):
+    # header with only the elements needed to decode a single frame of the
+    # encapsulated pixel data of header, small enough to send to workers
+    pixel_header = pydicom.Dataset()
+    for keyword in _PIXEL_MODULE:
+        if keyword in header:
+            pixel_header.add(header.data_element(keyword))
+    pixel_header.NumberOfFrames = 1
+    pixel_header.file_meta = pydicom.Dataset()
+    pixel_header.file_meta.TransferSyntaxUID = \
+        header.file_meta.TransferSyntaxUID
+    pixel_header.is_little_endian = header.is_little_endian
+    pixel_header.is_implicit_VR = header.is_implicit_VR
+    return pixel_header
+
+def _decode_frames(pixel_header, frames, slope=1, intercept=0):
+    # worker function for read_decoded, decodes the encapsulated frames
+    # (bytes) with the elements of pixel_header
+    arrays = []
+    for frame in frames:
+        pixel_header.PixelData = pydicom.encaps.encapsulate([frame])
+        arrays.append(pixel_header.pixel_array.astype(np.float64))
+    array = np.stack(arrays)
+    array *= slope
+    array += intercept
+    return array
+
+def _frame_jobs(file, workers=None):
+    # read a multi frame file once and split its encapsulated frames in
+    # chunks, one job for each chunk
+    header = pydicom.dcmread(file)
+    nframes = int(header.NumberOfFrames)
+    frames = list(pydicom.encaps.generate_pixel_data_frame(header.PixelData,
+                                                           nframes))
+    pixel_header = _pixel_header(header)
+    slope = float(getattr(header, 'RescaleSlope', 1))
+    intercept = float(getattr(header, 'RescaleIntercept', 0))
+
+    size = max(1, -(-nframes // (4 * (workers or os.cpu_count()))))
+    return [(pixel_header, frames[start:start + size], slope, intercept) \
+            for start in range(0, nframes, size)]
+
+def _decode_frame_job(job):
+    # worker function for read_decoded
+    return _decode_frames(*job)
+
+def read_decoded(records, workers=None):
+    """ Read the pixel data of the files in records (PixelDataRecords) into
+    a float array with shape (frames, rows, columns). Files (or the frames of
+    a single multi frame file) are decoded by a pool of worker processes,
+    values are rescaled as by decode_pixels. A single multi frame file is
+    read once, chunks of its frames are decoded by the workers. """
+    records = list(records)
+    first = records[0]
+    if first.samples_per_pixel not in (None, 1):
+        msg = '{0} has no single sample pixel data'
+        raise ValueError(msg.format(first.file))
+
+    nframes = first.frames or 1
+    if len(records) == 1 and nframes > 1 and \
+        first.length is None and can_decode(first.transfer_syntax):
+        # the file is read once, chunks of its frames are decoded separately
+        jobs = _frame_jobs(first.file, workers=workers)
+        job_function = _decode_frame_job
+        chunksize = 1
+    else:
+        jobs = [(record.file, None, record.transfer_syntax) \
+                for record in records]
+        nframes = sum(record.frames or 1 for record in records)
+        job_function = _decode_job
+        chunksize = max(1, len(jobs) // (4 * (workers or os.cpu_count())))
+
+    array = np.empty((nframes, first.rows, first.columns), dtype=np.float64)
+    if workers == 1 or len(jobs) == 1:
+        results = map(job_function, jobs)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(job_function, jobs, chunksize=chunksize)
+
+    try:
+        index = 0
+        for frames in results:
+            array[index:index + len(frames)] = frames
+            index += len(frames)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return array
+
+class ImageArray(np.ndarray):
+    """ Numpy array that shares the pixel buffer of a SimpleITK image. The
+    image is kept alive as long as the array (or a view on it) exists. """
+
+    def __array_finalize__(self, obj):
+        # views share the buffer and keep the image, new arrays do not
+        image = getattr(obj, 'image', None)
+        if image is not None and not np.may_share_memory(self, obj):
+            image = None
+        self.image = image
+
+def array_view(image):
+    """ Return a read-only numpy array with the pixel data of a SimpleITK
+    image without copying. Unlike sitk.GetArrayViewFromImage the array keeps
+    a reference to the image, it stays valid when the image is deleted. """
+    array = sitk.GetArrayViewFromImage(image).view(ImageArray)
+    array.image = image
+    return array
+
 def read_files(file_list):
     """ Read a file or list of files using SimpleTIK. A file list will be
          read as an image series in SimpleITK. """
@@ -83,6 +497,66 @@ def read_serie(files, rescale=True, SUV=False, folder=None, SUVparams={}):
 
     return image
 
+def read_region(files, z_range=None, roi=None, slice_spacing=None):
+    """ Read a region of a single image serie to a SimpleITK image. Files
+    must be sorted. z_range (start, stop) selects slices (frames for a single
+    multi frame file) like a python slice, roi (x0, y0, x1, y1) selects the
+    in-plane window in pixels. Only the files of the selected slices are
+    opened and only the window is copied. Use slice_spacing to set the
+    distance between slices, otherwise the spacing of the first file is used.
+    Rescale slope and intercept are applied by SimpleITK.
+    """
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(files[0])
+    reader.ReadImageInformation()
+    size = reader.GetSize()
+    dimension = reader.GetDimension()
+
+    multi_frame = len(files) == 1 and dimension == 3 and size[2] > 1
+    nslices = size[2] if multi_frame else len(files)
+
+    z_start, z_stop, _ = slice(*(z_range or (None,))).indices(nslices)
+    x0, y0, x1, y1 = roi or (0, 0, size[0], size[1])
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, size[0]), min(y1, size[1])
+    if z_stop <= z_start or x1 <= x0 or y1 <= y0:
+        msg = 'Empty region z_range: {0}, roi: {1}'
+        raise ValueError(msg.format(z_range, roi))
+    width, height, depth = x1 - x0, y1 - y0, z_stop - z_start
+
+    if multi_frame:
+        reader.SetExtractIndex([x0, y0, z_start])
+        reader.SetExtractSize([width, height, depth])
+        image = sitk.Cast(reader.Execute(), sitk.sitkFloat64)
+        if slice_spacing is not None:
+            image.SetSpacing(image.GetSpacing()[:2] + (slice_spacing,))
+        return image
+
+    # read the window of each slice into a preallocated volume
+    reader.SetExtractIndex([x0, y0] + [0] * (dimension - 2))
+    reader.SetExtractSize([width, height] + [1] * (dimension - 2))
+    array = np.empty((depth, height, width), dtype=np.float64)
+    first = None
+    for index, file in enumerate(files[z_start:z_stop]):
+        reader.SetFileName(file)
+        image = reader.Execute()
+        if first is None:
+            first = image
+        array[index] = sitk.GetArrayViewFromImage(image).reshape(height,
+                                                                 width)
+
+    image = sitk.GetImageFromArray(array)
+    spacing = list(first.GetSpacing()) + [1] * (3 - dimension)
+    if slice_spacing is not None:
+        spacing[2] = slice_spacing
+    image.SetSpacing(spacing)
+    if dimension == 3:
+        image.SetOrigin(first.GetOrigin())
+        image.SetDirection(first.GetDirection())
+    else:
+        image.SetOrigin(list(first.GetOrigin()) + [0])
+    return image
+
 def suv_scale_factor(header, SUVparams={}):
     """ Calculate the SUV scaling factor (Bq/cc --> SUV) based on information
     in the header. Works on Siemens PET Dicom Headers. """
@@ -118,6 +592,53 @@ def suv_scale_factor(header, SUVparams={}):
     return suv_scaling
 
 
+def suv_parameters(series_date, series_time, patient_weight, nuclide_info):
+    """ Return patient weight, injected dose, half life and the time in
+    seconds between injection and series start as used by suv_scale_factor.
+    Values that are missing or cannot be parsed are returned as NaN. """
+    nan = float('nan')
+    to_float = lambda value: nan if value is None else float(value)
+
+    if nuclide_info is not None and \
+        not isinstance(nuclide_info, pydicom.Dataset):
+        # sequence, use the first item
+        nuclide_info = nuclide_info[0] if len(nuclide_info) else None
+    if nuclide_info is None:
+        return to_float(patient_weight), nan, nan, nan
+
+    nuclide_dose = to_float(getattr(nuclide_info, 'RadionuclideTotalDose',
+                                    None))
+    halflife = to_float(getattr(nuclide_info, 'RadionuclideHalfLife', None))
+    injection_time = getattr(nuclide_info, 'RadiopharmaceuticalStartTime',
+                             None)
+    try:
+        parse = lambda x: dateutil.parser.parse(x)
+        series_dt = parse(series_date + ' ' + series_time)
+        injection_dt = parse(series_date + ' ' + injection_time)
+        delta_time = (series_dt - injection_dt).total_seconds()
+    except (TypeError, ValueError, OverflowError):
+        delta_time = nan
+
+    return to_float(patient_weight), nuclide_dose, halflife, delta_time
+
+def decay_factors(halflife, delta_time):
+    """ Vectorized decay of activity after delta_time seconds for arrays of
+    half lives and times (s). """
+    halflife = np.asarray(halflife, dtype=np.float64)
+    delta_time = np.asarray(delta_time, dtype=np.float64)
+    return 0.5 ** (delta_time / halflife)
+
+def suv_scale_factors(patient_weight, nuclide_dose, halflife, delta_time):
+    """ Vectorized suv_scale_factor for arrays of patient weights (kg),
+    injected doses (Bq), half lives (s) and times between injection and
+    series start (s). Returns NaN where parameters are missing. """
+    patient_weight = np.asarray(patient_weight, dtype=np.float64)
+    nuclide_dose = np.asarray(nuclide_dose, dtype=np.float64)
+    decay_correction = decay_factors(halflife, delta_time)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (patient_weight * 1000) / (decay_correction * nuclide_dose)
+
+
 def rescale_values(header=None):
     """ Return rescale slope and intercept if they are in the dicom headers,
     otherwise 1 is returned for slope and 0 for intercept. """
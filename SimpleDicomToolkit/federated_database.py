@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Query multiple dicom databases as if they were a single database.
+"""
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import SimpleDicomToolkit as sdtk
+from SimpleDicomToolkit.DicomDatabaseSQL import Database, DatabaseBuilder
+
+
+class FederatedDatabase(sdtk.Logger):
+    """ Combine the databases of multiple folders. The database files are
+    attached to a single (in memory) sqlite connection with ATTACH DATABASE
+    and queries run as a UNION over the main tables of all databases. Each
+    file is resolved against the root path of its own database. SQLite
+    attaches at most 10 databases by default. """
+
+    _SCHEMA = 'shard{index}' # schema name of an attached database
+    _SHARD_COL = 'shard_index' # index of the database of a row
+
+    def __init__(self, paths, scan=False, silent=False, parallel=False,
+                 **kwargs):
+        """
+        Combine the databases in paths
+
+        paths:      folders (or database files) of the databases
+        scan:       Scan each path for new and removed files before
+                    combining the databases.
+        silent:     Supress progressbar and log messages except errors
+        parallel:   Query each database in a separate thread instead of a
+                    single UNION query. Useful for databases on different
+                    disks.
+
+        Additional keyword arguments are passed to DatabaseBuilder.
+        """
+        if silent:
+            self._LOG_LEVEL = logging.ERROR
+
+        super().__init__()
+
+        self.builders = [DatabaseBuilder(path=path, scan=scan, silent=silent,
+                                         **kwargs) for path in paths]
+
+        for builder in self.builders:
+            if builder.database.in_memory:
+                msg = 'In memory databases cannot be federated'
+                raise ValueError(msg)
+
+        codecs = set(builder.codec for builder in self.builders)
+        if len(codecs) > 1:
+            raise ValueError('Databases with different codecs cannot be '
+                             'federated')
+        self.codec = codecs.pop() if codecs else sdtk.JSONCodec
+
+        self.parallel = parallel
+
+        self.database = sdtk.SQLiteWrapper(sdtk.SQLiteWrapper.IN_MEMORY)
+        self.database._LOG_LEVEL = self._LOG_LEVEL
+
+        cmd = 'ATTACH DATABASE ? AS {schema}'
+        for index, builder in enumerate(self.builders):
+            self.logger.info('Attaching %s', builder.database_file)
+            self.database.execute(cmd.format(schema=self._schema(index)),
+                                  values=[builder.database_file], close=False)
+
+        self._selection = {}
+        self._columns = None
+        self.reset()
+
+    def __len__(self):
+        return self.count()
+
+    @property
+    def selection(self):
+        """ Return the current selection with decoded values """
+        selection = {}
+        for key, value in self._selection.items():
+            if key in self.non_tag_columns:
+                selection[key] = value
+            else:
+                selection[key] = sdtk.Decoder.decode_entry(
+                    key, value, codec=self.codec)[0]
+        return selection
+
+    @property
+    def non_tag_columns(self):
+        """ Return column names that are not dicom tagnames """
+        return (DatabaseBuilder.FILENAME_COL,
+                DatabaseBuilder.FILE_SIZE_COL,
+                DatabaseBuilder.ID_COL,
+                sdtk.SQLiteWrapper.ROWID,
+                DatabaseBuilder.TAGNAMES_COL)
+
+    @property
+    def columns(self):
+        """ Return the column names of the main table of each database """
+        if self._columns is None:
+            self._columns = [builder.database.column_names(
+                DatabaseBuilder.MAIN_TABLE) for builder in self.builders]
+        return self._columns
+
+    @property
+    def files_with_path(self):
+        """ Return all files in the selection with the root path of the
+        database they belong to """
+        rows = self._rows([self._SHARD_COL, DatabaseBuilder.FILENAME_COL])
+        return [os.path.join(self.builders[index].path,
+                             file.replace('\\', '/')) for index, file in rows]
+
+    def select(self, **kwargs):
+        """ Make a selection in all databases, see Database.select """
+        for tag, value in kwargs.items():
+            if tag in self.non_tag_columns:
+                continue
+            kwargs[tag] = Database._encode_value(tag, value, codec=self.codec)
+
+        self._selection.update(kwargs)
+        return self
+
+    def reset(self, tags=None):
+        """ Remove (part of) the selection, see Database.reset """
+        if tags:
+            tags = [tags] if not isinstance(tags, list) else tags
+            for tag in tags:
+                self._selection.pop(tag, None)
+        else:
+            self._selection = {}
+
+        self._columns = None # databases may have changed
+        return self
+
+    def get_column(self, column_name, distinct=True, sort=True, parse=True):
+        """ Return the (unique) values for a column in all databases """
+        values = [row[0] for row in self._rows([column_name],
+                                               distinct=distinct, sort=sort)]
+
+        if not any(column_name in columns for columns in self.columns):
+            # side tags, files without the tag have no value (Database)
+            values = [value for value in values if value is not None]
+
+        if parse and column_name not in self.non_tag_columns:
+            values = [sdtk.Decoder.decode_entry(column_name, vi,
+                                                codec=self.codec)[0] \
+                      if vi is not None else None for vi in values]
+        return values
+
+    def count(self, column_name=None, distinct=True):
+        """ Count the (unique) values of a column in all databases. Without
+        column_name the number of files in the selection is returned. """
+        if column_name is None:
+            column_name, distinct = sdtk.SQLiteWrapper.ROWID, False
+
+        if self.parallel:
+            return len([value for value in self.get_column(
+                column_name, distinct=distinct, sort=False, parse=False) \
+                if value is not None])
+
+        union, values = self._union([column_name], distinct=distinct)
+        if union is None:
+            return 0
+
+        cmd = 'SELECT COUNT({distinct} {column}) FROM ({union})'
+        cmd = cmd.format(distinct='DISTINCT' if distinct else '',
+                         column=column_name, union=union)
+        return self.database.execute(cmd, values=values, fetch_all=True,
+                                     close=False)[0][0]
+
+    def databases(self):
+        """ Yield a Database with the current selection for each database
+        that has files in the current selection, e.g. to read images """
+        indices = self._rows([self._SHARD_COL], distinct=True, sort=True)
+        for (index, ) in indices:
+            # wrap the builder of the shard, a new builder could open
+            # another database file or use other options
+            builder = self.builders[index]
+            database = Database(builder.path, builder=builder,
+                                silent=self._LOG_LEVEL > logging.INFO)
+            database._selection = self._selection.copy()
+            yield database
+
+    def _schema(self, index):
+        return self._SCHEMA.format(index=index)
+
+    def _shard_statement(self, index, column_names, distinct=False,
+                         schema=None):
+        # select statement for a single database, returns None if the
+        # selection cannot match any row in the database. Side tags (e.g.
+        # private tags) are selected from the tag value table of the database
+        builder = self.builders[index]
+        columns = self.columns[index]
+        for column in self._selection.keys():
+            if column not in columns and not builder.is_side_tag(column,
+                                                                 columns):
+                return None, []
+
+        select = []
+        for column in column_names:
+            if column == self._SHARD_COL:
+                select += ['{0} AS {1}'.format(index, column)]
+            elif column == sdtk.SQLiteWrapper.ROWID:
+                # name the column in the union, rowid is named id otherwise
+                select += ['{0} AS {0}'.format(column)]
+            elif column in columns:
+                select += [column]
+            elif builder.is_side_tag(column, columns):
+                select += [builder.side_column(column, schema=schema)]
+            else:
+                select += ['NULL AS {0}'.format(column)]
+
+        table = DatabaseBuilder._schema_table(DatabaseBuilder.MAIN_TABLE,
+                                              schema)
+
+        selection = builder.query_selection(self._selection, schema=schema)
+        where, values = sdtk.SQLiteWrapper._where_clause(**selection)
+        cmd = 'SELECT {distinct} {columns} FROM {table} {where}'
+        cmd = cmd.format(distinct='DISTINCT' if distinct else '',
+                         columns=sdtk.SQLiteWrapper._list_to_string(select),
+                         table=table, where=where)
+        return cmd, values
+
+    def _union(self, column_names, distinct=False):
+        # UNION ALL of the select statements for all attached databases
+        statements = []
+        values = []
+        for index in range(len(self.builders)):
+            cmd, vals = self._shard_statement(index, column_names,
+                                              distinct=distinct,
+                                              schema=self._schema(index))
+            if cmd is not None:
+                statements += [cmd]
+                values += vals
+
+        if not statements:
+            return None, []
+        return ' UNION ALL '.join(statements), values
+
+    def _rows(self, column_names, distinct=False, sort=False):
+        # rows of all databases from a single query on the UNION ALL of the
+        # attached databases. With parallel the databases are queried in
+        # separate threads and the rows are merged.
+        if self.parallel:
+            rows = [tuple(row) for _, shard_rows in \
+                    self._query_shards(column_names, distinct=distinct) \
+                    for row in shard_rows]
+            if distinct:
+                rows = list(set(rows))
+            if sort:
+                # sort NULL first, like sqlite
+                rows = sorted(rows, key=lambda row: [(value is not None,
+                                                      value) for value in row])
+            return rows
+
+        union, values = self._union(column_names, distinct=distinct)
+        if union is None:
+            return []
+
+        columns = sdtk.SQLiteWrapper._list_to_string(column_names)
+        cmd = 'SELECT {distinct} {columns} FROM ({union}) {order}'
+        cmd = cmd.format(distinct='DISTINCT' if distinct else '',
+                         columns=columns, union=union,
+                         order='ORDER BY ' + columns if sort else '')
+        return self.database.execute(cmd, values=values, fetch_all=True,
+                                     close=False)
+
+    def _query_shards(self, column_names, distinct=False):
+        # return (index, rows) for each database. Rows are retrieved with one
+        # query on the attached databases or with a thread per database.
+        def query(index):
+            schema = None if self.parallel else self._schema(index)
+            cmd, values = self._shard_statement(index, column_names,
+                                                distinct=distinct,
+                                                schema=schema)
+            if cmd is None:
+                return index, []
+            if self.parallel:
+                database = self.builders[index].database
+                return index, database.execute(cmd, values=values,
+                                               fetch_all=True)
+            return index, self.database.execute(cmd, values=values,
+                                                fetch_all=True, close=False)
+
+        self.columns # read columns before starting threads
+        indices = range(len(self.builders))
+        if not self.parallel:
+            return [query(index) for index in indices]
+
+        with ThreadPoolExecutor(max_workers=len(self.builders)) as executor:
+            return list(executor.map(query, indices))
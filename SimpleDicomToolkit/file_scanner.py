@@ -1,7 +1,118 @@
 import os
+import struct
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
 class FileScanner():
+    # results of sniff
+    DICOM           = 'dicom'       # 128 byte preamble followed by DICM
+    RAW_DICOM       = 'raw dicom'   # data elements without preamble
+
+    # reasons for rejecting files in filter_files
+    REJECT_EXCLUDED  = 'excluded'
+    REJECT_EXTENSION = 'extension'
+    REJECT_SIZE      = 'size'
+
+    _PREAMBLE_LENGTH = 128
+    _DICOM_PREFIX    = b'DICM'
+    _RAW_GROUPS      = (0x0002, 0x0008) # first group of a file without preamble
+
+    @staticmethod
+    def sniff(file):
+        """ Return DICOM if the file has a dicom preamble, RAW_DICOM if the
+        file starts with a dicom data element (no preamble) and None
+        otherwise. Only the first 132 bytes are read. """
+        try:
+            with open(file, 'rb') as fp:
+                data = fp.read(FileScanner._PREAMBLE_LENGTH + 4)
+        except (IsADirectoryError, PermissionError):
+            return None
+
+        prefix = data[FileScanner._PREAMBLE_LENGTH:]
+        if prefix == FileScanner._DICOM_PREFIX:
+            return FileScanner.DICOM
+        if FileScanner._is_raw_dicom(data):
+            return FileScanner.RAW_DICOM
+        return None
+
+    @staticmethod
+    def _is_raw_dicom(data):
+        # file without preamble and file meta information, data starts with
+        # a tag of the identifying group in little or big endian
+        if len(data) < 8:
+            return False
+
+        for endian in ('<', '>'):
+            group, _ = struct.unpack(endian + 'HH', data[:4])
+            if group not in FileScanner._RAW_GROUPS:
+                continue
+            VR = data[4:6]
+            if VR.isalpha() and VR.isupper():
+                return True # explicit VR
+            length = struct.unpack(endian + 'I', data[4:8])[0]
+            if length < 0x10000:
+                return True # implicit VR with a plausible value length
+        return False
+
+    @staticmethod
+    def filter_files(files, folder='', include=None, exclude=None,
+                     extensions=None, exclude_extensions=None,
+                     min_size=None, max_size=None):
+        """ Split files in accepted files and rejected files. Returns a list
+        with accepted files and a dictionary with the rejected files as keys
+        and the reason for rejection as value.
+
+        include:            glob patterns, files must match at least one
+        exclude:            glob patterns, files may not match any
+        extensions:         accepted extensions e.g. ['.dcm', '.ima', '']
+        exclude_extensions: rejected extensions e.g. ['.pdf', '.zip']
+        min_size, max_size: file size limits in bytes
+
+        Patterns are matched against the file name relative to folder with
+        / as separator. Extensions are compared case insensitive.
+        """
+        lower = lambda values: [value.lower() for value in values]
+        if extensions is not None:
+            extensions = lower(extensions)
+        if exclude_extensions is not None:
+            exclude_extensions = lower(exclude_extensions)
+
+        accepted, rejected = [], {}
+        for file in files:
+            name = file.replace('\\', '/')
+            extension = os.path.splitext(name)[1].lower()
+
+            if include and not any(fnmatch.fnmatch(name, pattern) \
+                                   for pattern in include):
+                rejected[file] = FileScanner.REJECT_EXCLUDED
+            elif exclude and any(fnmatch.fnmatch(name, pattern) \
+                                 for pattern in exclude):
+                rejected[file] = FileScanner.REJECT_EXCLUDED
+            elif extensions is not None and extension not in extensions:
+                rejected[file] = FileScanner.REJECT_EXTENSION
+            elif exclude_extensions and extension in exclude_extensions:
+                rejected[file] = FileScanner.REJECT_EXTENSION
+            elif (min_size is not None or max_size is not None) and \
+                not FileScanner._size_ok(os.path.join(folder, file),
+                                         min_size, max_size):
+                rejected[file] = FileScanner.REJECT_SIZE
+            else:
+                accepted.append(file)
+
+        return accepted, rejected
+
+    @staticmethod
+    def _size_ok(file, min_size=None, max_size=None):
+        try:
+            size = os.path.getsize(file)
+        except OSError:
+            return True # let the reader handle the missing file
+        if min_size is not None and size < min_size:
+            return False
+        if max_size is not None and size > max_size:
+            return False
+        return True
 
     @staticmethod
     def compare(files, existing_files):
@@ -20,22 +131,111 @@ class FileScanner():
         return new_files, not_found
 
     @staticmethod
-    def recursive_generator(path):
-        """Recursively yield DirEntry objects for given directory."""
-        for entry in os.scandir(path):
-            if entry.is_dir(follow_symlinks=False):
-                yield from FileScanner.recursive_generator(entry.path)
-            else:
-                yield entry
+    def recursive_generator(path, max_depth=None, follow_symlinks=False):
+        """Recursively yield DirEntry objects for the files in given
+        directory. max_depth and follow_symlinks as in parallel_generator."""
+        stat = os.stat(path)
+        visited = set([(stat.st_dev, stat.st_ino)]) # folders already scanned
+
+        def walk(folder, depth):
+            try:
+                with os.scandir(folder) as scanned:
+                    entries = list(scanned)
+            except (FileNotFoundError, PermissionError, NotADirectoryError):
+                return # folder removed or not readable during scan
+
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    if max_depth is not None and depth >= max_depth:
+                        continue
+                    if follow_symlinks:
+                        # only links can form loops
+                        target = entry.stat(follow_symlinks=True)
+                        key = (target.st_dev, target.st_ino)
+                        if key in visited:
+                            continue
+                        visited.add(key)
+                    yield from walk(entry.path, depth + 1)
+                elif not entry.is_dir():
+                    yield entry
+
+        yield from walk(path, 0)
 
     @staticmethod
-    def files_in_folder(folder, recursive=False, absolute_path=False):
+    def parallel_generator(path, workers=8, max_depth=None,
+                           follow_symlinks=False):
+        """ Yield file names relative to path. Folders are scanned
+        concurrently by a pool of workers and files are yielded as soon
+        as their folder is scanned. Faster than recursive_generator on file
+        systems with a high latency per directory listing (network shares).
+
+        max_depth:       number of sub folder levels to scan, None scans all
+        follow_symlinks: scan folders that are symbolic links. Each folder
+                         is scanned once, links that form a loop are ignored.
+                         Links to folders are skipped otherwise.
+        """
+
+        def folder_key(entry):
+            # identify folders to detect loops, only links can form loops
+            if not follow_symlinks:
+                return entry.path
+            stat = entry.stat(follow_symlinks=True)
+            return (stat.st_dev, stat.st_ino)
+
+        def scan(folder, depth):
+            # list a single folder, returns files and sub folders
+            files, folders = [], []
+            try:
+                with os.scandir(os.path.join(path, folder)) as entries:
+                    for entry in entries:
+                        name = os.path.join(folder, entry.name)
+                        if entry.is_dir(follow_symlinks=follow_symlinks):
+                            if max_depth is None or depth < max_depth:
+                                folders.append((name, folder_key(entry)))
+                        elif not entry.is_dir():
+                            files.append(name)
+            except (FileNotFoundError, PermissionError, NotADirectoryError):
+                pass # folder removed or not readable during scan
+            return files, folders, depth
+
+        stat = os.stat(path)
+        visited = set([(stat.st_dev, stat.st_ino)]) # folders already scanned
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set([executor.submit(scan, '', 0)])
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, folders, depth = future.result()
+                    for folder, key in folders:
+                        if key in visited:
+                            continue
+                        visited.add(key)
+                        pending.add(executor.submit(scan, folder, depth + 1))
+                    yield from files
+
+    @staticmethod
+    def files_in_folder(folder, recursive=False, absolute_path=False,
+                        workers=None, max_depth=None, follow_symlinks=False):
+        """ Return the files in folder. Use workers to scan sub folders
+        concurrently, see parallel_generator. max_depth and follow_symlinks
+        are used by the serial and the concurrent scan. """
+        if recursive and workers:
+            files = FileScanner.parallel_generator(
+                folder, workers=workers, max_depth=max_depth,
+                follow_symlinks=follow_symlinks)
+            if absolute_path:
+                files = [os.path.normpath(os.path.join(folder, file)) \
+                         for file in files]
+            return list(files)
+
         if recursive:
-            file_gen = FileScanner.recursive_generator(folder)
+            file_gen = FileScanner.recursive_generator(
+                folder, max_depth=max_depth, follow_symlinks=follow_symlinks)
         else:
             file_gen = os.scandir(folder)
         if absolute_path:
             files = [os.path.normpath(entry.path) for entry in file_gen]
         else:
             files = [os.path.relpath(file, folder) for file in file_gen]
-        return files
\ No newline at end of file
+        return files
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Cache with downsampled previews of dicom series.
+"""
+import os
+import math
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import SimpleITK as sitk
+import SimpleDicomToolkit as sdtk
+
+
+MIP = 'mip'
+
+# downsample factor for each preview level
+LEVELS = {1: 2, 2: 4, 3: 8}
+
+THUMBNAIL_SIZE = 128 # max number of pixels of the mip in each direction
+
+_SIGNATURE_KEY = 'signature'
+
+
+def _level_key(level):
+    if level == MIP:
+        return MIP
+    if level not in LEVELS:
+        msg = 'Preview level must be {0} or {1}'
+        raise ValueError(msg.format(list(LEVELS.keys()), MIP))
+    return 'level{0}'.format(level)
+
+def _shrink(image, factor):
+    # average factor x factor (x factor) pixels, dimensions smaller than
+    # factor are reduced to a single pixel
+    factors = [max(1, min(factor, size)) for size in image.GetSize()]
+    return sitk.BinShrink(image, factors)
+
+def make_previews(files, scale=1):
+    """ Read the (sorted) files of a single series and return a dictionary
+    with a numpy array for each level and the mip. Pixel values are
+    multiplied by scale (SUV). """
+    image = sdtk.dicom_reader.read_serie(files, SUV=False)
+    if scale != 1:
+        image *= scale
+    image = sitk.Cast(image, sitk.sitkFloat32)
+
+    previews = {}
+    for level, factor in LEVELS.items():
+        array = sitk.GetArrayFromImage(_shrink(image, factor))
+        previews[_level_key(level)] = array
+
+    # maximum intensity projection in the anterior posterior direction,
+    # 2D images are used as is
+    array = sitk.GetArrayFromImage(image)
+    if array.ndim == 3 and array.shape[0] > 1:
+        mip = array.max(axis=1)
+    else:
+        mip = array.reshape(array.shape[-2:])
+    factor = math.ceil(max(mip.shape) / THUMBNAIL_SIZE)
+    if factor > 1:
+        mip = sitk.GetArrayFromImage(_shrink(sitk.GetImageFromArray(mip),
+                                             factor))
+    previews[MIP] = mip
+    return previews
+
+def _save(cache_file, signature, previews):
+    # write to a temporary file first, readers never see partial files
+    temp_file = cache_file + '.tmp.npz'
+    np.savez(temp_file, **{_SIGNATURE_KEY: signature}, **previews)
+    os.replace(temp_file, cache_file)
+
+def _build(files, scale, cache_file, signature):
+    # worker function, builds previews and stores them in cache_file
+    previews = make_previews(files, scale=scale)
+    if cache_file is not None:
+        _save(cache_file, signature, previews)
+    return previews
+
+
+class PreviewCache(sdtk.Logger):
+    """ Stores downsampled levels (LEVELS) and a mip thumbnail of series as
+    npz files in folder, one file per series. Each entry has a signature of
+    the files of the series (name, size and modification time), entries with
+    a different signature are rebuilt. Series that cannot be read get an
+    entry without previews and are not built again until their files change.
+    Previews are only kept in memory if folder is None. """
+
+    def __init__(self, folder=None, workers=None):
+        super().__init__()
+        self.folder = folder
+        self.workers = workers
+        self._memory = {} # uid: (signature, previews)
+
+    @staticmethod
+    def signature(files, scale=1):
+        """ Return a hash of the files and their size and modification time.
+        Changes when a file of the series is added, removed or changed. """
+        digest = hashlib.sha1(repr(scale).encode())
+        for file in files:
+            try:
+                stat = os.stat(file)
+                info = (file, stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                info = (file, None, None)
+            digest.update(repr(info).encode())
+        return digest.hexdigest()
+
+    def cache_file(self, uid):
+        """ Return the file name of the entry for a series """
+        if self.folder is None:
+            return None
+        return os.path.join(self.folder, uid + '.npz')
+
+    def get(self, uid, signature, level=1):
+        """ Return the preview of a series, None if the series is not in the
+        cache, if its signature changed or if the series cannot be read """
+        return self._lookup(uid, signature, _level_key(level))
+
+    def has(self, uid, signature):
+        """ Return True if the cache has an up to date entry for a series """
+        return self._lookup(uid, signature, _SIGNATURE_KEY) is not None
+
+    def _lookup(self, uid, signature, key):
+        if uid in self._memory:
+            cached_signature, previews = self._memory[uid]
+            if cached_signature == signature:
+                return signature if key == _SIGNATURE_KEY \
+                    else previews.get(key)
+
+        cache_file = self.cache_file(uid)
+        if cache_file is None or not os.path.exists(cache_file):
+            return None
+        try:
+            with np.load(cache_file) as data:
+                if str(data[_SIGNATURE_KEY]) != signature:
+                    self.logger.debug('Preview of %s is outdated', uid)
+                    return None
+                return data[key] if key in data else None
+        except (OSError, ValueError, KeyError):
+            self.logger.info('Cannot read preview %s', cache_file)
+            return None
+
+    def build(self, series, workers=None):
+        """ Build the previews for series, a dictionary with the uid as key
+        and a tuple with files, scale and signature as value. Series are
+        built in parallel by a pool of worker processes. """
+        if not series:
+            return
+        if self.folder is not None:
+            os.makedirs(self.folder, exist_ok=True)
+
+        workers = workers or self.workers
+        jobs = [(uid, files, scale, self.cache_file(uid), signature) \
+                for uid, (files, scale, signature) in series.items()]
+
+        if len(jobs) == 1 or workers == 1:
+            for job in jobs:
+                self._store(job, lambda: _build(*job[1:]))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_build, *job[1:]) for job in jobs]
+                for job, future in zip(jobs, futures):
+                    self._store(job, future.result)
+
+    def _store(self, job, result):
+        # keep the previews of a finished job, series that cannot be read
+        # are skipped
+        uid, signature = job[0], job[-1]
+        try:
+            previews = result()
+        except Exception as error:
+            self.logger.error('Cannot build preview of %s: %s', uid, error)
+            previews = {}
+            if self.folder is not None:
+                _save(job[3], signature, previews)
+        else:
+            self.logger.debug('Built preview of %s', uid)
+        if self.folder is None:
+            self._memory[uid] = (signature, previews)
+
+    def clear(self):
+        """ Remove all previews """
+        self._memory = {}
+        if self.folder is not None and os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
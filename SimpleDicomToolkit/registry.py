@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Process wide registry of databases, shared by threads (e.g. web handlers)
+that open the same folder many times.
+"""
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import SimpleITK as sitk
+
+import SimpleDicomToolkit as sdtk
+
+
+class SharedCache:
+    """ Thread safe cache of values (tag names, columns, images) shared by
+    the databases of a registry entry. Values are computed outside the lock,
+    values computed before a clear are not stored. The least recently used
+    values are removed when the values use more than max_bytes (None keeps
+    all values). """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._values = OrderedDict() # key --> (value, bytes), oldest first
+        self._bytes = 0
+        self._generation = 0 # incremented by clear
+
+    @property
+    def nbytes(self):
+        """ Estimated memory used by the cached values """
+        return self._bytes
+
+    def get(self, key, compute):
+        """ Return the cached value for key, compute and store it if it is
+        not in the cache """
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key][0]
+            generation = self._generation
+
+        value = compute()
+        size = self._size(value)
+
+        with self._lock:
+            if generation != self._generation:
+                return value
+            if key in self._values: # computed by another thread
+                self._values.move_to_end(key)
+                return self._values[key][0]
+            self._values[key] = (value, size)
+            self._bytes += size
+            self._evict()
+        return value
+
+    def _evict(self):
+        # remove the least recently used values, the newest value is kept
+        if self.max_bytes is None:
+            return
+        while self._bytes > self.max_bytes and len(self._values) > 1:
+            _, (_, size) = self._values.popitem(last=False)
+            self._bytes -= size
+
+    @staticmethod
+    def _size(value):
+        # estimated size of a value in bytes, images are counted by their
+        # pixel buffer
+        if isinstance(value, sitk.Image):
+            return value.GetNumberOfPixels() * \
+                value.GetNumberOfComponentsPerPixel() * \
+                value.GetSizeOfPixelComponent()
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (list, tuple)):
+            return sys.getsizeof(value) + \
+                sum(sys.getsizeof(item) for item in value)
+        return sys.getsizeof(value)
+
+    def clear(self):
+        """ Remove all values, called when the database changed """
+        with self._lock:
+            self._values = OrderedDict()
+            self._bytes = 0
+            self._generation += 1
+
+    def __len__(self):
+        return len(self._values)
+
+
+class _Entry:
+    # builder and shared cache of a folder opened with the same options
+    def __init__(self, cache_bytes=None):
+        self.lock = threading.Lock()
+        self.builder = None
+        self.cache = SharedCache(max_bytes=cache_bytes)
+        self.scanned = None # time of the last scan
+        self.stale = False # scan at the next get, set by invalidate
+        self.watcher = None
+
+
+class DatabaseRegistry(sdtk.Logger):
+    """ Returns a Database for a folder that shares a single DatabaseBuilder,
+    sqlite connections (one per thread) and a SharedCache with all other
+    databases returned for the same folder and options. The folder is scanned
+    when it is opened for the first time and again when ttl seconds passed
+    since the last scan (None never scans again). With watch=True a
+    DatabaseWatcher keeps the database up to date instead. The cached values
+    of a folder use at most cache_bytes (least recently used values are
+    removed first, None does not limit the cache). """
+
+    _CACHE_BYTES = 2**30 # default memory budget of the cache of a folder
+
+    def __init__(self, ttl=60, watch=False, interval=2,
+                 cache_bytes=_CACHE_BYTES):
+        super().__init__()
+        self.ttl = ttl
+        self.watch = watch
+        self.interval = interval # poll interval of watchers
+        self.cache_bytes = cache_bytes
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    @staticmethod
+    def _key(path, kwargs):
+        # databases are shared for the same folder and options
+        path = os.path.abspath(path)
+        return (path, repr(sorted(kwargs.items())))
+
+    def get(self, path, **kwargs):
+        """ Return a new Database object for path, keyword arguments are
+        passed to Database. Each caller gets its own selection, the builder
+        and cached values are shared. """
+        if kwargs.get('in_memory'):
+            raise ValueError('In memory databases cannot be shared')
+
+        key = self._key(path, kwargs)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(self.cache_bytes)
+
+        with entry.lock:
+            if entry.builder is None:
+                database = sdtk.Database(path, thread_local=True, **kwargs)
+                entry.builder = database.builder
+                entry.scanned = time.time()
+                if self.watch:
+                    self._start_watcher(entry)
+            else:
+                self._refresh(entry)
+                database = sdtk.Database(path, builder=entry.builder,
+                                         **kwargs)
+
+        database._shared = entry.cache
+        return database
+
+    def _refresh(self, entry):
+        # scan the folder again when the ttl expired, a watcher keeps the
+        # database up to date otherwise
+        expired = entry.watcher is None and self.ttl is not None \
+            and time.time() - entry.scanned >= self.ttl
+        if not (expired or entry.stale):
+            return
+        self.logger.info('Scanning %s', entry.builder.path)
+        if entry.builder.rescan():
+            entry.cache.clear()
+        entry.scanned = time.time()
+        entry.stale = False
+
+    def _start_watcher(self, entry):
+        builder = entry.builder
+        entry.watcher = sdtk.DatabaseWatcher(
+            builder.path, database_file=builder.database_file,
+            interval=self.interval, **builder.options)
+        entry.watcher.subscribe(lambda event: entry.cache.clear())
+        entry.watcher.start()
+
+    def invalidate(self, path=None):
+        """ Scan the folders of path (all folders if path is None) at the
+        next get and clear their cached values """
+        path = None if path is None else os.path.abspath(path)
+        with self._lock:
+            entries = [entry for key, entry in self._entries.items() \
+                       if path is None or key[0] == path]
+        for entry in entries:
+            with entry.lock:
+                entry.stale = True
+                entry.cache.clear()
+
+    def clear(self):
+        """ Stop all watchers and remove all entries """
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries = {}
+        for entry in entries:
+            if entry.watcher is not None:
+                entry.watcher.stop()
+
+
+# registry used by get_database
+default_registry = DatabaseRegistry()
+
+def get_database(path, **kwargs):
+    """ Return a Database for path from the process wide registry, see
+    DatabaseRegistry.get """
+    return default_registry.get(path, **kwargs)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Codecs that convert encoded dicom values to values stored in the database.
+"""
+import json
+import zlib
+import struct
+import numbers
+
+
+class JSONCodec():
+    """ Store every value as json text. Default codec, used by all databases
+    created by older versions. """
+    NAME = 'json'
+    COLUMN_TYPE = 'TEXT'
+
+    @staticmethod
+    def dumps(value):
+        """ Convert a single value (or a list of values) to a stored value """
+        return json.dumps(value)
+
+    @staticmethod
+    def loads(value):
+        """ Convert a stored single value back """
+        return json.loads(value)
+
+    @staticmethod
+    def pack(values):
+        """ Convert a list of stored values (multiple values or the datasets
+        of a sequence) to a single stored value """
+        return json.dumps(values)
+
+    @staticmethod
+    def unpack(value):
+        """ Return the list of stored values from a packed value """
+        return json.loads(value)
+
+    @staticmethod
+    def is_packed(value):
+        """ Return True if the stored value contains multiple values """
+        try:
+            return isinstance(json.loads(value), list)
+        except:
+            return False
+
+
+class BinaryCodec():
+    """ Store single values as native sqlite values (INTEGER, REAL, TEXT) and
+    multiple values and sequences as compact binary BLOBs. Blobs larger than
+    ZLIB_SIZE bytes are compressed with zlib. Numbers are compared and sorted
+    as numbers by sqlite and decoding does not need json. """
+    NAME = 'binary'
+    COLUMN_TYPE = 'BLOB' # no type affinity, values are stored as given
+
+    ZLIB_SIZE = 256
+
+    # first byte of a blob
+    _RAW = b'\x00'
+    _ZLIB = b'\x01'
+
+    # type codes of packed values
+    _NONE = b'N'
+    _INT = b'i'
+    _BIG_INT = b'I' # integers outside the 64 bit range, stored as text
+    _FLOAT = b'd'
+    _STR = b's'
+    _BYTES = b'b'
+    _LIST = b'l'
+    _DICT = b'm'
+
+    _LENGTH = struct.Struct('<I')
+    _INT64 = struct.Struct('<q')
+    _DOUBLE = struct.Struct('<d')
+
+    @staticmethod
+    def dumps(value):
+        """ Convert a single value (or a list of values) to a stored value """
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return str(value)
+        if isinstance(value, numbers.Integral):
+            value = int(value)
+            return value if BinaryCodec._is_int64(value) else str(value)
+        if isinstance(value, numbers.Real):
+            return float(value)
+        if isinstance(value, (list, tuple)):
+            return BinaryCodec.pack([BinaryCodec.dumps(vi) for vi in value])
+        msg = 'Object of type {0} cannot be encoded'
+        raise TypeError(msg.format(type(value).__name__))
+
+    @staticmethod
+    def loads(value):
+        """ Convert a stored single value back """
+        return value
+
+    @staticmethod
+    def pack(values):
+        """ Convert a list of stored values (multiple values or the datasets
+        of a sequence) to a single blob """
+        data = BinaryCodec._pack_value(values)
+        if len(data) > BinaryCodec.ZLIB_SIZE:
+            return BinaryCodec._ZLIB + zlib.compress(data)
+        return BinaryCodec._RAW + data
+
+    @staticmethod
+    def unpack(value):
+        """ Return the list of stored values from a blob """
+        value = bytes(value)
+        data = value[1:]
+        if value[:1] == BinaryCodec._ZLIB:
+            data = zlib.decompress(data)
+        return BinaryCodec._unpack_value(data, 0)[0]
+
+    @staticmethod
+    def is_packed(value):
+        """ Return True if the stored value contains multiple values """
+        return isinstance(value, (bytes, memoryview))
+
+    @staticmethod
+    def _is_int64(value):
+        return -2**63 <= value < 2**63
+
+    @staticmethod
+    def _pack_value(value):
+        # type code followed by the value
+        pack_length = BinaryCodec._LENGTH.pack
+        if value is None:
+            return BinaryCodec._NONE
+        if isinstance(value, int):
+            if BinaryCodec._is_int64(value):
+                return BinaryCodec._INT + BinaryCodec._INT64.pack(value)
+            data = str(value).encode()
+            return BinaryCodec._BIG_INT + pack_length(len(data)) + data
+        if isinstance(value, float):
+            return BinaryCodec._FLOAT + BinaryCodec._DOUBLE.pack(value)
+        if isinstance(value, str):
+            data = value.encode('utf-8')
+            return BinaryCodec._STR + pack_length(len(data)) + data
+        if isinstance(value, (bytes, memoryview)):
+            data = bytes(value)
+            return BinaryCodec._BYTES + pack_length(len(data)) + data
+        if isinstance(value, (list, tuple)):
+            items = [BinaryCodec._pack_value(vi) for vi in value]
+            return BinaryCodec._LIST + pack_length(len(items)) + b''.join(items)
+        if isinstance(value, dict):
+            items = [BinaryCodec._pack_value(str(key)) + \
+                     BinaryCodec._pack_value(vi) for key, vi in value.items()]
+            return BinaryCodec._DICT + pack_length(len(items)) + b''.join(items)
+        msg = 'Object of type {0} cannot be packed'
+        raise TypeError(msg.format(type(value).__name__))
+
+    @staticmethod
+    def _unpack_value(data, offset):
+        # return value and offset of the next value
+        code = data[offset:offset + 1]
+        offset += 1
+        if code == BinaryCodec._NONE:
+            return None, offset
+        if code == BinaryCodec._INT:
+            return BinaryCodec._INT64.unpack_from(data, offset)[0], offset + 8
+        if code == BinaryCodec._FLOAT:
+            return BinaryCodec._DOUBLE.unpack_from(data, offset)[0], offset + 8
+
+        length = BinaryCodec._LENGTH.unpack_from(data, offset)[0]
+        offset += 4
+        if code in (BinaryCodec._STR, BinaryCodec._BIG_INT):
+            value = data[offset:offset + length].decode('utf-8')
+            if code == BinaryCodec._BIG_INT:
+                value = int(value)
+            return value, offset + length
+        if code == BinaryCodec._BYTES:
+            return data[offset:offset + length], offset + length
+        if code == BinaryCodec._LIST:
+            values = []
+            for _ in range(length):
+                value, offset = BinaryCodec._unpack_value(data, offset)
+                values.append(value)
+            return values, offset
+        if code == BinaryCodec._DICT:
+            values = {}
+            for _ in range(length):
+                key, offset = BinaryCodec._unpack_value(data, offset)
+                values[key], offset = BinaryCodec._unpack_value(data, offset)
+            return values, offset
+        raise ValueError('Invalid type code {0} in packed value'.format(code))
+
+
+CODECS = {codec.NAME: codec for codec in (JSONCodec, BinaryCodec)}
+
+
+def get_codec(name=None):
+    """ Return the codec for name, JSONCodec if name is None """
+    if name is None:
+        return JSONCodec
+    if name not in CODECS:
+        msg = 'Unknown codec {0}, use one of {1}'
+        raise ValueError(msg.format(name, list(CODECS.keys())))
+    return CODECS[name]
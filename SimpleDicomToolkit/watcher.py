@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Keep a database up to date with the files in its folder.
+"""
+import os
+import time
+import logging
+import threading
+from collections import namedtuple
+
+import SimpleDicomToolkit as sdtk
+from SimpleDicomToolkit.DicomDatabaseSQL import DatabaseBuilder
+
+
+# published to subscribers after files were added to, removed from or updated
+# in the database. Files are relative to the root path of the database.
+WatchEvent = namedtuple('WatchEvent', ['added', 'removed', 'updated'])
+
+
+class DatabaseWatcher(sdtk.Logger):
+    """ Poll the folder of a database in a background thread. New files are
+    added in small batches and removed files are deleted from the database.
+    After each change a WatchEvent is published to all subscribers.
+
+    Only folders with a changed modification time are scanned again, the
+    folder tree is walked completely only once when the watcher starts. The
+    file rules, DICOMDIR indexing, max_depth and follow_symlinks options of
+    the builder are applied as by a scan of the builder. """
+
+    _ROOT = '' # relative name of the root folder
+
+    def __init__(self, path, database_file=None, interval=2, batch_size=100,
+                 silent=True, **kwargs):
+        """
+        Watch the folder path of a database
+
+        path:           root folder of the database
+        database_file:  database file, defaults to the database in path
+        interval:       seconds between two polls
+        batch_size:     number of files inserted before an event is published
+
+        Additional keyword arguments are passed to DatabaseBuilder.
+        """
+        if silent:
+            self._LOG_LEVEL = logging.ERROR
+
+        super().__init__()
+
+        self.builder = DatabaseBuilder(path=path, database_file=database_file,
+                                       scan=False, silent=silent, **kwargs)
+
+        if self.builder.database.in_memory:
+            raise ValueError('In memory databases cannot be watched')
+
+        self.path = self.builder.path
+        self.interval = interval
+        self.batch_size = batch_size
+
+        # files of the database itself (including -wal and -shm files) and
+        # the preview folder
+        self._ignore = os.path.basename(self.builder.database_file)
+
+        self._subscribers = []
+        self._folders = {} # relative folder --> modification time
+        self._real_paths = {} # relative folder --> real path (symlinks)
+        self._files = {} # relative folder --> set of relative files
+        self._last_poll = None
+        # changes found by a scan that are not in the database yet, kept
+        # until they were stored so a failed poll is retried
+        self._added = set()
+        self._removed = set()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        """ True if the watcher thread is running """
+        return self._thread is not None and self._thread.is_alive()
+
+    def subscribe(self, callback):
+        """ Call callback with a WatchEvent after each change """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """ Stop calling callback after changes """
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def start(self):
+        """ Start watching in a background thread """
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='DatabaseWatcher')
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Stop the background thread """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def poll(self):
+        """ Update the database with the changes since the previous poll.
+        The first poll scans the entire folder tree. """
+        poll_time = time.time()
+        if self._last_poll is None:
+            added, removed = self._scan_all()
+        else:
+            added, removed = self._scan_changed(self._last_poll)
+        self._added = self._added.difference(removed).union(added)
+        self._removed = self._removed.difference(added).union(removed)
+
+        removed = sorted(self._removed)
+        if removed:
+            self.logger.info('Removing %i files', len(removed))
+            # duplicates of removed instances replace the removed files
+            self._added.update(self.builder.remove_files(removed))
+            self._removed.clear()
+            self._publish(WatchEvent(added=[], removed=removed, updated=[]))
+
+        added = []
+        if self._added:
+            # files added in the meantime by another builder (e.g. a rescan)
+            existing = set(self.builder.files)
+            added = sorted(file for file in self._added \
+                           if file not in existing)
+            self._added.clear()
+            self._added.update(added)
+
+        added, rejected = sdtk.FileScanner.filter_files(
+            added, folder=self.path, **self.builder.file_rules)
+        if rejected:
+            self.builder._record_rejected(rejected)
+            self._added.difference_update(rejected)
+
+        if self.builder.dicomdir:
+            # files referenced by a DICOMDIR are indexed from its records
+            remaining = self.builder._index_dicomdirs(added)
+            indexed = [file for file in added if file not in set(remaining)]
+            added = remaining
+            self._added.difference_update(indexed)
+            if indexed:
+                self._publish(WatchEvent(added=indexed, removed=[],
+                                         updated=[]))
+
+        for batch in self.builder.chunks(added, self.batch_size):
+            self.logger.info('Adding %i files', len(batch))
+            self.builder.insert_files(batch, silent=True)
+            self._added.difference_update(batch)
+            self._publish(WatchEvent(added=batch, removed=[], updated=[]))
+
+        if added or removed:
+            self.builder.checkpoint()
+        self._last_poll = poll_time
+
+        # read full headers of files indexed from a DICOMDIR in the background
+        updated = self.builder.parse_pending(limit=self.batch_size)
+        if updated:
+            self.logger.info('Read %i pending files', len(updated))
+            self._publish(WatchEvent(added=[], removed=[], updated=updated))
+
+        return added, removed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception:
+                self.logger.exception('Updating database failed')
+            self._stop.wait(self.interval)
+
+    def _publish(self, event):
+        for callback in list(self._subscribers):
+            try:
+                callback(event)
+            except Exception:
+                self.logger.exception('Subscriber failed for %s', event)
+
+    def _scan_all(self):
+        # walk the entire tree and compare with the files in the database
+        self._added = set()
+        self._removed = set()
+        self._folders = {}
+        self._real_paths = {}
+        self._files = {}
+        self._scan_folder(self._ROOT)
+
+        files = set()
+        for folder_files in self._files.values():
+            files.update(folder_files)
+        return sdtk.FileScanner.compare(files, self.builder.files)
+
+    def _scan_changed(self, last_poll):
+        # rescan only folders that were modified after the previous poll.
+        # Folders modified shortly before the previous poll are scanned again
+        # because file systems may have a coarse modification time.
+        added, removed = [], []
+        for folder, mtime in list(self._folders.items()):
+            if folder not in self._folders:
+                continue # removed while scanning parent folder
+            try:
+                new_mtime = os.stat(self._full_path(folder)).st_mtime
+            except FileNotFoundError:
+                removed += self._forget_tree(folder)
+                continue
+
+            if new_mtime != mtime or new_mtime >= last_poll - 1:
+                new_files, removed_files = self._scan_folder(folder)
+                added += new_files
+                removed += removed_files
+        return added, removed
+
+    def _scan_folder(self, folder):
+        # scan a single folder, new sub folders are scanned recursively.
+        # Returns new and removed files relative to the root path.
+        try:
+            mtime = os.stat(self._full_path(folder)).st_mtime
+            entries = list(os.scandir(self._full_path(folder)))
+        except FileNotFoundError:
+            return [], self._forget_tree(folder)
+
+        self._folders[folder] = mtime
+
+        files = set()
+        sub_folders = set()
+        follow_symlinks = self.builder.follow_symlinks
+        max_depth = self.builder.max_depth
+        for entry in entries:
+            name = os.path.join(folder, entry.name)
+            if folder == self._ROOT and entry.name.startswith(self._ignore):
+                continue # database, journal files and preview folder
+            if entry.is_dir(follow_symlinks=follow_symlinks):
+                if max_depth is None or self._depth(name) <= max_depth:
+                    sub_folders.add(name)
+            elif not entry.is_dir(): # links to folders are skipped
+                files.add(name)
+
+        known = self._files.get(folder, set())
+        self._files[folder] = files
+
+        new_files = list(files.difference(known))
+        removed_files = list(known.difference(files))
+
+        for sub_folder in sub_folders:
+            if sub_folder not in self._folders and \
+                not self._is_visited(sub_folder):
+                new_files += self._scan_folder(sub_folder)[0]
+
+        for sub_folder in self._sub_folders(folder):
+            if sub_folder not in sub_folders:
+                removed_files += self._forget_tree(sub_folder)
+
+        return new_files, removed_files
+
+    @staticmethod
+    def _depth(folder):
+        # number of sub folder levels below the root folder
+        return len(os.path.normpath(folder).split(os.sep))
+
+    def _is_visited(self, folder):
+        # links to folders are followed once, links can form loops
+        if not self.builder.follow_symlinks:
+            return False
+        real_path = os.path.realpath(self._full_path(folder))
+        if real_path == os.path.realpath(self.path) or \
+            real_path in self._real_paths.values():
+            return True
+        self._real_paths[folder] = real_path
+        return False
+
+    def _sub_folders(self, folder):
+        # direct sub folders of folder that are being watched
+        return [sub for sub in self._folders \
+                if sub != folder and os.path.dirname(sub) == folder]
+
+    def _forget_tree(self, folder):
+        # stop watching folder and its sub folders, return their files
+        removed = []
+        prefix = os.path.join(folder, '')
+        for sub in list(self._folders.keys()):
+            if sub == folder or folder == self._ROOT or sub.startswith(prefix):
+                self._folders.pop(sub, None)
+                self._real_paths.pop(sub, None)
+                removed += list(self._files.pop(sub, set()))
+        return removed
+
+    def _full_path(self, folder):
+        return os.path.join(self.path, folder)
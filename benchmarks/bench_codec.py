@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the JSON and the binary value codec.
+
+The test files of pydicom are copied to sub folders of a temporary folder and
+a database is built with each codec. Build time, size of the database file,
+the time to decode all rows and the time to encode the headers are printed,
+and the decoded rows of both databases are compared.
+
+    PYTHONPATH=. python benchmarks/bench_codec.py --copies 5
+"""
+import argparse
+import os
+import tempfile
+import time
+import warnings
+
+import pydicom
+from pydicom.data import get_testdata_files
+
+import SimpleDicomToolkit as sdtk
+from SimpleDicomToolkit.DicomDatabaseSQL import DatabaseBuilder
+
+from bench_tags import copy_testdata
+
+
+def read_headers():
+    headers = []
+    for file in get_testdata_files('*.dcm'):
+        try:
+            headers.append(pydicom.dcmread(file, stop_before_pixels=True))
+        except Exception:
+            pass
+    return headers
+
+
+def encode_time(headers, codec, rounds=3):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for header in headers:
+            try:
+                sdtk.Encoder.encode(header, codec=codec)
+            except Exception:
+                pass
+    return time.perf_counter() - start
+
+
+def same_value(value, other):
+    # sequences of a codec may differ in type but not in value
+    if isinstance(value, list) and isinstance(other, list):
+        return len(value) == len(other) and \
+            all(str(v) == str(o) for v, o in zip(value, other))
+    return value == other
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--copies', type=int, default=5)
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    headers = read_headers()
+    rows = {}
+    with tempfile.TemporaryDirectory() as root:
+        folder = os.path.join(root, 'dicom')
+        print('{0} files'.format(copy_testdata(folder, args.copies)))
+        for codec in (sdtk.JSONCodec, sdtk.BinaryCodec):
+            file = os.path.join(root, codec.NAME + '.db')
+            start = time.perf_counter()
+            DatabaseBuilder(folder, database_file=file, silent=True,
+                            codec=codec.NAME).database.close()
+            t_build = time.perf_counter() - start
+
+            database = sdtk.Database(file, scan=False, silent=True)
+            start = time.perf_counter()
+            rows[codec.NAME] = list(database.iter_rows(
+                sort_by=database.builder.FILENAME_COL))
+            t_decode = time.perf_counter() - start
+
+            print('{0}: build {1:.1f} s, {2} kB, decode {3} rows {4:.2f} s, '
+                  'encode {5:.2f} s'.format(
+                      codec.NAME, t_build, os.path.getsize(file) // 1024,
+                      len(rows[codec.NAME]), t_decode,
+                      encode_time(headers, codec)))
+
+    json_rows, binary_rows = rows[sdtk.JSONCodec.NAME], \
+        rows[sdtk.BinaryCodec.NAME]
+    assert len(json_rows) == len(binary_rows)
+    diffs = sum(not same_value(value, other.get(tag))
+                for row, other in zip(json_rows, binary_rows)
+                for tag, value in row.items())
+    print('{0} values differ'.format(diffs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of Database.decoded_array against Database.array.
+
+Series with the transfer syntaxes of the pydicom test files (uncompressed,
+RLE, JPEG lossless, JPEG-LS and JPEG 2000) are written to a temporary folder,
+together with a multi frame RLE file. Each is read with array (SimpleITK)
+and with decoded_array for a number of workers, results are compared.
+
+    PYTHONPATH=. python benchmarks/bench_decode.py --slices 40 --workers 1 2 4
+"""
+import argparse
+import copy
+import os
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pydicom
+from pydicom.data import get_testdata_files
+from pydicom.encaps import encapsulate, generate_pixel_data_frame
+
+import SimpleDicomToolkit as sdtk
+
+SERIES = {'uncompressed': 'MR_small.dcm',
+          'rle': 'MR_small_RLE.dcm',
+          'jpeg lossless': 'JPEG-LL.dcm',
+          'jpeg-ls': 'MR_small_jpeg_ls_lossless.dcm',
+          'jpeg 2000': 'MR_small_jp2klossless.dcm'}
+
+MULTI_FRAME = 'emri_small_RLE.dcm'
+
+
+def write_series(folder, source, slices):
+    base = pydicom.dcmread(get_testdata_files(source)[0])
+    series = pydicom.uid.generate_uid()
+    os.makedirs(folder)
+    for index in range(slices):
+        ds = copy.deepcopy(base)
+        ds.SeriesInstanceUID = series
+        ds.SOPInstanceUID = pydicom.uid.generate_uid()
+        ds.InstanceNumber = index + 1
+        ds.SliceLocation = float(index)
+        ds.ImagePositionPatient = [0, 0, float(index)]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.save_as(os.path.join(folder, '{0:03d}.dcm'.format(index)))
+
+
+def write_multi_frame(folder, repeat):
+    # repeat the frames of a multi frame RLE file
+    ds = pydicom.dcmread(get_testdata_files(MULTI_FRAME)[0])
+    frames = list(generate_pixel_data_frame(ds.PixelData,
+                                            int(ds.NumberOfFrames)))
+    ds.PixelData = encapsulate(frames * repeat)
+    ds.NumberOfFrames = len(frames) * repeat
+    os.makedirs(folder)
+    ds.save_as(os.path.join(folder, 'multi_frame.dcm'))
+    return ds.NumberOfFrames
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench(name, folder, workers):
+    database = sdtk.Database(folder, silent=True, in_memory=True)
+    reference, t_array = timed(lambda: database.array)
+    line = '{0:<24} array {1:.3f} s'.format(name, t_array)
+    for count in workers:
+        database.reset()
+        array, t_decoded = timed(database.decoded_array, workers=count)
+        assert np.allclose(array, reference)
+        line += ', {0} workers {1:.3f} s'.format(count, t_decoded)
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--slices', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=40,
+                        help='repetitions of the multi frame RLE frames')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    with tempfile.TemporaryDirectory() as root:
+        for name, source in SERIES.items():
+            folder = os.path.join(root, name.replace(' ', '_'))
+            write_series(folder, source, args.slices)
+            bench(name, folder, args.workers)
+
+        folder = os.path.join(root, 'multi_frame')
+        frames = write_multi_frame(folder, args.repeat)
+        bench('rle {0} frames'.format(frames), folder, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the serial and the concurrent folder scan of FileScanner.
+
+A synthetic tree of empty files is created in a temporary folder. Latency of
+a network share is emulated by a sleep in each directory listing.
+
+    PYTHONPATH=. python benchmarks/bench_scan.py --latency 0 0.002 0.01
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from SimpleDicomToolkit.file_scanner import FileScanner
+
+
+def make_tree(folder, files=5, folders=3, depth=6):
+    # files per folder and folders per folder, depth levels of sub folders
+    os.makedirs(folder, exist_ok=True)
+    for index in range(files):
+        open(os.path.join(folder, 'f{0}.dcm'.format(index)), 'w').close()
+    if depth > 0:
+        for index in range(folders):
+            make_tree(os.path.join(folder, 'd{0}'.format(index)),
+                      files=files, folders=folders, depth=depth - 1)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--latency', type=float, nargs='+', default=[0],
+                        help='seconds added to each directory listing')
+    args = parser.parse_args()
+
+    scandir = os.scandir
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, depth=args.depth)
+        for latency in args.latency:
+            def slow_scandir(path='.'):
+                time.sleep(latency)
+                return scandir(path)
+            os.scandir = slow_scandir
+            try:
+                serial, t_serial = timed(FileScanner.files_in_folder, root,
+                                         recursive=True)
+                parallel, t_parallel = timed(FileScanner.files_in_folder,
+                                             root, recursive=True,
+                                             workers=args.workers)
+            finally:
+                os.scandir = scandir
+            assert sorted(serial) == sorted(parallel)
+            print('latency {0:.3f} s: {1} files, serial {2:.2f} s, '
+                  '{3} workers {4:.2f} s'.format(latency, len(serial),
+                                                 t_serial, args.workers,
+                                                 t_parallel))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of a database build with all tags against a tag whitelist.
+
+The test files of pydicom are copied to sub folders of a temporary folder.
+Build time, size of the database file and the number of columns of the main
+table are printed.
+
+    PYTHONPATH=. python benchmarks/bench_tags.py --copies 30
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import warnings
+
+from pydicom.data import get_testdata_files
+
+from SimpleDicomToolkit.DicomDatabaseSQL import DatabaseBuilder
+
+TAGS = ['PatientName', 'StudyDescription', 'SeriesDescription', 'StudyDate']
+
+
+def copy_testdata(folder, copies):
+    files = get_testdata_files('*.dcm')
+    for index in range(copies):
+        copy_folder = os.path.join(folder, str(index))
+        os.makedirs(copy_folder)
+        for file in files:
+            shutil.copy(file, copy_folder)
+    return len(files) * copies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--copies', type=int, default=10)
+    parser.add_argument('--tags', nargs='+', default=TAGS)
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    with tempfile.TemporaryDirectory() as root:
+        folder = os.path.join(root, 'dicom')
+        print('{0} files'.format(copy_testdata(folder, args.copies)))
+        for name, tags in (('all tags', None), ('whitelist', args.tags)):
+            file = os.path.join(root, name.replace(' ', '_') + '.db')
+            start = time.perf_counter()
+            builder = DatabaseBuilder(folder, database_file=file, silent=True,
+                                      tags=tags)
+            elapsed = time.perf_counter() - start
+            columns = builder.database.column_names(builder.MAIN_TABLE)
+            print('{0}: {1:.1f} s, {2} kB, {3} columns'.format(
+                name, elapsed, os.path.getsize(file) // 1024, len(columns)))
+            builder.database.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Memory behaviour of Database.array_view and Database.get_array: views keep
+their image alive and keep_image=False keeps a single copy of the pixel data.
+"""
+import gc
+import os
+import weakref
+
+import numpy as np
+import pydicom
+import pytest
+from pydicom.dataset import Dataset, FileDataset
+
+import SimpleDicomToolkit as sdtk
+
+CT_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.2'
+
+
+def write_series(folder, slices=8, size=64):
+    # write a small CT series with explicit VR little endian pixel data
+    uid = pydicom.uid.generate_uid
+    study, series, frame = uid(), uid(), uid()
+    for index in range(slices):
+        meta = Dataset()
+        meta.MediaStorageSOPClassUID = CT_IMAGE_STORAGE
+        meta.MediaStorageSOPInstanceUID = uid()
+        meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+        meta.ImplementationClassUID = uid()
+
+        file = os.path.join(folder, 'slice{0:02d}.dcm'.format(index))
+        ds = FileDataset(file, {}, file_meta=meta, preamble=b'\0' * 128)
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+        ds.SOPClassUID = CT_IMAGE_STORAGE
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.PatientID = 'MEMORY'
+        ds.Modality = 'CT'
+        ds.StudyInstanceUID = study
+        ds.SeriesInstanceUID = series
+        ds.FrameOfReferenceUID = frame
+        ds.InstanceNumber = index + 1
+        ds.SliceLocation = float(index)
+        ds.ImagePositionPatient = [0, 0, index]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [1, 1]
+        ds.SliceThickness = 1
+        ds.Rows = ds.Columns = size
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.BitsAllocated = ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.RescaleSlope = 1
+        ds.RescaleIntercept = 0
+        pixels = np.arange(size * size, dtype=np.int16) + index
+        ds.PixelData = pixels.tobytes()
+        ds.save_as(file, write_like_original=False)
+
+
+@pytest.fixture
+def database(tmp_path):
+    write_series(str(tmp_path))
+    return sdtk.Database(str(tmp_path), silent=True, SUV=False,
+                         in_memory=True)
+
+
+def test_view_keeps_image_alive(database):
+    view = database.array_view
+    expected = np.array(view)
+    image = weakref.ref(view.image)
+
+    # clearing the cache and deleting the database does not free the image
+    database.reset()
+    del database
+    gc.collect()
+    assert image() is not None
+    assert np.array_equal(view, expected)
+
+    # slices of the view keep the image as well
+    part = view[2:4]
+    del view
+    gc.collect()
+    assert image() is not None
+    assert np.array_equal(part, expected[2:4])
+
+    del part
+    gc.collect()
+    assert image() is None
+
+
+def test_view_without_copy(database):
+    view = database.array_view
+    assert not view.flags.writeable
+    assert view.image is database.image
+    assert not np.shares_memory(database.array, view)
+
+
+def test_keep_image_false_holds_one_copy(database):
+    array = database.get_array(keep_image=False)
+    assert database._image is None
+
+    # the view is the only owner of the pixel data of the image
+    image = weakref.ref(array.image)
+    assert np.array_equal(array, database.array)
+    database.reset()
+    gc.collect()
+    assert image() is not None
+    del array
+    gc.collect()
+    assert image() is None
+
+
+def test_keep_image_false_copy_releases_image(database):
+    array = database.get_array(view=False, keep_image=False)
+    assert database._image is None
+    assert array.flags.owndata
+    assert not isinstance(array, sdtk.dicom_reader.ImageArray)